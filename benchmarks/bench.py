@@ -0,0 +1,194 @@
+"""Throughput benchmarks against the local fake server.
+
+Run the commands end to end (each in its own process, against a
+fresh SQLite database)::
+
+    python benchmarks/bench.py run --pubs 500 --latency 0.05 --concurrency 4
+
+or micro-benchmark parsing EFetch XML::
+
+    python benchmarks/bench.py parse --articles 10000
+
+or the in-memory citation graph queries (citations.graph)::
+
+    python benchmarks/bench.py graph --edges 5000000
+"""
+
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakeserver import (  # noqa: E402 pylint: disable=wrong-import-position
+    FakeServer,
+    World,
+    article_set,
+    pub_pmid,
+    synthetic_article,
+)
+
+EMAIL = "bench@example.com"
+
+
+def count(dbfile: str, table: str) -> int:
+    with sqlite3.connect(dbfile) as con:
+        try:
+            return con.execute(f"select count(*) from {table}").fetchone()[0]
+        except sqlite3.OperationalError:
+            return 0
+
+
+def run_command(args: List[str], env: dict, quiet: bool = True):
+    """Run ``citations args`` and return (seconds, peak RSS in MB, exit status)."""
+    start = time.perf_counter()
+    with open(os.devnull, "wb") as devnull:
+        p = subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, "-m", "citations", *args],
+            env=env,
+            stdout=devnull if quiet else None,
+            stderr=devnull if quiet else None,
+        )
+        _, status, rusage = os.wait4(p.pid, 0)
+        p.returncode = status
+    # ru_maxrss is in KB on Linux
+    return time.perf_counter() - start, rusage.ru_maxrss / 1024, status
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option("--pubs", default=200, help="number of publications", show_default=True)
+@click.option("--citers", default=5000, help="pool of citing papers", show_default=True)
+@click.option("--latency", default=0.0, help="mean server latency (seconds)")
+@click.option("--error-rate", default=0.0, help="fraction of 500 responses")
+@click.option("--rate-429", default=0.0, help="fraction of 429 responses")
+@click.option("--concurrency", default=4, show_default=True)
+@click.option("--keep", type=click.Path(file_okay=False), help="keep the database here")
+@click.option("-v", "--verbose", is_flag=True, help="show command output")
+def run(pubs, citers, latency, error_rate, rate_429, concurrency, keep, verbose):
+    """Run add-publications, scan, ncbi-json and ncbi-metadata."""
+    srv = FakeServer(
+        latency=latency,
+        error_rate=error_rate,
+        rate_429=rate_429,
+        world=World(citers=citers),
+    ).start()
+    workdir = keep or tempfile.mkdtemp(prefix="citations-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    dbfile = os.path.join(workdir, "bench.db")
+    env = dict(os.environ, CITATIONS_DB=f"sqlite:///{dbfile}", **srv.env())
+    env.pop("NCBI_API_KEY", None)
+
+    # start fast: the governors still back off on 429/5xx
+    fast = ["--sleep", "0.001"]
+    conc = ["--concurrency", str(concurrency)]
+    steps = [
+        (
+            "add-publications",
+            [*fast, EMAIL, *[pub_pmid(i) for i in range(pubs)]],
+            "publications",
+        ),
+        ("scan", [*fast, *conc, "--no-sync"], "citations"),
+        ("ncbi-json", [*fast, *conc, "--no-email", EMAIL], "ncbi_meta"),
+        ("ncbi-metadata", [*fast, *conc, "--no-email", EMAIL], "metadata"),
+    ]
+    click.echo(
+        f"{'command':<18}{'records':>9}{'secs':>9}{'records/s':>11}"
+        f"{'requests':>10}{'req/s':>9}{'peak MB':>9}"
+    )
+    for name, args, table in steps:
+        before, nreq = count(dbfile, table), srv.stats.total
+        secs, rss, status = run_command(
+            ["--no-cache", name, *args], env, quiet=not verbose
+        )
+        records = count(dbfile, table) - before
+        requests = srv.stats.total - nreq
+        click.echo(
+            f"{name:<18}{records:>9}{secs:>9.2f}{records / secs:>11.1f}"
+            f"{requests:>10}{requests / secs:>9.1f}{rss:>9.0f}"
+            + ("" if status == 0 else click.style(f"  exit {status}", fg="red"))
+        )
+    click.echo(
+        f"server: {srv.stats.total} requests, {srv.stats.errors} errors,"
+        f" {srv.stats.throttled} throttled"
+    )
+    if keep:
+        click.echo(f"database kept in {dbfile}")
+    srv.shutdown()
+
+
+@cli.command()
+@click.option("--articles", default=5000, help="articles in the XML", show_default=True)
+@click.option("--repeat", default=3, show_default=True)
+@click.option("--fixture", type=click.Path(dir_okay=False), help="EFetch XML to parse")
+def parse(articles: int, repeat: int, fixture: Optional[str]):
+    """Micro-benchmark parsing EFetch XML (ncbi.parse_pubmed)."""
+    from citations.ncbi import parse_pubmed
+
+    if fixture:
+        with open(fixture, "rb") as fp:
+            content = fp.read()
+    else:
+        content = article_set([synthetic_article(pub_pmid(i)) for i in range(articles)])
+    mb = len(content) / 1e6
+    click.echo(f"{mb:.1f}MB of XML")
+    for full in [True, False]:
+        best = float("inf")
+        n = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            n = sum(1 for _ in parse_pubmed(content, full=full))
+            best = min(best, time.perf_counter() - start)
+        click.echo(
+            f"full={full!s:<5} {n} records in {best:.3f}s:"
+            f" {n / best:.0f} records/s, {mb / best:.1f}MB/s"
+        )
+
+
+@cli.command()
+@click.option("--edges", default=2_000_000, help="citations", show_default=True)
+@click.option("--cited", default=20_000, help="our publications", show_default=True)
+@click.option("--citing", default=500_000, help="citing papers", show_default=True)
+@click.option("--seed", default=1, show_default=True)
+def graph(edges: int, cited: int, citing: int, seed: int):
+    """Micro-benchmark building and querying the citation graph."""
+    import resource
+
+    import numpy as np
+
+    from citations.graph import CitationGraph
+
+    rng = np.random.default_rng(seed)
+    # a few publications collect most of the citations
+    doi_id = (rng.pareto(1.5, edges) * cited / 20).astype(np.int64) % cited
+    citedby_id = cited + rng.integers(0, citing, edges)
+
+    def timed(name, f):
+        start = time.perf_counter()
+        ret = f()
+        click.echo(f"{name:<24}{time.perf_counter() - start:>8.3f}s")
+        return ret
+
+    g = timed("build", lambda: CitationGraph(doi_id, citedby_id))
+    top = int(np.bincount(doi_id).argmax())
+    timed("cocited (top paper)", lambda: g.cocited(top))
+    timed("coupled", lambda: g.coupled(int(citedby_id[0])))
+    timed("multi_citers", g.multi_citers)
+    timed("top_citers", g.top_citers)
+    timed("cocited_pairs", g.cocited_pairs)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    click.echo(f"{g.nedges} edges, peak RSS {rss:.0f}MB")
+
+
+if __name__ == "__main__":
+    cli()
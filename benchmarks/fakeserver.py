@@ -0,0 +1,347 @@
+"""Local stand-in for the NCBI E-utilities, OpenCitations and Crossref APIs.
+
+Serves a synthetic (deterministic) world of publications, citing papers
+and PubMed records, optionally overlaid with recorded responses, with
+configurable latency, error rate and 429 injection::
+
+    python benchmarks/fakeserver.py --port 8765 --latency 0.05 --error-rate 0.01
+
+then point citations at it::
+
+    export CITATIONS_EUTILS=http://127.0.0.1:8765/entrez/eutils
+    export CITATIONS_OPENCITATIONS=http://127.0.0.1:8765/oc/
+    export CITATIONS_CROSSREF=http://127.0.0.1:8765/crossref/works/
+    export CITATIONS_MAX_RATE=1000
+
+Recorded responses (``--fixtures DIR``) are read from ``DIR/pubmed/*.xml``
+(EFetch output; each PubmedArticle is served by its PMID) and
+``DIR/opencitations/*.json`` (named by DOI with "/" replaced by "_").
+"""
+
+import json
+import os
+import random
+import re
+import threading
+import time
+from glob import glob
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+import click
+
+PREFIX = "10.5555"
+PUB_PMID = 10_000_000
+CITE_PMID = 20_000_000
+ARTICLE = re.compile(rb"<PubmedArticle>.*?</PubmedArticle>", re.S)
+PMID = re.compile(rb"<PMID[^>]*>(\d+)</PMID>")
+DOI_TERM = re.compile(r'"([^"]+)"\[DOI\]')
+
+
+def pub_doi(i: int) -> str:
+    return f"{PREFIX}/pub.{i}"
+
+
+def pub_pmid(i: int) -> str:
+    return str(PUB_PMID + i)
+
+
+class World:
+    """The synthetic bibliography.
+
+    Publication ``i`` (DOI 10.5555/pub.i, PMID 10000000+i) is cited
+    ``i % max_citations`` times by papers 10.5555/cite.j drawn from a
+    pool of ``citers`` so that citers are shared between publications.
+    One in ten citing papers isn't in PubMed.
+    """
+
+    def __init__(self, citers: int = 5000, max_citations: int = 25, seed: int = 1):
+        self.citers = citers
+        self.max_citations = max_citations
+        self.seed = seed
+        self.articles: Dict[str, bytes] = {}
+        self.opencitations: Dict[str, bytes] = {}
+
+    def load(self, fixtures: str):
+        for fname in glob(os.path.join(fixtures, "pubmed", "*.xml")):
+            with open(fname, "rb") as fp:
+                for m in ARTICLE.finditer(fp.read()):
+                    pmid = PMID.search(m.group(0))
+                    if pmid:
+                        self.articles[pmid.group(1).decode()] = m.group(0)
+        for fname in glob(os.path.join(fixtures, "opencitations", "*.json")):
+            doi = os.path.basename(fname)[: -len(".json")].replace("_", "/")
+            with open(fname, "rb") as fp:
+                self.opencitations[doi.lower()] = fp.read()
+
+    def citing(self, doi: str) -> List[str]:
+        m = re.match(rf"^{re.escape(PREFIX)}/pub\.(\d+)$", doi)
+        if not m:
+            return []
+        i = int(m.group(1))
+        rnd = random.Random(self.seed * 1_000_003 + i)
+        n = i % self.max_citations
+        return [f"{PREFIX}/cite.{j}" for j in rnd.sample(range(self.citers), n)]
+
+    def pmid(self, doi: str) -> Optional[str]:
+        m = re.match(rf"^{re.escape(PREFIX)}/(pub|cite)\.(\d+)$", doi.lower())
+        if not m:
+            return None
+        i = int(m.group(2))
+        if m.group(1) == "pub":
+            return pub_pmid(i)
+        return None if i % 10 == 0 else str(CITE_PMID + i)
+
+    def doi(self, pmid: str) -> Optional[str]:
+        n = int(pmid)
+        if CITE_PMID <= n:
+            return f"{PREFIX}/cite.{n - CITE_PMID}"
+        if PUB_PMID <= n:
+            return pub_doi(n - PUB_PMID)
+        return None
+
+    def article(self, pmid: str) -> bytes:
+        if pmid in self.articles:
+            return self.articles[pmid]
+        return synthetic_article(pmid, self.doi(pmid))
+
+    def crossref(self, doi: str) -> Optional[dict]:
+        """A Crossref work for any DOI of the world (PubMed or not)."""
+        m = re.match(rf"^{re.escape(PREFIX)}/(pub|cite)\.(\d+)$", doi.lower())
+        if not m:
+            return None
+        rnd = random.Random(int(m.group(2)))
+        return {
+            "DOI": doi,
+            "title": [f"Title of {doi}"],
+            "container-title": [f"Journal {rnd.randrange(1000)}"],
+            "issued": {"date-parts": [[2000 + rnd.randrange(24), 1]]},
+            "volume": str(rnd.randrange(300)),
+            "author": [
+                {
+                    "given": f"Fore{a}",
+                    "family": f"Author{a}",
+                    "affiliation": [{"name": f"University {rnd.randrange(500)}"}],
+                }
+                for a in range(1 + rnd.randrange(8))
+            ],
+        }
+
+    def oc(self, doi: str) -> bytes:
+        if doi.lower() in self.opencitations:
+            return self.opencitations[doi.lower()]
+        return json.dumps(
+            [
+                {"oci": f"{k}", "cited": f"coci => {doi}", "citing": f"coci => {c}"}
+                for k, c in enumerate(self.citing(doi))
+            ]
+        ).encode()
+
+
+def synthetic_article(pmid: str, doi: Optional[str] = None) -> bytes:
+    """A PubmedArticle of realistic size and shape."""
+    rnd = random.Random(int(pmid))
+    nauthors = 1 + rnd.randrange(15)
+    authors = []
+    for a in range(nauthors):
+        orcid = (
+            f'<Identifier Source="ORCID">0000-0002-{a:04d}-{rnd.randrange(9999):04d}'
+            "</Identifier>"
+            if rnd.random() < 0.3
+            else ""
+        )
+        affs = "".join(
+            "<AffiliationInfo><Affiliation>School of Molecular Sciences, "
+            f"University {rnd.randrange(500)}, Perth, Australia.</Affiliation>"
+            f'<Identifier Source="GRID">grid.{rnd.randrange(9999)}.{k}</Identifier>'
+            f'<Identifier Source="ISNI">0000 0004 {rnd.randrange(9999):04d} {k}</Identifier>'
+            "</AffiliationInfo>"
+            for k in range(rnd.randrange(3))
+        )
+        authors.append(
+            f'<Author ValidYN="Y"><LastName>Author{a}</LastName><ForeName>Fore{a}</ForeName>'
+            f"<Initials>F</Initials>{orcid}{affs}</Author>"
+        )
+    words = " ".join(f"word{rnd.randrange(5000)}" for _ in range(200))
+    ids = f'<ArticleId IdType="pubmed">{pmid}</ArticleId>'
+    if doi:
+        ids += f'<ArticleId IdType="doi">{doi}</ArticleId>'
+    if rnd.random() < 0.4:
+        ids += f'<ArticleId IdType="pmc">PMC{pmid}</ArticleId>'
+    year = 2000 + rnd.randrange(24)
+    return (
+        f'<PubmedArticle><MedlineCitation Status="MEDLINE"><PMID Version="1">{pmid}</PMID>'
+        f"<Article><Journal><JournalIssue><Volume>{rnd.randrange(300)}</Volume>"
+        f"<Issue>{rnd.randrange(12)}</Issue><PubDate><Year>{year}</Year></PubDate>"
+        f"</JournalIssue><Title>Journal {rnd.randrange(1000)}</Title>"
+        f"<ISOAbbreviation>J {rnd.randrange(1000)}</ISOAbbreviation></Journal>"
+        f"<ArticleTitle>Title of {pmid}: {words[:120]}</ArticleTitle>"
+        f"<Pagination><MedlinePgn>{rnd.randrange(900)}-{rnd.randrange(900, 999)}</MedlinePgn>"
+        f"</Pagination><Abstract><AbstractText>{words}</AbstractText></Abstract>"
+        f'<AuthorList CompleteYN="Y">{"".join(authors)}</AuthorList></Article>'
+        f"</MedlineCitation><PubmedData><ArticleIdList>{ids}</ArticleIdList>"
+        "</PubmedData></PubmedArticle>"
+    ).encode()
+
+
+def article_set(articles: List[bytes]) -> bytes:
+    return (
+        b'<?xml version="1.0" ?>\n<PubmedArticleSet>'
+        + b"".join(articles)
+        + b"</PubmedArticleSet>"
+    )
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+        self.errors = 0
+        self.throttled = 0
+
+    def hit(self, endpoint: str):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    @property
+    def total(self) -> int:
+        return sum(self.requests.values())
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: "FakeServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def params(self) -> Tuple[str, Dict[str, str]]:
+        u = urlparse(self.path)
+        q = parse_qs(u.query)
+        if self.command == "POST":
+            n = int(self.headers.get("Content-Length", 0))
+            q.update(parse_qs(self.rfile.read(n).decode()))
+        return u.path, {k: v[0] for k, v in q.items()}
+
+    def send(self, body: bytes, ctype: str = "application/json", status: int = 200):
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self.do_GET()
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        srv = self.server
+        path, p = self.params()
+        if "eutils" in path:
+            endpoint = path.rsplit("/", 1)[-1]
+        elif path.startswith("/crossref/"):
+            endpoint = "crossref"
+        else:
+            endpoint = "opencitations"
+        srv.stats.hit(endpoint)
+        if srv.latency:
+            time.sleep(srv.rnd.uniform(0.5, 1.5) * srv.latency)
+        r = srv.rnd.random()
+        if r < srv.rate_429:
+            srv.stats.throttled += 1
+            return self.send(b"Too Many Requests", "text/plain", 429)
+        if r < srv.rate_429 + srv.error_rate:
+            srv.stats.errors += 1
+            return self.send(b"Internal Server Error", "text/plain", 500)
+
+        world = srv.world
+        if path.endswith("/efetch.fcgi"):
+            pmids = [i for i in p.get("id", "").split(",") if i]
+            return self.send(
+                article_set([world.article(pmid) for pmid in pmids]), "text/xml"
+            )
+        if path.endswith("/esearch.fcgi"):
+            dois = DOI_TERM.findall(p.get("term", ""))
+            ids = [pmid for pmid in map(world.pmid, dois) if pmid]
+            body = {"esearchresult": {"count": str(len(ids)), "idlist": ids}}
+            return self.send(json.dumps(body).encode())
+        if path.rstrip("/") == "/crossref/works":
+            dois = [f[len("doi:") :] for f in p.get("filter", "").split(",")]
+            items = [w for w in map(world.crossref, dois) if w]
+            body = {"status": "ok", "message": {"items": items}}
+            return self.send(json.dumps(body).encode())
+        if path.startswith("/crossref/works/"):
+            work = world.crossref(unquote(path[len("/crossref/works/") :]))
+            if work is None:
+                return self.send(b"Resource not found.", "text/plain", 404)
+            body = {"status": "ok", "message": work}
+            return self.send(json.dumps(body).encode())
+        if path.startswith("/oc/"):
+            return self.send(world.oc(unquote(path[len("/oc/") :])))
+        return self.send(b"not found", "text/plain", 404)
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        rate_429: float = 0.0,
+        world: Optional[World] = None,
+        seed: int = 1,
+    ):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.world = world or World(seed=seed)
+        self.rnd = random.Random(seed)
+        self.stats = Stats()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def env(self) -> Dict[str, str]:
+        """Environment variables pointing citations at this server."""
+        return {
+            "CITATIONS_EUTILS": f"{self.url}/entrez/eutils",
+            "CITATIONS_OPENCITATIONS": f"{self.url}/oc/",
+            "CITATIONS_CROSSREF": f"{self.url}/crossref/works/",
+            # as fast as the server goes (429s and 5xx still slow us down)
+            "CITATIONS_MAX_RATE": "1000",
+        }
+
+    def start(self) -> "FakeServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+@click.command()
+@click.option("--port", default=8765, show_default=True)
+@click.option("--latency", default=0.0, help="mean seconds per response")
+@click.option("--error-rate", default=0.0, help="fraction of 500 responses")
+@click.option("--rate-429", default=0.0, help="fraction of 429 responses")
+@click.option("--fixtures", type=click.Path(file_okay=False), help="recorded responses")
+@click.option("--seed", default=1, show_default=True)
+def main(port, latency, error_rate, rate_429, fixtures, seed):
+    """Serve fake EFetch/ESearch/OpenCitations/Crossref endpoints."""
+    world = World(seed=seed)
+    if fixtures:
+        world.load(fixtures)
+    srv = FakeServer(port, latency, error_rate, rate_429, world, seed)
+    for k, v in srv.env().items():
+        click.echo(f"export {k}={v}")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
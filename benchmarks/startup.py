@@ -0,0 +1,66 @@
+"""Time how long ``citations --help`` takes to start::
+
+    python benchmarks/startup.py
+
+It also says which heavy modules got imported. tests/test_startup.py
+fails if any are, or if :data:`citations.cli.COMMANDS` has fallen out
+of step with the commands that are actually defined.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import click
+
+HEAVY = ["pandas", "numpy", "sqlalchemy", "lxml", "requests", "urllib3"]
+# run against this checkout whether or not the package is installed
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+from citations.cli import cli
+try:
+    cli.main(args=sys.argv[1:], prog_name="citations", standalone_mode=False)
+except SystemExit:
+    pass
+elapsed = time.perf_counter() - start
+heavy = sorted({m.split(".")[0] for m in sys.modules} & set(%r))
+print(json.dumps(dict(elapsed=elapsed, heavy=heavy)), file=sys.stderr)
+""" % (HEAVY,)
+
+
+def probe(args):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT] + sys.path))
+    r = subprocess.run(
+        [sys.executable, "-c", PROBE, *args],
+        capture_output=True,
+        text=True,
+        check=False,
+        env=env,
+    )
+    return json.loads(r.stderr.strip().splitlines()[-1])
+
+
+@click.command()
+@click.option("--repeat", default=5, show_default=True)
+def main(repeat):
+    """Time `citations --help` and check what it imports."""
+    failed = False
+    for args in [["--help"], ["test-email", "--help"]]:
+        runs = [probe(args) for _ in range(repeat)]
+        best = min(r["elapsed"] for r in runs)
+        heavy = runs[0]["heavy"]
+        line = f"citations {' '.join(args)}: {best * 1000:.0f}ms"
+        if heavy:
+            failed = True
+            click.secho(f"{line} imports {', '.join(heavy)}", fg="red")
+        else:
+            click.secho(line, fg="green")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -1,5 +1,3 @@
-# pylint: disable=unused-import
-from . import citations  # noqa:
 from .cli import cli
 
 if __name__ == "__main__":
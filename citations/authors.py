@@ -0,0 +1,181 @@
+"""Authors and affiliations of NCBI records as real (indexed) tables.
+
+The author lists inside records (see :func:`ncbi.parse_pubmed`) are
+copied, keyed on PMID, into ``authors``, ``affiliations`` (interned on
+name, GRID and ISNI) and the ``author_affiliations`` link table when
+records are fetched, or by ``citations backfill-authors`` for records
+fetched before. Questions like "which institutions cite us most"
+become plain SQL::
+
+    SELECT af.grid, count(DISTINCT a.pubmed) AS n
+    FROM metadata m
+    JOIN authors a ON a.pubmed = m.pubmed
+    JOIN author_affiliations aa ON aa.author_id = a.id
+    JOIN affiliations af ON af.id = aa.affiliation_id
+    WHERE af.grid IS NOT NULL
+    GROUP BY af.grid ORDER BY n DESC
+"""
+
+import hashlib
+import re
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import click
+
+from . import metrics
+
+ORCID = re.compile(r"\d{4}-\d{4}-\d{4}-\d{3}[\dX]")
+
+
+def orcid(value: Optional[str]) -> Optional[str]:
+    """The bare ORCID iD from e.g. ``https://orcid.org/0000-0002-1825-0097``."""
+    m = ORCID.search(value or "")
+    return m.group(0) if m else None
+
+
+def clip(value: Optional[str], n: int) -> Optional[str]:
+    return value[:n] if value else None
+
+
+def affiliation_row(name: Optional[str], grid=None, isni=None) -> Dict[str, Any]:
+    grid = clip((grid or "").strip(), 32)
+    isni = clip((isni or "").replace(" ", ""), 16)
+    name = (name or "").strip() or None
+    key = "\x1f".join([name or "", grid or "", isni or ""])
+    return dict(
+        key=hashlib.sha1(key.encode("utf-8")).hexdigest(),
+        name=name,
+        grid=grid,
+        isni=isni,
+    )
+
+
+def author_rows(
+    record: Mapping[str, Any],
+) -> Tuple[List[Dict[str, Any]], List[Tuple[int, Dict[str, Any]]]]:
+    """Rows for ``authors`` and (position, row) pairs for ``affiliations``."""
+    pubmed = record["pubmed"]
+    authors = []
+    affiliations = []
+    for position, a in enumerate(record.get("authors") or []):
+        authors.append(
+            dict(
+                pubmed=pubmed,
+                position=position,
+                lastname=clip(a.get("lastname"), 128),
+                forename=clip(a.get("forename"), 128),
+                initials=clip(a.get("initials"), 16),
+                orcid=orcid(a.get("orcid")),
+            )
+        )
+        affs = a.get("affiliations") or []
+        if not affs and a.get("affiliation"):
+            affs = [dict(affiliation=a["affiliation"])]
+        for aff in affs:
+            row = affiliation_row(
+                aff.get("affiliation"), aff.get("grid"), aff.get("isni")
+            )
+            if row["name"] or row["grid"] or row["isni"]:
+                affiliations.append((position, row))
+    return authors, affiliations
+
+
+def intern_affiliations(db, conn, rows: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+    """Map affiliation keys to their ``affiliations.id``, adding any new ones."""
+    from .ncbi import chunks
+
+    af = db.affiliations
+    byk = {row["key"]: row for row in rows}
+    ret: Dict[str, int] = {}
+    add = db.insert_ignore(af)
+    for chunk in chunks(sorted(byk), 500):
+        conn.execute(add, [byk[k] for k in chunk])
+        q = db.select([af.c.id, af.c.key]).where(af.c.key.in_(chunk))
+        for r in conn.execute(q):
+            ret[r.key] = r.id
+    return ret
+
+
+def store_authors(db, records: Iterable[Mapping[str, Any]]) -> int:
+    """Write the authors of NCBI ``records``, replacing any already stored
+    for their PMIDs. Returns the number of authors written."""
+    with metrics.timer("db_write", op="authors"), db.engine.begin() as conn:
+        return write_authors(db, conn, records)
+
+
+def write_authors(db, conn, records: Iterable[Mapping[str, Any]]) -> int:
+    """:func:`store_authors` in the transaction of ``conn``."""
+    from .ncbi import chunks
+
+    a = db.authors
+    link = db.author_affiliations
+    byid = {r["pubmed"]: r for r in records if r and r.get("pubmed")}
+    total = 0
+    for chunk in chunks(sorted(byid), 500):
+        old = db.select([a.c.id]).where(a.c.pubmed.in_(chunk))
+        conn.execute(link.delete().where(link.c.author_id.in_(old)))
+        conn.execute(a.delete().where(a.c.pubmed.in_(chunk)))
+
+        authors: List[Dict[str, Any]] = []
+        affs: List[Tuple[str, int, Dict[str, Any]]] = []
+        for pubmed in chunk:
+            rows, aff = author_rows(byid[pubmed])
+            authors.extend(rows)
+            affs.extend((pubmed, position, row) for position, row in aff)
+        if not authors:
+            continue
+        conn.execute(db.insert_ignore(a), authors)
+        total += len(authors)
+        if not affs:
+            continue
+        aff_ids = intern_affiliations(db, conn, (row for _, _, row in affs))
+        q = db.select([a.c.id, a.c.pubmed, a.c.position]).where(a.c.pubmed.in_(chunk))
+        author_ids = {(r.pubmed, r.position): r.id for r in conn.execute(q)}
+        links = {
+            (author_ids[(pubmed, position)], aff_ids[row["key"]])
+            for pubmed, position, row in affs
+        }
+        conn.execute(
+            db.insert_ignore(link),
+            [dict(author_id=i, affiliation_id=j) for i, j in sorted(links)],
+        )
+    metrics.inc("db_rows_written_total", total)
+    return total
+
+
+def backfill(db, chunksize: int = 1000, rebuild: bool = False) -> int:
+    """Fill the author tables from the stored records (and any old JSON
+    ``data`` in ``metadata`` and ``ncbi_meta`` not yet moved by
+    ``citations migrate``). Only PMIDs without any authors are looked
+    at unless ``rebuild`` is set. Returns the number of authors written."""
+    from sqlalchemy import exists
+
+    a = db.authors
+    if rebuild:
+        with db.engine.begin() as conn:
+            conn.execute(db.author_affiliations.delete())
+            conn.execute(a.delete())
+    total = 0
+    for table, column in [
+        (db.records, db.records.c.record),
+        (db.ncbi_table, db.ncbi_table.c.data),
+        (db.meta_table, db.meta_table.c.data),
+    ]:
+        pk = list(table.primary_key)[0]
+        q = (
+            db.select([pk.label("pk"), column.label("record")])
+            .where(column.isnot(None))
+            .where(table.c.pubmed.isnot(None))
+            .where(~exists().where(a.c.pubmed == table.c.pubmed))
+            .order_by(pk)
+            .limit(chunksize)
+        )
+        last = None
+        while True:
+            rows = db.execute(q if last is None else q.where(pk > last))
+            if not rows:
+                break
+            last = rows[-1].pk
+            total += store_authors(db, [r.record for r in rows])
+            click.secho(f"{table.name}: {total} authors", fg="blue")
+    return total
@@ -0,0 +1,232 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+from urllib.parse import urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+DAY = 24 * 3600.0
+# time to live for each source of responses
+TTLS: Dict[str, float] = {
+    "opencitations": 14 * DAY,
+    "crossref": 60 * DAY,
+    "ncbi-efetch": 60 * DAY,
+    "ncbi-esearch": 14 * DAY,
+}
+DEFAULT_TTL = 7 * DAY
+MAX_SIZE = 2 * 1024**3  # bytes
+# parameters that don't change the response
+IGNORE_PARAMS = {"email", "api_key", "mailto"}
+# headers worth keeping with a cached response
+KEEP_HEADERS = ("Content-Type",)
+# maximum number of keys in one "in (...)" lookup
+LOOKUP_SIZE = 500
+
+
+class OfflineError(requests.exceptions.ConnectionError):
+    """Response not in the cache and we are offline."""
+
+
+def normalize(
+    method: str,
+    url: str,
+    params: Optional[Dict[str, Any]] = None,
+    data: Optional[Dict[str, Any]] = None,
+) -> str:
+    parts = urlsplit(url)
+    url = urlunsplit(
+        (parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, "")
+    )
+    # GET params and POST data address the same resource
+    args = {**(params or {}), **(data or {})}
+    args = {k: v for k, v in args.items() if k not in IGNORE_PARAMS}
+    return f"{method.upper()} {url}?{urlencode(sorted(args.items()))}"
+
+
+class ResponseCache:
+    """SQLite backed cache of HTTP responses keyed on the
+    normalized request (method, URL and parameters).
+
+    Batched requests (many PMIDs in one EFetch, many DOIs in one
+    ESearch) are instead cached record by record (see
+    :meth:`get_records`) so that a re-run whose batches fall on
+    different boundaries still finds them.
+
+    Least recently used responses are evicted once the cache
+    grows past ``max_size`` bytes.
+    """
+
+    def __init__(self, path: str, max_size: int = MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.puts = 0
+        self.con = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute("""create table if not exists responses (
+                key text primary key,
+                source text not null,
+                url text not null,
+                headers text not null,
+                content blob not null,
+                size integer not null,
+                created real not null,
+                accessed real not null
+            )""")
+        self.con.execute(
+            "create index if not exists responses_accessed on responses(accessed)"
+        )
+
+    @staticmethod
+    def key(method: str, url: str, params=None, data=None) -> str:
+        return hashlib.sha256(
+            normalize(method, url, params, data).encode("utf-8")
+        ).hexdigest()
+
+    @staticmethod
+    def record_key(source: str, ident: str) -> str:
+        return hashlib.sha256(f"RECORD {source} {ident}".encode("utf-8")).hexdigest()
+
+    def get(
+        self, key: str, source: str, offline: bool = False
+    ) -> Optional[requests.Response]:
+        """Return a cached response. When offline expired responses are returned too."""
+        ttl = TTLS.get(source, DEFAULT_TTL)
+        now = time.time()
+        with self.lock:
+            row = self.con.execute(
+                "select url, headers, content, created from responses where key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            url, headers, content, created = row
+            if not offline and created + ttl < now:
+                return None
+            self.con.execute(
+                "update responses set accessed = ? where key = ?", (now, key)
+            )
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.reason = "OK"
+        resp.url = url
+        resp.headers = CaseInsensitiveDict(json.loads(headers))
+        resp._content = content  # pylint: disable=protected-access
+        resp.encoding = requests.utils.get_encoding_from_headers(resp.headers)
+        return resp
+
+    def put(self, key: str, source: str, resp: requests.Response):
+        content = resp.content
+        # content has already been decompressed so Content-Encoding is dropped
+        headers = {h: resp.headers[h] for h in KEEP_HEADERS if h in resp.headers}
+        now = time.time()
+        with self.lock:
+            self.con.execute(
+                "insert or replace into responses values (?,?,?,?,?,?,?,?)",
+                (
+                    key,
+                    source,
+                    resp.url,
+                    json.dumps(headers),
+                    content,
+                    len(content),
+                    now,
+                    now,
+                ),
+            )
+            self.puts += 1
+            if self.puts % 100 == 0:
+                self._evict()
+
+    def get_records(
+        self, source: str, idents: Iterable[str], offline: bool = False
+    ) -> Dict[str, bytes]:
+        """The cached content of any of ``idents`` (e.g. PMIDs) from ``source``.
+
+        Like :meth:`get` expired records are returned too when offline.
+        """
+        ttl = TTLS.get(source, DEFAULT_TTL)
+        now = time.time()
+        keys = {self.record_key(source, ident): ident for ident in idents}
+        todo = list(keys)
+        ret: Dict[str, bytes] = {}
+        with self.lock:
+            for i in range(0, len(todo), LOOKUP_SIZE):
+                chunk = todo[i : i + LOOKUP_SIZE]
+                rows = self.con.execute(
+                    "select key, content, created from responses"
+                    f" where key in ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                hits = [
+                    (key, content)
+                    for key, content, created in rows
+                    if offline or created + ttl >= now
+                ]
+                self.con.executemany(
+                    "update responses set accessed = ? where key = ?",
+                    [(now, key) for key, _ in hits],
+                )
+                ret.update((keys[key], content) for key, content in hits)
+        return ret
+
+    def put_records(self, source: str, records: Dict[str, bytes]):
+        """Cache the content of each record (keyed by e.g. PMID) from ``source``."""
+        if not records:
+            return
+        now = time.time()
+        with self.lock:
+            self.con.execute("begin")
+            self.con.executemany(
+                "insert or replace into responses values (?,?,?,?,?,?,?,?)",
+                [
+                    (
+                        self.record_key(source, ident),
+                        source,
+                        ident,
+                        "{}",
+                        content,
+                        len(content),
+                        now,
+                        now,
+                    )
+                    for ident, content in records.items()
+                ],
+            )
+            self.con.execute("commit")
+            before = self.puts
+            self.puts += len(records)
+            if before // 100 != self.puts // 100:
+                self._evict()
+
+    def _evict(self):
+        (size,) = self.con.execute(
+            "select coalesce(sum(size), 0) from responses"
+        ).fetchone()
+        if size <= self.max_size:
+            return
+        # remove least recently used until we are at 90% of max_size
+        excess = size - int(self.max_size * 0.9)
+        cur = self.con.execute("select key, size from responses order by accessed")
+        victims = []
+        for key, sz in cur:
+            victims.append((key,))
+            excess -= sz
+            if excess <= 0:
+                break
+        self.con.execute("begin")
+        self.con.executemany("delete from responses where key = ?", victims)
+        self.con.execute("commit")
+
+    def evict(self):
+        with self.lock:
+            self._evict()
+
+    def close(self):
+        with self.lock:
+            self.con.close()
@@ -1,74 +1,161 @@
+import csv
 import re
 import time
-from typing import Any, Dict, Iterable, List
+from datetime import datetime, timedelta
+from io import StringIO
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import unquote
 
 import click
 import pandas as pd
-from .config import HEADERS
+from .engine import run_concurrently
+from .governor import configure, current_rate
+from .transport import HEADERS
+from .ncbi import BATCH_SIZE, DOI_BATCH_SIZE, EFETCH
+from .crossref import CROSSREF_BATCH_SIZE
 
+from . import config, metrics
 from .cli import cli
 
 DOI = re.compile(r"coci => ([^\s]+)$")
+DOI_PREFIX = re.compile(r"^(?:https?://(?:dx\.)?doi\.org/|doi:\s*)", re.I)
 
+OPENCITATIONS = config.OPENCITATIONS
+CROSSREF = config.CROSSREF
 
-def fetch_opennet(doi: str) -> Dict[str, Any]:
-    import requests
 
-    r = requests.get(f"https://w3id.org/oc/index/api/v1/citations/{doi}")
+def fetch_opennet(doi: str, refresh: bool = False) -> Dict[str, Any]:
+    from .transport import get
+
+    r = get(f"{OPENCITATIONS}{doi}", cache="opencitations", refresh=refresh)
     r.raise_for_status()
-    return r.json()
+    with metrics.timer("parse", source="opencitations"):
+        return r.json()
 
 
 def fetch_crossref(doi: str) -> Dict[str, Any]:
-    import requests
+    from .transport import get
 
-    r = requests.get(f"https://api.crossref.org/works/{doi}")
+    r = get(f"{CROSSREF}{doi}", cache="crossref")
     r.raise_for_status()
     m = r.json()
     assert "status" in m and m["status"] == "ok", m
     return m["message"]
 
 
-def fetch_publications(mongo: str = None) -> pd.DataFrame:
-    from pymongo import MongoClient
-
-    if mongo is None:
-        mongo = "mongodb://127.0.0.1:27017/personnel"
-
-    c = MongoClient(mongo)
-    db = c.get_default_database()
-    pubsl = list(
-        db.publications.find({}, {"doi": 1, "pubmed": 1, "title": 1, "year": 1})
-    )
-
-    pubs = pd.DataFrame.from_records(pubsl)
-    pubs.year = pubs.year.astype(int)
-    pubs = pubs.sort_values(["year", "title"])
-    pubs = pubs.drop("_id", axis="columns")
-    pubs["ncitations"] = -1
-    return pubs
-
-
-def citations(doi: str) -> Iterable[str]:
-    r = fetch_opennet(doi)
+def citations(doi: str, refresh: bool = False) -> Iterable[str]:
+    r = fetch_opennet(doi, refresh=refresh)
     for d in r:
         m = DOI.match(d["cited"])
-        if m and m.group(1) != doi:
+        if m and fixdoi(m.group(1)) != doi:
             continue
         m = DOI.match(d["citing"])
         if m:
-            yield m.group(1)
+            yield fixdoi(m.group(1))
 
 
-def citation_df(doi: str) -> pd.DataFrame:
+def citation_df(doi: str, refresh: bool = False) -> pd.DataFrame:
 
-    df = pd.DataFrame({"citedby": list(set(citations(doi)))})
+    df = pd.DataFrame({"citedby": list(set(citations(doi, refresh=refresh)))})
     df["doi"] = doi
     return df
 
 
+class BufferedWriter:
+    """Collect inserts and updates and write them with ``executemany``
+    in a single transaction every ``max_rows`` rows or ``max_wait`` seconds.
+
+    Use as a context manager: anything still buffered is flushed on
+    exit, even when the loop is stopped with a KeyboardInterrupt.
+    """
+
+    def __init__(self, engine, max_rows: int = 1000, max_wait: float = 5.0):
+        self.engine = engine
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+        # executemany needs the same keys for every row so group on them too
+        self.pending: Dict[Tuple[Any, Tuple[str, ...]], List[Dict[str, Any]]] = {}
+        # one insert statement per table so that inserts are grouped too
+        self.inserts: Dict[Any, Any] = {}
+        self.nrows = 0
+        self.last = time.monotonic()
+
+    def execute(self, stmt, rows):
+        if isinstance(rows, dict):
+            rows = [rows]
+        for row in rows:
+            key = (stmt, tuple(sorted(row)))
+            self.pending.setdefault(key, []).append(row)
+            self.nrows += 1
+        if self.nrows >= self.max_rows or time.monotonic() - self.last >= self.max_wait:
+            self.flush()
+
+    def insert(self, table, rows):
+        stmt = self.inserts.get(table)
+        if stmt is None:
+            stmt = self.inserts[table] = table.insert()
+        self.execute(stmt, rows)
+
+    def call(self, fn: Callable[[Any], Any]):
+        """Run ``fn(conn)`` in the transaction of the next flush, after the
+        statements first seen before it (for writes that need the
+        connection, e.g. to read back ids)."""
+        self.pending[(fn, None)] = []
+
+    def flush(self):
+        self.last = time.monotonic()
+        if not self.pending:
+            return
+        pending, self.pending, nrows, self.nrows = self.pending, {}, self.nrows, 0
+        with metrics.timer("db_write", op="flush"), self.engine.begin() as conn:
+            for (stmt, keys), rows in pending.items():
+                if keys is None:
+                    stmt(conn)
+                else:
+                    conn.execute(stmt, rows)
+        metrics.inc("db_rows_written_total", nrows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+
+def pg_copy_insert(table, conn, keys, data_iter):
+    """pandas ``to_sql`` method that loads rows with PostgreSQL's COPY."""
+    buf = StringIO()
+    writer = csv.writer(buf)
+    # write NULL as \N so that empty strings stay empty strings
+    writer.writerows([r"\N" if v is None else v for v in row] for row in data_iter)
+    buf.seek(0)
+    columns = ", ".join(f'"{k}"' for k in keys)
+    name = f"{table.schema}.{table.name}" if table.schema else table.name
+    dbapi_conn = conn.connection
+    with dbapi_conn.cursor() as cur:
+        cur.copy_expert(
+            f"COPY {name} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf
+        )
+
+
 class Db:
-    def __init__(self, engine, publications, citations_table, meta_table, ncbi_table):
+    def __init__(
+        self,
+        engine,
+        publications,
+        citations_table,
+        meta_table,
+        ncbi_table,
+        dois,
+        sync_state,
+        jobs,
+        authors,
+        affiliations,
+        author_affiliations,
+        records,
+        citation_counts,
+        citation_years,
+    ):
         from sqlalchemy import bindparam, select
 
         self.pd = pd
@@ -78,18 +165,44 @@ class Db:
         self.citations = citations_table
         self.meta_table = meta_table
         self.ncbi_table = ncbi_table
+        self.dois = dois
+        self.sync_state = sync_state
+        self.jobs = jobs
+        self.authors = authors
+        self.affiliations = affiliations
+        self.author_affiliations = author_affiliations
+        self.records = records
+        self.citation_counts = citation_counts
+        self.citation_years = citation_years
         self.select = select
+        # canonical DOI -> dois.id
+        self._doi_ids: Dict[str, int] = {}
+        p = publications
+        # SET expressions see the old ncitations
         self.update = (
-            publications.update()  # pylint: disable=no-value-for-parameter
-            .values({publications.c.ncitations: bindparam("b_ncitations")})
-            .where(publications.c.doi == bindparam("b_doi"))
+            p.update()  # pylint: disable=no-value-for-parameter
+            .values(
+                {
+                    p.c.prev_ncitations: p.c.ncitations,
+                    p.c.ncitations: bindparam("b_ncitations"),
+                    p.c.last_checked: bindparam("b_checked"),
+                }
+            )
+            .where(p.c.doi == bindparam("b_doi"))
+        )
+        c = citations_table
+        self.add_citation = self.insert_ignore(c)
+        self.add_record = self.insert_ignore(records)
+        self.remove_citation = c.delete().where(
+            (c.c.doi_id == bindparam("b_doi_id"))
+            & (c.c.citedby_id == bindparam("b_citedby_id"))
         )
 
     def count(self, t, q=None) -> int:
         from sqlalchemy import func
 
         q2 = self.select([func.count()]).select_from(t)
-        if q:
+        if q is not None:
             q2 = q2.where(q)
         with self.engine.connect() as conn:
             return conn.execute(q2).fetchone()[0]
@@ -102,11 +215,321 @@ class Db:
 
     def update_citation_count(self, doi, ncitations):
         with self.engine.connect() as con:
-            proxy = con.execute(self.update, b_doi=doi, b_ncitations=ncitations)
+            proxy = con.execute(
+                self.update,
+                b_doi=doi,
+                b_ncitations=ncitations,
+                b_checked=datetime.utcnow(),
+            )
             assert proxy.rowcount == 1, (doi, proxy.rowcount)
 
+    @property
+    def is_postgres(self) -> bool:
+        return self.engine.dialect.name == "postgresql"
+
+    def bulk_load(self, df: pd.DataFrame, table: str):
+        """Append a dataframe to ``table``, with COPY on PostgreSQL."""
+        with metrics.timer("db_write", op="bulk_load"):
+            df.to_sql(
+                table,
+                con=self.engine,
+                if_exists="append",
+                index=False,
+                chunksize=10000,
+                method=pg_copy_insert if self.is_postgres else None,
+            )
+        metrics.inc("db_rows_written_total", len(df))
+
+    def copy_rows(self, conn, table, rows: List[Dict[str, Any]]):
+        """Insert ``rows`` into ``table`` on ``conn``, with COPY on PostgreSQL."""
+        if not rows:
+            return
+        with metrics.timer("db_write", op="bulk_load"):
+            if self.is_postgres:
+                # like insert(): columns the rows leave out get their defaults
+                keys = [col.name for col in table.columns if col.name in rows[0]]
+                data = ([row.get(k) for k in keys] for row in rows)
+                pg_copy_insert(table, conn, keys, data)
+            else:
+                conn.execute(table.insert(), rows)
+        metrics.inc("db_rows_written_total", len(rows))
+
+    def insert_ignore(self, table):
+        """Insert statement that skips rows violating a unique constraint."""
+        if self.is_postgres:
+            from sqlalchemy.dialects.postgresql import insert
+
+            return insert(table).on_conflict_do_nothing()
+        return table.insert().prefix_with("OR IGNORE")
+
+    def intern(self, dois: Iterable[str]) -> Dict[str, int]:
+        """Map canonical DOIs to their ``dois.id``, adding any new ones."""
+        from .ncbi import chunks
+
+        d = self.dois
+        dois = set(dois)
+        ret = {doi: self._doi_ids[doi] for doi in dois if doi in self._doi_ids}
+        missing = dois - ret.keys()
+        if not missing:
+            return ret
+        add = self.insert_ignore(d)
+        with self.engine.begin() as conn:
+            # keep well below SQLite's bind parameter limit
+            for chunk in chunks(sorted(missing), 500):
+                conn.execute(add, [{"doi": doi} for doi in chunk])
+                q = self.select([d.c.id, d.c.doi]).where(d.c.doi.in_(chunk))
+                for r in conn.execute(q):
+                    ret[r.doi] = self._doi_ids[r.doi] = r.id
+        return ret
+
+    def intern_series(self, dois: pd.Series) -> pd.Series:
+        """Vectorized :meth:`intern` of a Series of canonical DOIs."""
+        ids = self.intern(dois.dropna().unique())
+        return dois.map(ids)
+
+    def citations_query(self):
+        """The citations table with DOI strings instead of ids."""
+        c = self.citations
+        cited = self.dois.alias("cited")
+        citing = self.dois.alias("citing")
+        j = c.join(cited, c.c.doi_id == cited.c.id).join(
+            citing, c.c.citedby_id == citing.c.id
+        )
+        return self.select(
+            [c.c.id, cited.c.doi.label("doi"), citing.c.doi.label("citedby")]
+        ).select_from(j)
+
     def update_citations(self, df: pd.DataFrame):
-        df.to_sql("citations", con=self.engine, if_exists="append", index=False)
+        """Add citations (``doi``, ``citedby`` columns), ignoring any we already have."""
+        if len(df) == 0:
+            return
+        pairs = self.citation_pairs(df)
+        with self.engine.begin() as conn:
+            conn.execute(self.add_citation, pairs.to_dict("records"))
+
+    def citation_pairs(self, df: pd.DataFrame) -> pd.DataFrame:
+        """The distinct (``doi_id``, ``citedby_id``) of ``doi``, ``citedby`` columns."""
+        return pd.DataFrame(
+            {
+                "doi_id": self.intern_series(canonical_dois(df.doi)),
+                "citedby_id": self.intern_series(canonical_dois(df.citedby)),
+            }
+        ).drop_duplicates()
+
+    def sync_citations(
+        self, doi: str, citedby: Iterable[str], writer: "BufferedWriter"
+    ) -> Tuple[int, int]:
+        """Make the citations of ``doi`` equal to ``citedby``.
+
+        Only the differences are written: new citing DOIs are added
+        and ones that have disappeared (retracted) are removed.
+        Returns the number added and removed.
+        """
+        c = self.citations
+        citedby = set(citedby)
+        ids = self.intern(citedby | {doi})
+        doi_id = ids[doi]
+        q = self.select([c.c.citedby_id]).where(c.c.doi_id == doi_id)
+        existing = {r.citedby_id for r in self.execute(q)}
+        citedby_ids = {ids[d] for d in citedby}
+        new = citedby_ids - existing
+        gone = existing - citedby_ids
+        writer.execute(
+            self.add_citation, [dict(doi_id=doi_id, citedby_id=i) for i in new]
+        )
+        writer.execute(
+            self.remove_citation,
+            [dict(b_doi_id=doi_id, b_citedby_id=i) for i in gone],
+        )
+        return len(new), len(gone)
+
+    def migrate(self):
+        """One-off migrations for databases created by older versions."""
+        from sqlalchemy import inspect
+
+        columns = {c["name"] for c in inspect(self.engine).get_columns("citations")}
+        if "citedby" in columns:
+            self.migrate_citations()
+        self.migrate_publication_dois()
+        self.migrate_metadata_ids()
+        for table in [self.meta_table, self.ncbi_table]:
+            self.migrate_records(table)
+        if self.count(self.citation_counts) == 0:
+            from .counts import refresh
+
+            click.secho(f"counted citations of {refresh(self)} DOIs", fg="blue")
+
+    def migrate_records(self, table, chunksize: int = 1000):
+        """Move old JSON ``data`` into the records table and hot columns."""
+        from sqlalchemy import bindparam, null
+
+        from .codec import hot_columns
+
+        pk = list(table.primary_key)[0]
+        q = (
+            self.select([pk.label("pk"), table.c.data])
+            .where(table.c.data.isnot(None))
+            .limit(chunksize)
+        )
+        values = {"data": null()}
+        hot = hot_columns(None)
+        values.update({k: bindparam(f"b_{k}") for k in hot})
+        u = (
+            table.update()  # pylint: disable=no-value-for-parameter
+            .where(pk == bindparam("b_pk"))
+            .values(values)
+        )
+        total = 0
+        while True:
+            with self.engine.begin() as conn:
+                rows = conn.execute(q).fetchall()
+                if not rows:
+                    break
+                records = {r.data["pubmed"]: r.data for r in rows if r.data}
+                if records:
+                    now = datetime.utcnow()
+                    conn.execute(
+                        self.add_record,
+                        [
+                            dict(pubmed=pmid, record=d, fetched=now)
+                            for pmid, d in records.items()
+                        ],
+                    )
+                conn.execute(
+                    u,
+                    [
+                        dict(
+                            b_pk=r.pk,
+                            **{f"b_{k}": v for k, v in hot_columns(r.data).items()},
+                        )
+                        for r in rows
+                    ],
+                )
+            total += len(rows)
+            click.secho(f"{table.name}: moved {total} records", fg="blue")
+
+    def migrate_citations(self):
+        """Convert the old DOI string citations table to interned DOI ids."""
+        from sqlalchemy import Column, Integer, MetaData, Table, text
+
+        c = self.citations
+        with self.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE citations RENAME TO citations_old"))
+        c.create(bind=self.engine)
+        # bulk load the pairs without constraints then dedupe them in one go
+        load = Table(
+            "citations_load",
+            MetaData(),
+            Column("doi_id", Integer),
+            Column("citedby_id", Integer),
+        )
+        load.create(bind=self.engine)
+        total = 0
+        for df in pd.read_sql_query(
+            "select doi, citedby from citations_old", con=self.engine, chunksize=100000
+        ):
+            df = df.dropna()
+            self.bulk_load(self.citation_pairs(df), load.name)
+            total += len(df)
+            click.secho(f"converted {total} citations", fg="blue")
+        q = self.select([load.c.doi_id, load.c.citedby_id]).distinct()
+        with self.engine.begin() as conn:
+            conn.execute(c.insert().from_select(["doi_id", "citedby_id"], q))
+            load.drop(bind=conn)
+            conn.execute(text("DROP TABLE citations_old"))
+        click.secho(f"{self.ncitations()} unique citations", fg="green")
+
+    def migrate_publication_dois(self) -> int:
+        """Canonicalize publications.doi (older versions kept the original case).
+
+        Rows that turn out to have the same DOI are merged into the one
+        synced from mongo or, failing that, the one already scanned.
+        Returns the number of rows changed or removed.
+        """
+        from sqlalchemy import bindparam
+
+        p = self.publications
+        q = self.select(
+            [p.c.id, p.c.doi, p.c.mongo_id, p.c.pubmed, p.c.ncitations]
+        ).where(p.c.doi.isnot(None))
+        df = pd.read_sql_query(q, con=self.engine)
+        df["canonical"] = canonical_dois(df.doi)
+        if (df.doi == df.canonical).all():
+            return 0
+        df = df.assign(
+            synced=df.mongo_id.notna(), scanned=df.ncitations.fillna(-1)
+        ).sort_values(
+            ["canonical", "synced", "scanned", "id"],
+            ascending=[True, False, False, True],
+        )
+        # the merged row keeps any PMID a duplicate had
+        df["merged_pubmed"] = df.groupby("canonical").pubmed.transform("first")
+        dup = df.duplicated("canonical")
+        keep = df[~dup]
+        keep = keep[
+            (keep.doi != keep.canonical)
+            | (keep.pubmed.isna() & keep.merged_pubmed.notna())
+        ]
+        u = (
+            p.update()  # pylint: disable=no-value-for-parameter
+            .where(p.c.id == bindparam("b_id"))
+            .values(doi=bindparam("b_doi"), pubmed=bindparam("b_pubmed"))
+        )
+        with self.engine.begin() as conn:
+            if dup.any():
+                conn.execute(
+                    p.delete().where(p.c.id == bindparam("b_id")),
+                    [dict(b_id=int(i)) for i in df.id[dup]],
+                )
+            if len(keep):
+                conn.execute(
+                    u,
+                    [
+                        dict(
+                            b_id=int(i),
+                            b_doi=doi,
+                            b_pubmed=None if pd.isna(pubmed) else pubmed,
+                        )
+                        for i, doi, pubmed in zip(
+                            keep.id, keep.canonical, keep.merged_pubmed
+                        )
+                    ],
+                )
+        click.secho(
+            f"canonicalized {len(keep)} publication DOIs"
+            f" and merged {int(dup.sum())} duplicates",
+            fg="green",
+        )
+        return len(keep) + int(dup.sum())
+
+    def migrate_metadata_ids(self):
+        """Fill in metadata.doi_id for rows written by older versions."""
+        from sqlalchemy import bindparam
+
+        m = self.meta_table
+        q = self.select([m.c.doi]).where(m.c.doi_id.is_(None)).distinct()
+        dois = pd.read_sql_query(q, con=self.engine).doi
+        if len(dois) == 0:
+            return
+        ids = self.intern_series(canonical_dois(dois))
+        u = (
+            m.update()  # pylint: disable=no-value-for-parameter
+            .values({m.c.doi_id: bindparam("b_doi_id")})
+            .where(m.c.doi == bindparam("b_doi"))
+        )
+        with self.engine.begin() as conn:
+            conn.execute(
+                u,
+                [
+                    dict(b_doi=doi, b_doi_id=int(i))
+                    for doi, i in zip(dois, ids)
+                    if i == i  # not NaN
+                ],
+            )
+        click.secho(f"set doi_id for {len(dois)} metadata DOIs", fg="green")
+
+    def writer(self, max_rows: int = 1000, max_wait: float = 5.0) -> BufferedWriter:
+        return BufferedWriter(self.engine, max_rows=max_rows, max_wait=max_wait)
 
     def fixdoi(self, olddoi: str, newdoi: str):
         p = self.publications
@@ -121,6 +544,70 @@ class Db:
             con=self.engine,
         )
 
+    def stale(self, older_than: timedelta) -> pd.DataFrame:
+        """Scanned publications not checked for ``older_than``.
+
+        The most recent publications and those whose citation count
+        grew the most at the last check come first.
+        """
+        from sqlalchemy import case, or_
+
+        p = self.publications
+        cutoff = datetime.utcnow() - older_than
+        growth = case(
+            [(p.c.prev_ncitations >= 0, p.c.ncitations - p.c.prev_ncitations)],
+            else_=0,
+        )
+        q = (
+            self.select([p])
+            .where(p.c.ncitations >= 0)
+            .where(or_(p.c.last_checked.is_(None), p.c.last_checked < cutoff))
+            .order_by(p.c.year.desc(), growth.desc())
+        )
+        return self.pd.read_sql_query(q, con=self.engine)
+
+    def get_mark(self, name: str) -> Optional[str]:
+        """High-water mark of an incremental sync (see :mod:`citations.sync`)."""
+        s = self.sync_state
+        rows = self.execute(self.select([s.c.value]).where(s.c.name == name))
+        return rows[0].value if rows else None
+
+    def set_mark(self, name: str, value: str):
+        s = self.sync_state
+        with self.engine.begin() as conn:
+            r = conn.execute(
+                s.update()  # pylint: disable=no-value-for-parameter
+                .where(s.c.name == name)
+                .values(value=value, updated=datetime.utcnow())
+            )
+            if r.rowcount == 0:
+                conn.execute(
+                    s.insert().values(name=name, value=value, updated=datetime.utcnow())
+                )
+
+    def table(self, name: str):
+        """Table object by name (reflecting tables we don't define)."""
+        for t in [
+            self.publications,
+            self.citations,
+            self.meta_table,
+            self.ncbi_table,
+            self.dois,
+            self.sync_state,
+            self.jobs,
+            self.authors,
+            self.affiliations,
+            self.author_affiliations,
+            self.records,
+            self.citation_counts,
+            self.citation_years,
+        ]:
+            if t.name == name:
+                return t
+        from sqlalchemy import MetaData, Table
+
+        return Table(name, MetaData(), autoload=True, autoload_with=self.engine)
+
     def npubs(self) -> int:
         return self.count(self.publications)
 
@@ -131,48 +618,76 @@ class Db:
         return self.count(self.citations)
 
 
-def initdb() -> Db:
+def initdb(url: str = None) -> Db:
     from sqlalchemy import (
         JSON,
         Boolean,
         Column,
+        DateTime,
+        ForeignKey,
+        Index,
         Integer,
         MetaData,
         String,
         Table,
+        Text,
         create_engine,
+        event,
         text,
     )
 
+    from .codec import CompressedJSON
+
     meta = MetaData()
     Publications = Table(
         "publications",
         meta,
         Column("id", Integer, primary_key=True),
-        Column("doi", String(64), index=True),
+        Column("doi", String(256), index=True),
+        # the mongo document this came from
+        Column("mongo_id", String(24), index=True),
         Column("pubmed", String(16)),
         Column("title", String(256)),
         Column("year", Integer),
         Column("ncitations", Integer),
+        # when ncitations was last fetched and its value before that
+        Column("last_checked", DateTime),
+        Column("prev_ncitations", Integer),
+    )
+
+    # canonical (lowercase) DOIs interned as integers
+    Dois = Table(
+        "dois",
+        meta,
+        Column("id", Integer, primary_key=True),
+        Column("doi", String(256), nullable=False, unique=True),
     )
 
     Citations = Table(
         "citations",
         meta,
         Column("id", Integer, primary_key=True),
-        Column("doi", String(64), index=True),
-        Column("citedby", String(64)),
+        Column("doi_id", Integer, ForeignKey("dois.id"), nullable=False),
+        Column("citedby_id", Integer, ForeignKey("dois.id"), nullable=False),
+        Index("ix_citations_pair", "doi_id", "citedby_id", unique=True),
+        Index("ix_citations_citedby_id", "citedby_id"),
     )
     Meta = Table(
         "metadata",
         meta,
         Column("id", Integer, primary_key=True),
-        Column("doi", String(64), index=True, nullable=False),
+        Column("doi", String(256), index=True, nullable=False),
+        Column("doi_id", Integer, ForeignKey("dois.id"), index=True),
         Column("pubmed", String(12)),
         Column("source", String(12), nullable=False),
         Column("status", Integer, nullable=False, server_default=text("0")),
-        Column("has_affiliation", Boolean),
+        Column("has_affiliation", Boolean, index=True),
+        # the NCBI record as written by older versions (now in records)
         Column("data", JSON),
+        # failed fetches: tries so far and when to try again (see retry.py)
+        Column("attempts", Integer),
+        Column("next_attempt", DateTime),
+        *record_columns(),
     )
 
     Ncbi = Table(
@@ -181,95 +696,520 @@ def initdb() -> Db:
         Column("pubmed", String(12), primary_key=True),
         Column("status", Integer, nullable=False, server_default=text("0")),
         Column("data", JSON),
+        Column("attempts", Integer),
+        Column("next_attempt", DateTime),
+        Column("has_affiliation", Boolean, index=True),
+        *record_columns(),
     )
 
-    engine = create_engine("sqlite:///./citations.db")
-    Publications.create(bind=engine, checkfirst=True)
-    Citations.create(bind=engine, checkfirst=True)
-    Meta.create(bind=engine, checkfirst=True)
-    Ncbi.create(bind=engine, checkfirst=True)
+    # every NCBI record we have, compressed, once per PMID (see records.py);
+    # metadata.pubmed and ncbi_meta.pubmed refer to it
+    Records = Table(
+        "records",
+        meta,
+        Column("pubmed", String(12), primary_key=True),
+        Column("record", CompressedJSON, nullable=False),
+        Column("fetched", DateTime),
+    )
 
-    return Db(engine, Publications, Citations, Meta, Ncbi)
+    # citations per cited DOI and per citing year (see counts.py)
+    CitationCounts = Table(
+        "citation_counts",
+        meta,
+        Column("doi_id", Integer, ForeignKey("dois.id"), primary_key=True),
+        Column("total", Integer, nullable=False),
+        # citations whose year we know
+        Column("dated", Integer, nullable=False),
+        Column("updated", DateTime),
+    )
 
+    CitationYears = Table(
+        "citation_years",
+        meta,
+        Column("doi_id", Integer, ForeignKey("dois.id"), primary_key=True),
+        Column("year", Integer, primary_key=True),
+        Column("n", Integer, nullable=False),
+    )
 
-class TooManyRetries(Exception):
-    def __init__(self, done):
-        super().__init__(f"Too many retries done: {done}")
+    # high-water marks for incremental syncs
+    SyncState = Table(
+        "sync_state",
+        meta,
+        Column("name", String(256), primary_key=True),
+        Column("value", String(256)),
+        Column("updated", DateTime),
+    )
 
-    @property
-    def message(self):
-        if self.args:
-            return self.args[0]
-        return "Too many retries"
+    # work queue shared by `citations worker` processes (see jobs.py)
+    Jobs = Table(
+        "jobs",
+        meta,
+        Column("id", Integer, primary_key=True),
+        Column("kind", String(16), nullable=False),
+        Column("key", String(256), nullable=False),
+        Column("status", Integer, nullable=False, server_default=text("0")),
+        Column("owner", String(64)),
+        Column("lease_until", DateTime),
+        Column("attempts", Integer, nullable=False, server_default=text("0")),
+        # a pending job that failed isn't claimed again until then
+        Column("next_attempt", DateTime),
+        Column("updated", DateTime),
+        Index("ix_jobs_kind_key", "kind", "key", unique=True),
+        Index("ix_jobs_claim", "kind", "status", "lease_until"),
+    )
 
+    # author lists of NCBI records keyed on PMID (see authors.py)
+    Authors = Table(
+        "authors",
+        meta,
+        Column("id", Integer, primary_key=True),
+        Column("pubmed", String(12), nullable=False),
+        Column("position", Integer, nullable=False),
+        Column("lastname", String(128)),
+        Column("forename", String(128)),
+        Column("initials", String(16)),
+        Column("orcid", String(19), index=True),
+        Index("ix_authors_pubmed_position", "pubmed", "position", unique=True),
+    )
 
-def dometadata(db: Db, email: str, sleep=1.0, ntry=4, headers=None):
-    import requests
-    from sqlalchemy import null, select
+    # interned on (name, grid, isni) by their sha1 key
+    Affiliations = Table(
+        "affiliations",
+        meta,
+        Column("id", Integer, primary_key=True),
+        Column("key", String(40), nullable=False, unique=True),
+        Column("name", Text),
+        Column("grid", String(32), index=True),
+        Column("isni", String(16), index=True),
+    )
+
+    AuthorAffiliations = Table(
+        "author_affiliations",
+        meta,
+        Column("author_id", Integer, ForeignKey("authors.id"), primary_key=True),
+        Column(
+            "affiliation_id",
+            Integer,
+            ForeignKey("affiliations.id"),
+            primary_key=True,
+            index=True,
+        ),
+    )
+
+    url = url or config.DATABASE
+    if url.startswith("sqlite"):
+        engine = create_engine(url)
+        event.listen(engine, "connect", sqlite_pragmas)
+    else:
+        engine = create_engine(
+            url,
+            pool_size=config.POOL_SIZE,
+            max_overflow=config.MAX_OVERFLOW,
+            pool_recycle=config.POOL_RECYCLE,
+            pool_pre_ping=True,
+        )
+    for table in [
+        Dois,
+        Publications,
+        Citations,
+        Meta,
+        Ncbi,
+        SyncState,
+        Jobs,
+        Authors,
+        Affiliations,
+        AuthorAffiliations,
+        Records,
+        CitationCounts,
+        CitationYears,
+    ]:
+        table.create(bind=engine, checkfirst=True)
+        if not add_columns(engine, table):
+            click.secho(
+                f"table {table.name} is out of date: run `citations migrate`",
+                fg="red",
+                err=True,
+            )
+
+    return Db(
+        engine,
+        Publications,
+        Citations,
+        Meta,
+        Ncbi,
+        Dois,
+        SyncState,
+        Jobs,
+        Authors,
+        Affiliations,
+        AuthorAffiliations,
+        Records,
+        CitationCounts,
+        CitationYears,
+    )
+
+
+def record_columns():
+    """The fields of the NCBI record we query on."""
+    from sqlalchemy import Column, Integer, String
+
+    return [
+        Column("year", Integer, index=True),
+        Column("journal", String(256), index=True),
+        Column("pmc", String(16), index=True),
+        Column("title", String(512), index=True),
+        Column("n_authors", Integer, index=True),
+    ]
+
+
+def add_columns(engine, table) -> bool:
+    """Add (nullable) columns and indexes that are missing from an older
+    database and, on PostgreSQL, lengthen VARCHAR columns that have since
+    been widened.
+
+    Returns False if the table needs a real migration.
+    """
+    from sqlalchemy import String, inspect
+
+    inspector = inspect(engine)
+    have = {c["name"]: c["type"] for c in inspector.get_columns(table.name)}
+    indexes = {ix["name"] for ix in inspector.get_indexes(table.name)}
+    missing = [col for col in table.columns if col.name not in have]
+    if any(not col.nullable for col in missing):
+        return False
+    # SQLite doesn't enforce lengths
+    narrow = [
+        col
+        for col in table.columns
+        if engine.dialect.name == "postgresql"
+        and col.name in have
+        and isinstance(col.type, String)
+        and col.type.length
+        and 0 < (getattr(have[col.name], "length", None) or 0) < col.type.length
+    ]
+    with engine.begin() as conn:
+        for col in narrow:
+            coltype = col.type.compile(dialect=engine.dialect)
+            conn.execute(
+                f"ALTER TABLE {table.name} ALTER COLUMN {col.name} TYPE {coltype}"
+            )
+        for col in missing:
+            coltype = col.type.compile(dialect=engine.dialect)
+            conn.execute(f"ALTER TABLE {table.name} ADD COLUMN {col.name} {coltype}")
+        names = {col.name for col in missing}
+        for index in table.indexes:
+            # a new unique index on old data could fail: leave it to migrate
+            new = names & {col.name for col in index.columns}
+            if index.name not in indexes and (new or not index.unique):
+                index.create(bind=conn)
+    return True
+
+
+def sqlite_pragmas(dbapi_connection, _connection_record):
+    # WAL lets readers carry on while we write and, with it,
+    # synchronous=NORMAL only fsyncs at checkpoints
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-65536")  # 64MB
+    cursor.close()
+
+
+def dometadata(
+    db: Db,
+    email: str,
+    sleep=1.0,
+    ntry=8,
+    headers=None,
+    batch_size: int = DOI_BATCH_SIZE,
+    concurrency: int = 1,
+    dois: Optional[Iterable[str]] = None,
+    defer: bool = False,
+) -> Dict[str, float]:
+    """Fetch NCBI metadata for citing DOIs (``dois`` or all those without any).
+
+    A DOI whose request fails is tried again with exponential backoff
+    while the run carries on; after ``ntry`` attempts it is given up on.
+    With ``defer`` failed DOIs aren't waited for but returned as
+    {doi: seconds until the next try}.
+    """
+    from sqlalchemy import bindparam, null, or_, select
     from tqdm import tqdm
 
-    from .ncbi import ncbi_fetchdoi
+    from .codec import hot_columns
+    from .counts import Stale
+    from .ncbi import ncbi_fetchdois
+    from .records import lookup, save
+    from .retry import (
+        DEAD,
+        FAILED,
+        RetryQueue,
+        attempts_so_far,
+        due,
+        retryable,
+    )
 
     m = db.meta_table
-    c = db.citations
-    j = c.outerjoin(m, m.c.doi == c.c.citedby)
-    q = select([c.c.citedby.distinct()]).select_from(j).where(m.c.doi == null())
-
+    if dois is not None:
+        todo = db.intern(dois)
+        q = select([m.c.doi_id, m.c.attempts]).where(m.c.status == FAILED)
+        q = q.where(m.c.doi_id.in_(list(todo.values())))
+    else:
+        c = db.citations
+        d = db.dois
+        # citing DOIs without any metadata or whose last try failed
+        j = c.join(d, c.c.citedby_id == d.c.id).outerjoin(m, m.c.doi_id == d.c.id)
+        q = select([d.c.id, d.c.doi]).select_from(j)
+        q = q.where(or_(m.c.id == null(), due(m)))
+        with db.engine.connect() as con:
+            todo = {r.doi: r.id for r in con.execute(q.distinct())}
+        q = select([m.c.doi_id, m.c.attempts]).where(due(m))
     with db.engine.connect() as con:
-        todo = {r.citedby for r in con.execute(q)}
-    click.secho(f"todo {len(todo)}", fg="blue")
+        attempts = attempts_so_far(con.execute(q))
+    click.secho(f"todo {len(todo)} ({len(attempts)} retries)", fg="blue")
+    configure(sleep)
 
-    session = requests.Session()
+    retry: RetryQueue[str] = RetryQueue(batch_size, max_attempts=ntry, defer=defer)
+    delete_failed = m.delete().where(
+        (m.c.doi_id == bindparam("b_doi_id")) & (m.c.status == FAILED)
+    )
+    update_failed = (
+        m.update()  # pylint: disable=no-value-for-parameter
+        .where((m.c.doi_id == bindparam("b_doi_id")) & (m.c.status == FAILED))
+        .values(
+            status=bindparam("b_status"),
+            attempts=bindparam("b_attempts"),
+            next_attempt=bindparam("b_next"),
+        )
+    )
+
+    def failed(doi, status, n=None, delay=None):
+        # executemany needs the same keys for every row
+        return dict(
+            doi=doi,
+            doi_id=todo[doi],
+            pubmed=None,
+            status=status,
+            source="ncbi",
+            attempts=n,
+            next_attempt=next_attempt(delay),
+            **hot_columns(None),
+        )
 
-    def insert(d):
-        with db.engine.connect() as conn:
-            conn.execute(m.insert(), d)
+    def fetch(chunk):
+        return ncbi_fetchdois(
+            chunk, email, headers=headers, known=lambda pmids: lookup(db, pmids)
+        )
 
-    with tqdm(todo) as pbar:
-        for idx, doi in enumerate(pbar):
-            try:
-                data = list(
-                    ncbi_fetchdoi(doi, email, sleep, session=session, headers=headers)
+    with Stale(db) as stale, db.writer() as writer, tqdm(total=len(todo)) as pbar:
+
+        def insert(rows):
+            writer.insert(m, rows)
+
+        def clear(chunk):
+            # replace rows from earlier failures (flushing first keeps the order)
+            if any(todo[doi] in attempts for doi in chunk):
+                writer.flush()
+            for doi in chunk:
+                if attempts.pop(todo[doi], None):
+                    writer.execute(delete_failed, dict(b_doi_id=todo[doi]))
+
+        def on_result(chunk, records, exc):
+            retry.finished(chunk)
+            if exc is not None and not retryable(exc):
+                # e.g. offline and not cached: leave the rows as they are
+                pbar.write(
+                    click.style(f"skipped {chunk[0]}..{chunk[-1]}: {exc}", fg="yellow")
                 )
+                pbar.update(len(chunk))
+                return
+            if exc is not None:
+                dead = 0
+                writer.flush()
+                for doi in chunk:
+                    n = attempts.get(todo[doi], 0) + 1
+                    delay = retry.schedule(doi, n)
+                    status = FAILED if delay is not None else DEAD
+                    dead += status == DEAD
+                    if todo[doi] in attempts:
+                        writer.execute(
+                            update_failed,
+                            dict(
+                                b_doi_id=todo[doi],
+                                b_status=status,
+                                b_attempts=n,
+                                b_next=next_attempt(delay),
+                            ),
+                        )
+                    else:
+                        insert([failed(doi, status, n, delay)])
+                    attempts[todo[doi]] = n
+                pbar.write(
+                    click.style(
+                        f"failed for {chunk[0]}..{chunk[-1]}: {exc}"
+                        f" ({len(retry)} to retry, {dead} given up)",
+                        fg="red",
+                    )
+                )
+                pbar.update(dead)
+                return
+
+            pbar.set_postfix(rate=current_rate(EFETCH), retry=len(retry))
+            clear(chunk)
+            rows = []
+            for doi, data in records.items():
                 if not data:
-                    d = dict(doi=doi, status=-1, source="ncbi")
-                    insert(d)
+                    rows.append(failed(doi, -1))
                     continue
-                data = data[0]
                 for d in data:
-                    has_affiliation = any(
-                        bool(a.get("affiliation")) for a in d["authors"]
-                    )
-                    d = dict(
-                        doi=doi,
-                        pubmed=d["pubmed"],
-                        status=1,
-                        source="ncbi",
-                        has_affiliation=has_affiliation,
-                        data=d,
+                    rows.append(
+                        dict(
+                            doi=doi,
+                            doi_id=todo[doi],
+                            pubmed=d["pubmed"],
+                            status=1,
+                            source="ncbi",
+                            attempts=None,
+                            next_attempt=None,
+                            **hot_columns(d),
+                        )
                     )
-                    insert(d)
+            save(db, writer, [d for data in records.values() for d in data])
+            insert(rows)
+            stale.citing.update(todo[doi] for doi, data in records.items() if data)
+            pbar.update(len(chunk))
+
+        run_concurrently(
+            retry.items(sorted(todo)),
+            fetch,
+            on_result,
+            concurrency=concurrency,
+        )
+    return retry.deferred
+
+
+def docrossref(
+    db: Db,
+    email: str,
+    sleep=1.0,
+    ntry=8,
+    headers=None,
+    batch_size: int = CROSSREF_BATCH_SIZE,
+    concurrency: int = 1,
+    dois: Optional[Iterable[str]] = None,
+    defer: bool = False,
+) -> Dict[str, float]:
+    """Look up citing DOIs that aren't in PubMed (``dois`` or all of them)
+    on Crossref, many DOIs to a request.
+
+    Found DOIs have their metadata row marked ``source="crossref"`` with
+    the year, journal etc. filled in; ones Crossref doesn't know stay at
+    status -1 (also as ``source="crossref"`` so they aren't asked again).
+    A failed request is retried with backoff; DOIs it still fails for are
+    left to the next run. ``defer`` is as for :func:`dometadata`.
+    """
+    from sqlalchemy import bindparam, select
+    from tqdm import tqdm
+
+    from .codec import hot_columns
+    from .counts import Stale
+    from .crossref import fetch_crossref_batch
+    from .retry import RetryQueue, retryable
+
+    m = db.meta_table
+    d = db.dois
+    q = select([d.c.id, d.c.doi]).select_from(m.join(d, m.c.doi_id == d.c.id))
+    q = q.where((m.c.status == -1) & (m.c.source == "ncbi"))
+    if dois is not None:
+        q = q.where(d.c.doi.in_(list(dois)))
+    with db.engine.connect() as con:
+        todo = {r.doi: r.id for r in con.execute(q)}
+    click.secho(f"crossref todo {len(todo)}", fg="blue")
+    if not todo:
+        return {}
+    configure(sleep)
+
+    retry: RetryQueue[str] = RetryQueue(batch_size, max_attempts=ntry, defer=defer)
+    attempts: Dict[str, int] = {}
+    hot = hot_columns(None)
+    update = (
+        m.update()  # pylint: disable=no-value-for-parameter
+        .where(m.c.doi_id == bindparam("b_doi_id"))
+        .where((m.c.status == -1) & (m.c.source == "ncbi"))
+        .values(
+            source="crossref",
+            status=bindparam("b_status"),
+            **{k: bindparam(f"b_{k}") for k in hot},
+        )
+    )
+
+    def fetch(chunk):
+        return fetch_crossref_batch(chunk, email, headers=headers)
 
-                    if sleep:
-                        time.sleep(sleep)
-            except Exception as e:  # pylint: disable=broad-except
+    with Stale(db) as stale, db.writer() as writer, tqdm(total=len(todo)) as pbar:
+
+        def on_result(chunk, records, exc):
+            retry.finished(chunk)
+            if exc is not None and not retryable(exc):
+                # e.g. offline and not cached: leave the rows as they are
+                pbar.write(
+                    click.style(f"skipped {chunk[0]}..{chunk[-1]}: {exc}", fg="yellow")
+                )
+                pbar.update(len(chunk))
+                return
+            if exc is not None:
+                given_up = 0
+                for doi in chunk:
+                    attempts[doi] = attempts.get(doi, 0) + 1
+                    if retry.schedule(doi, attempts[doi]) is None:
+                        given_up += 1
                 pbar.write(
-                    click.style(f"failed for {doi} after {idx+1}: {e}", fg="red")
+                    click.style(
+                        f"crossref failed for {chunk[0]}..{chunk[-1]}: {exc}",
+                        fg="red",
+                    )
                 )
-                d = dict(doi=doi, status=-2, data=null)
-                insert(d)
-                ntry -= 1
-                if ntry <= 0:
-                    raise TooManyRetries(idx + 1) from e
-                if sleep:
-                    time.sleep(sleep * 2)
+                pbar.update(given_up)
+                return
+            writer.execute(
+                update,
+                [
+                    dict(
+                        b_doi_id=todo[doi],
+                        b_status=-1 if r is None else 1,
+                        **{f"b_{k}": v for k, v in hot_columns(r).items()},
+                    )
+                    for doi, r in records.items()
+                ],
+            )
+            stale.citing.update(todo[doi] for doi, r in records.items() if r)
+            pbar.set_postfix(rate=current_rate(CROSSREF), retry=len(retry))
+            pbar.update(len(chunk))
 
+        run_concurrently(
+            retry.items(sorted(todo)), fetch, on_result, concurrency=concurrency
+        )
+    return retry.deferred
 
-def addpublications(db: Db, pubmeds: List[str], email: str, sleep=1.0, headers=None):
+
+def next_attempt(delay: Optional[float]) -> Optional[datetime]:
+    return None if delay is None else datetime.utcnow() + timedelta(seconds=delay)
+
+
+def addpublications(
+    db: Db,
+    pubmeds: List[str],
+    email: str,
+    sleep=1.0,
+    headers=None,
+    batch_size: int = BATCH_SIZE,
+):
     from sqlalchemy import select
-    from .ncbi import fetchncbi
+    from .authors import clip
+    from .ncbi import chunks
+    from .records import fetch_missing, save
     from tqdm import tqdm
-    import requests
 
     p = db.publications
     q = select([p.c.pubmed]).where(p.c.pubmed.in_(pubmeds))
@@ -280,129 +1220,249 @@ def addpublications(db: Db, pubmeds: List[str], email: str, sleep=1.0, headers=N
     click.secho(f"{len(todo)} todo", fg="green")
     if len(todo) == 0:
         return
-
-    def insert(d):
-        with db.engine.connect() as conn:
-            conn.execute(p.insert(), d)
-
-    session = requests.Session()
-    with tqdm(todo) as pbar:
-        for _idx, pmid in enumerate(pbar):
-            data = list(
-                fetchncbi(pmid, email, full=True, session=session, headers=headers)
-            )
-            if not data:
-                pbar.write(f"no data for {pmid}")
-                continue
-            data = data[0]
-            assert data["pubmed"] == pmid, data
-            d = {
-                k: v for k, v in data.items() if k in ["doi", "pubmed", "title", "year"]
-            }
-            d["ncitations"] = -1
-            insert(d)
-
-            if sleep:
-                time.sleep(sleep)
-
-
-def doncbi(db: Db, email: str, sleep=1.0, ntry=4, headers=None):
-    import requests
-    from sqlalchemy import null, select, and_
+    configure(sleep)
+
+    with db.writer() as writer, tqdm(total=len(todo)) as pbar:
+        for chunk in chunks(sorted(todo), batch_size):
+            records = fetch_missing(db, chunk, email, headers=headers)
+            save(db, writer, records.values())
+            for pmid, data in records.items():
+                if data is None:
+                    pbar.write(f"no data for {pmid}")
+                    continue
+                d = {
+                    k: v
+                    for k, v in data.items()
+                    if k in ["doi", "pubmed", "title", "year"]
+                }
+                d["title"] = clip(d.get("title"), 256)
+                d["ncitations"] = -1
+                writer.insert(p, d)
+            pbar.update(len(chunk))
+            pbar.set_postfix(rate=current_rate(EFETCH))
+
+
+def doncbi(
+    db: Db,
+    email: str,
+    sleep=1.0,
+    ntry=8,
+    headers=None,
+    batch_size: int = BATCH_SIZE,
+    concurrency: int = 1,
+    pmids: Optional[Iterable[str]] = None,
+    defer: bool = False,
+) -> Dict[str, float]:
+    """Fetch NCBI records for publications (``pmids`` or all those without one).
+
+    Failed PMIDs are retried with backoff (or deferred) as in :func:`dometadata`.
+    """
+    from sqlalchemy import bindparam, null, or_, select, and_
     from tqdm import tqdm
 
-    from .ncbi import fetchncbi
+    from .codec import hot_columns
+    from .records import fetch_missing, save
+    from .retry import (
+        DEAD,
+        FAILED,
+        RetryQueue,
+        attempts_so_far,
+        due,
+        retryable,
+    )
 
     p = db.publications
     n = db.ncbi_table
-    j = p.outerjoin(n, p.c.pubmed == n.c.pubmed)
-    q = select([p.c.pubmed]).select_from(j).where(n.c.pubmed == null())
-    q = q.where(and_(p.c.pubmed != null(), p.c.pubmed != ""))
-
+    if pmids is not None:
+        todo = set(pmids)
+        q = select([n.c.pubmed, n.c.attempts]).where(n.c.status == FAILED)
+        q = q.where(n.c.pubmed.in_(list(todo)))
+    else:
+        j = p.outerjoin(n, p.c.pubmed == n.c.pubmed)
+        q = select([p.c.pubmed]).select_from(j)
+        q = q.where(or_(n.c.pubmed == null(), due(n)))
+        q = q.where(and_(p.c.pubmed != null(), p.c.pubmed != ""))
+        with db.engine.connect() as con:
+            todo = {r.pubmed for r in con.execute(q)}
+        q = select([n.c.pubmed, n.c.attempts]).where(due(n))
     with db.engine.connect() as con:
-        todo = {r.pubmed for r in con.execute(q)}
-    click.secho(f"todo {len(todo)}", fg="blue")
-
-    session = requests.Session()
+        attempts = attempts_so_far(con.execute(q))
+    click.secho(f"todo {len(todo)} ({len(attempts)} retries)", fg="blue")
+    configure(sleep)
+
+    retry: RetryQueue[str] = RetryQueue(batch_size, max_attempts=ntry, defer=defer)
+    delete_failed = n.delete().where(n.c.pubmed == bindparam("b_pubmed"))
+    update_failed = (
+        n.update()  # pylint: disable=no-value-for-parameter
+        .where(n.c.pubmed == bindparam("b_pubmed"))
+        .values(
+            status=bindparam("b_status"),
+            attempts=bindparam("b_attempts"),
+            next_attempt=bindparam("b_next"),
+        )
+    )
 
-    def insert(d):
-        with db.engine.connect() as conn:
-            conn.execute(n.insert(), d)
+    def fetch(chunk):
+        return fetch_missing(db, chunk, email, headers=headers)
 
-    with tqdm(todo) as pbar:
-        for idx, pmid in enumerate(pbar):
-            try:
-                data = list(
-                    fetchncbi(pmid, email, full=True, session=session, headers=headers)
-                )
-                if not data:
-                    d = dict(pubmed=pmid, status=-1, data=None)
-                    insert(d)
-                    continue
-                data = data[0]
+    with db.writer() as writer, tqdm(total=len(todo)) as pbar:
 
-                insert(dict(pubmed=pmid, status=1, data=data))
+        def insert(rows):
+            writer.insert(n, rows)
 
-                if sleep:
-                    time.sleep(sleep)
-            except Exception as e:  # pylint: disable=broad-except
+        def on_result(chunk, records, exc):
+            retry.finished(chunk)
+            if exc is not None and not retryable(exc):
+                # e.g. offline and not cached: leave the rows as they are
                 pbar.write(
-                    click.style(f"failed for {pmid} after {idx+1}: {e}", fg="red")
+                    click.style(f"skipped {chunk[0]}..{chunk[-1]}: {exc}", fg="yellow")
                 )
-                d = dict(pubmed=pmid, status=-2, data=None)
-                insert(d)
-                ntry -= 1
-                if ntry <= 0:
-                    raise TooManyRetries(idx + 1) from e
-                if sleep:
-                    time.sleep(sleep * 2)
+                pbar.update(len(chunk))
+                return
+            if exc is not None:
+                dead = 0
+                writer.flush()
+                for pmid in chunk:
+                    a = attempts.get(pmid, 0) + 1
+                    delay = retry.schedule(pmid, a)
+                    status = FAILED if delay is not None else DEAD
+                    dead += status == DEAD
+                    row = dict(
+                        b_pubmed=pmid,
+                        b_status=status,
+                        b_attempts=a,
+                        b_next=next_attempt(delay),
+                    )
+                    if pmid in attempts:
+                        writer.execute(update_failed, row)
+                    else:
+                        insert([{k[2:]: v for k, v in row.items()}])
+                    attempts[pmid] = a
+                pbar.write(
+                    click.style(
+                        f"failed for {chunk[0]}..{chunk[-1]}: {exc}"
+                        f" ({len(retry)} to retry, {dead} given up)",
+                        fg="red",
+                    )
+                )
+                pbar.update(dead)
+                return
+
+            pbar.set_postfix(rate=current_rate(EFETCH), retry=len(retry))
+            # replace rows from earlier failures (flushing first keeps the order)
+            if any(pmid in attempts for pmid in chunk):
+                writer.flush()
+            for pmid in chunk:
+                if attempts.pop(pmid, None):
+                    writer.execute(delete_failed, dict(b_pubmed=pmid))
+            insert(
+                [
+                    dict(
+                        pubmed=pmid,
+                        status=-1 if data is None else 1,
+                        **hot_columns(data),
+                    )
+                    for pmid, data in records.items()
+                ]
+            )
+            save(db, writer, records.values())
+            pbar.update(len(chunk))
+
+        run_concurrently(
+            retry.items(sorted(todo)),
+            fetch,
+            on_result,
+            concurrency=concurrency,
+        )
+    return retry.deferred
 
 
-def docitations(db: Db, sleep=1.0):
+def docitations(
+    db: Db,
+    sleep=1.0,
+    concurrency: int = 1,
+    refresh: Optional[timedelta] = None,
+    dois: Optional[Iterable[str]] = None,
+):
+    """Scan citations of publications (``dois`` or all those not yet scanned)."""
     from requests.exceptions import HTTPError
     from tqdm import tqdm
 
-    todo = db.todo()
+    from .counts import Stale
+
+    todo = db.todo() if dois is None else pd.DataFrame({"doi": list(dois)})
+    # these go past the response cache: its copy is what we already have
+    refreshing: Set[str] = set()
+    if refresh is not None:
+        outdated = db.stale(refresh)
+        click.secho(f"refreshing {len(outdated)} publications", fg="yellow")
+        todo = pd.concat([todo, outdated], ignore_index=True)
+        refreshing = {fixdoi(doi) for doi in outdated.doi.dropna() if doi}
     ncitations = db.ncitations()
     click.secho(f"todo: {len(todo)}. Already found {ncitations} citations", fg="yellow")
+    configure(sleep)
     added = 0
     mx_exc = 4
-    with tqdm(todo.itertuples(), total=len(todo), postfix={"added": 0}) as pbar:
-        for row in pbar:
-            if not row.doi:
-                pbar.write(click.style(f"{row.Index}: no DOI", fg="red"))
-                continue
-            try:
+    with Stale(db) as stale, db.writer() as writer, tqdm(
+        total=len(todo), postfix={"added": 0}
+    ) as pbar:
+
+        def todo_dois():
+            for row in todo.itertuples():
+                if not row.doi:
+                    pbar.write(click.style(f"{row.Index}: no DOI", fg="red"))
+                    pbar.update()
+                    continue
                 doi = fixdoi(row.doi)
                 if doi != row.doi:
                     pbar.write(click.style(f"fixing {row.doi} -> {doi}", fg="yellow"))
                     db.fixdoi(row.doi, doi)
-                df = citation_df(doi)
-                db.update_citation_count(doi, len(df))
-                db.update_citations(df)
-                added += len(df)
-                pbar.set_postfix(added=added)
-                if sleep:
-                    time.sleep(sleep)
-            except HTTPError as e:
+                yield doi
+
+        def on_result(doi, df, exc):
+            nonlocal added, mx_exc
+            pbar.update()
+            if exc is not None:
+                if not isinstance(exc, HTTPError):
+                    raise exc
                 mx_exc -= 1
                 if mx_exc <= 0:
-                    raise e
-                pbar.write(click.style(f"{row.doi}: exception {e}", fg="red"))
+                    raise exc
+                pbar.write(click.style(f"{doi}: exception {exc}", fg="red"))
+                return
+            writer.execute(
+                db.update,
+                dict(b_doi=doi, b_ncitations=len(df), b_checked=datetime.utcnow()),
+            )
+            n, removed = db.sync_citations(doi, df.citedby, writer)
+            if n or removed:
+                stale.cited.add(db.intern([doi])[doi])
+            added += n
+            pbar.set_postfix(added=added, rate=current_rate(OPENCITATIONS))
+
+        def fetch(doi):
+            return citation_df(doi, refresh=doi in refreshing)
+
+        run_concurrently(todo_dois(), fetch, on_result, concurrency=concurrency)
 
 
 def fixdoi(doi: str) -> str:
-    doi = doi.replace("%2F", "/")
-    for prefix in [
-        "https://dx.doi.org/",
-        "http://dx.doi.org/",
-        "https://doi.org/",
-        "http://doi.org/",
-        "doi:",
-    ]:
-        if doi.startswith(prefix):
-            doi = doi[len(prefix) :]
-    return doi
+    """Canonical DOI: no URL or doi: prefix, %-decoded and lowercase."""
+    doi = doi.strip()
+    if "%" in doi:
+        doi = unquote(doi)
+    return DOI_PREFIX.sub("", doi).lower()
+
+
+def canonical_dois(dois: pd.Series) -> pd.Series:
+    """Vectorized :func:`fixdoi` for a whole Series of DOIs."""
+    dois = dois.str.strip()
+    # only a few DOIs are %-encoded
+    encoded = dois.str.contains("%", regex=False, na=False)
+    if encoded.any():
+        dois = dois.copy()
+        dois[encoded] = dois[encoded].map(unquote)
+    return dois.str.replace(DOI_PREFIX, "", regex=True).str.lower()
 
 
 def fixpubs(pubs: pd.DataFrame) -> pd.DataFrame:
@@ -413,12 +1473,27 @@ def fixpubs(pubs: pd.DataFrame) -> pd.DataFrame:
         click.secho(f"missing {smissing} dois", fg="yellow")
 
     pubs = pubs[~missing].copy()  # get rid of missing
-    pubs["doi"] = pubs.doi.apply(fixdoi)
+    pubs["doi"] = canonical_dois(pubs.doi)
     pubs = pubs.drop_duplicates(["doi"], ignore_index=True)
 
     return pubs
 
 
+class Duration(click.ParamType):
+    """A time span such as 30d, 12h, 2w or 90m."""
+
+    name = "duration"
+    UNITS = {"m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, timedelta):
+            return value
+        m = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([mhdw]?)\s*$", value)
+        if not m:
+            self.fail(f"{value!r} is not a duration (e.g. 30d, 12h)", param, ctx)
+        return timedelta(**{self.UNITS[m.group(2) or "d"]: float(m.group(1))})
+
+
 @cli.command(name="fixdoi")
 def fixdoi_():
     """Fix any incorrect dois."""
@@ -428,48 +1503,294 @@ def fixdoi_():
     df = fixpubs(df)
     db.publications.drop(bind=db.engine)
     db.publications.create(bind=db.engine)
-    df.to_sql(  # pylint: disable=no-member
-        "publications", con=db.engine, if_exists="append", index=False
-    )
+    db.bulk_load(df, "publications")
 
 
 @cli.command()
-@click.option("--sleep", default=1.0)
-@click.option("--mongo")
-def scan(sleep, mongo):
+@click.option(
+    "--sleep",
+    default=1.0,
+    help="initial time in seconds between requests (adapted while running)",
+    show_default=True,
+)
+@click.option(
+    "--concurrency",
+    default=1,
+    help="number of requests to keep in flight",
+    show_default=True,
+)
+@click.option(
+    "--refresh-older-than",
+    type=Duration(),
+    help="also rescan publications last checked longer ago than this e.g. 30d",
+)
+@click.option(
+    "--mongo",
+    default="mongodb://127.0.0.1:27017/personnel",
+    help="publications database",
+    show_default=True,
+)
+@click.option(
+    "--sync/--no-sync",
+    default=False,
+    help="pull new and changed publications from mongo first"
+    " (always done if there are no publications yet)",
+    show_default=True,
+)
+@click.option("--full-sync", is_flag=True, help="read every mongo publication")
+@click.option(
+    "--updated-field",
+    help="mongo field with the time a publication was last changed"
+    " (without it incremental syncs only see new publications, not edits)",
+)
+@click.option(
+    "--full-sync-every",
+    type=Duration(),
+    default="7d",
+    help="without --updated-field do a full sync if the last was longer ago than this",
+    show_default=True,
+)
+def scan(
+    sleep,
+    concurrency,
+    refresh_older_than,
+    mongo,
+    sync,
+    full_sync,
+    updated_field,
+    full_sync_every,
+):
     """Scan https://opencitations.net."""
+    from pymongo.errors import PyMongoError
+
+    from .sync import sync_from_mongo
+
     db = initdb()
-    if db.npubs() == 0:
-        pubs = fetch_publications(mongo)
-        pubs = fixpubs(pubs)
+    if sync or db.npubs() == 0:
+        try:
+            sync_from_mongo(
+                db,
+                mongo,
+                full=full_sync,
+                updated_field=updated_field,
+                full_every=full_sync_every,
+            )
+        except PyMongoError as e:
+            if db.npubs() == 0:
+                raise
+            click.secho(
+                f"mongo sync failed ({e}): scanning the publications we have",
+                fg="yellow",
+                err=True,
+            )
 
-        click.secho(f"found {len(pubs)} publications", fg="green")
-        pubs.to_sql(  # pylint: disable=no-member
-            "publications", con=db.engine, if_exists="append", index=False
-        )
+    docitations(db, sleep, concurrency=concurrency, refresh=refresh_older_than)
+
+
+@cli.command()
+def migrate():
+    """Bring an existing database up to date with this version."""
+    db = initdb()
+    db.migrate()
+    click.secho("database migrated", fg="green")
+
+
+@cli.command(name="report")
+@click.option(
+    "--top", default=50, help="rows per table in HTML output", show_default=True
+)
+@click.option("--email", help="email the report to this address")
+@click.option(
+    "--cache-dir",
+    default=config.REPORT_CACHE,
+    envvar="CITATIONS_REPORT_CACHE",
+    help="where to cache data between reports",
+    show_default=True,
+)
+@click.option("--no-report-cache", is_flag=True, help="always read the database")
+@click.argument("filename", type=click.Path(dir_okay=False), required=False)
+def report_(filename, top, email, cache_dir, no_report_cache):
+    """Citation metrics (h-index, i10) overall, per author and per lab.
+
+    FILENAME can be .html or .csv/.parquet (one file per table). With
+    neither FILENAME nor --email the summary is printed.
+    """
+    from . import report
+
+    db = initdb()
+    frames = report.cached_load(db, None if no_report_cache else cache_dir)
+    tables = report.report(frames)
+    if filename:
+        report.write(tables, filename, top=top)
+    if email:
+        from .mailer import sendmail
 
-    docitations(db, sleep)
+        sendmail(report.to_html(tables, top), email, subject="citations report")
+    if not filename and not email:
+        for name in ["summary", "years"]:
+            click.secho(report.TITLES[name], fg="green")
+            click.echo(tables[name].to_string(index=False))
 
 
 @cli.command()
-@click.argument("filename", type=click.Path(dir_okay=False))
-def tocsv(filename):
-    """Dump citations to FILENAME as CSV."""
+@click.option("-k", "--top", default=20, help="number of results", show_default=True)
+@click.option(
+    "--at-least",
+    default=2,
+    help="(multi) how many of ours a paper must cite",
+    show_default=True,
+)
+@click.option("-o", "--out", type=click.Path(dir_okay=False), help="write CSV here")
+@click.argument(
+    "query",
+    type=click.Choice(["cocited", "coupled", "multi", "citers", "pairs"]),
+)
+@click.argument("dois", nargs=-1)
+def graph(query, dois, top, at_least, out):
+    """Co-citation and coupling queries over the citation graph.
+
+    \b
+    cocited DOI   our papers most often cited together with DOI
+    coupled DOI   citing papers sharing most of our papers with DOI
+    multi         citing papers that cite --at-least of ours
+    citers [DOI]  papers citing most of ours (or of the given DOIs)
+    pairs         pairs of our papers most often cited together
+    """
+    from .graph import CitationGraph, doi_ids, frame
+
+    if query in ("cocited", "coupled") and len(dois) != 1:
+        raise click.UsageError(f"{query} needs one DOI")
+    db = initdb()
+    start = time.perf_counter()
+    g = CitationGraph.load(db)
+    click.secho(
+        f"{g.nedges} citations of {len(g.cited_ids)} papers by"
+        f" {len(g.citing_ids)} in {time.perf_counter() - start:.1f}s",
+        fg="blue",
+        err=True,
+    )
+    fixed = [fixdoi(doi) for doi in dois]
+    known = doi_ids(db, fixed)
+    unknown = [doi for doi, f in zip(dois, fixed) if f not in known]
+    if unknown:
+        raise click.BadParameter(f"unknown DOI(s): {' '.join(unknown)}")
+    ids = list(known.values())
+    if query == "cocited":
+        hits, n = g.cocited(ids[0], top)
+        df = frame(db, dict(doi=hits, cocitations=n), ["doi"])
+    elif query == "coupled":
+        hits, n = g.coupled(ids[0], top)
+        df = frame(db, dict(doi=hits, shared=n), ["doi"])
+    elif query == "multi":
+        hits, n = g.multi_citers(at_least, top)
+        df = frame(db, dict(doi=hits, cites=n), ["doi"])
+    elif query == "citers":
+        hits, n = g.top_citers(top, among=ids or None)
+        df = frame(db, dict(doi=hits, cites=n), ["doi"])
+    else:
+        a, b, n = g.cocited_pairs(top)
+        df = frame(db, dict(doi=a, other=b, cocitations=n), ["doi", "other"])
+    if out:
+        df.to_csv(out, index=False)
+        click.secho(f"wrote {len(df)} rows to {out}", fg="green")
+    else:
+        click.echo(df.to_string(index=False))
+
+
+@cli.command()
+def rebuild_counts():
+    """Recompute the citation count tables from scratch."""
+    from .counts import refresh
 
     db = initdb()
-    df = pd.read_sql_table("citations", con=db.engine)
-    df.to_csv(filename, index=False)  # pylint: disable=no-member
+    n = refresh(db)
+    click.secho(f"counted citations of {n} DOIs", fg="green")
+
+
+@cli.command()
+@click.option(
+    "--chunksize", default=1000, help="records to read at a time", show_default=True
+)
+@click.option("--rebuild", is_flag=True, help="delete all authors and start again")
+def backfill_authors(chunksize, rebuild):
+    """Fill the authors tables from stored NCBI records."""
+    from .authors import backfill
+
+    db = initdb()
+    n = backfill(db, chunksize=chunksize, rebuild=rebuild)
+    click.secho(
+        f"wrote {n} authors: {db.count(db.authors)} authors,"
+        f" {db.count(db.affiliations)} affiliations",
+        fg="green",
+    )
+
+
+def export_options(f):
+    for option in reversed(
+        [
+            click.option(
+                "-c",
+                "--columns",
+                help="comma separated list of columns to export",
+            ),
+            click.option("-w", "--where", help='SQL filter e.g. "status = 1"'),
+            click.option(
+                "--chunksize",
+                default=50000,
+                help="rows to read at a time",
+                show_default=True,
+            ),
+            click.option(
+                "--flatten",
+                is_flag=True,
+                help="replace the NCBI record columns with typed columns",
+            ),
+        ]
+    ):
+        f = option(f)
+    return f
+
+
+def doexport(table, filename, columns, where, chunksize, flatten):
+    from .export import export
+
+    db = initdb()
+    n = export(
+        db,
+        table,
+        filename,
+        columns=columns.split(",") if columns else None,
+        where=where,
+        chunksize=chunksize,
+        flat=flatten,
+    )
+    click.secho(f"wrote {n} rows to {filename}", fg="green")
+
+
+@cli.command()
+@export_options
+@click.argument("filename", type=click.Path(dir_okay=False))
+def tocsv(filename, columns, where, chunksize, flatten):
+    """Dump citations to FILENAME as CSV (or .parquet, .csv.gz etc.)."""
+    doexport("citations", filename, columns, where, chunksize, flatten)
 
 
 def show_meta_status(db: Db):
     from sqlalchemy import select, func
 
-    q = select([db.meta_table.c.status, func.count().label("num")]).group_by(
-        db.meta_table.c.status
+    m = db.meta_table
+    q = select([m.c.status, m.c.source, func.count().label("num")]).group_by(
+        m.c.status, m.c.source
     )
-    res = {r.status: r.num for r in db.execute(q)}
+    res: Dict[int, int] = {}
+    crossref = 0
+    for r in db.execute(q):
+        res[r.status] = res.get(r.status, 0) + r.num
+        if r.status == 1 and r.source == "crossref":
+            crossref = r.num
     click.secho(
-        f"done: {res.get(1,0)}, no data: {res.get(-1,0)}, failed: {res.get(-2,0)} ",
+        f"done: {res.get(1,0)} ({crossref} from crossref), no data: {res.get(-1,0)},"
+        f" failed: {res.get(-2,0)} (retrying), given up: {res.get(-3,0)}",
         fg="blue",
     )
 
@@ -478,13 +1799,13 @@ def show_meta_status(db: Db):
 @click.option(
     "--sleep",
     default=1.0,
-    help="time to sleep in seconds between requests",
+    help="initial time in seconds between requests (adapted while running)",
     show_default=True,
 )
 @click.option(
     "--ntry",
-    default=4,
-    help="number of retries before failing",
+    default=8,
+    help="attempts per item before giving up on it",
     show_default=True,
 )
 @click.option(
@@ -493,6 +1814,23 @@ def show_meta_status(db: Db):
     help="remove any failed records before proceeding",
     is_flag=True,
 )
+@click.option(
+    "--batch-size",
+    default=DOI_BATCH_SIZE,
+    help="number of DOIs to resolve per request",
+    show_default=True,
+)
+@click.option(
+    "--concurrency",
+    default=1,
+    help="number of requests to keep in flight",
+    show_default=True,
+)
+@click.option(
+    "--no-crossref",
+    is_flag=True,
+    help="don't look up DOIs that aren't in PubMed on Crossref",
+)
 @click.option("-h", "--with-headers", is_flag=True, help="add headers to http request")
 @click.option("--no-email", is_flag=True, help="don't email me at end or on error")
 @click.argument("email")
@@ -503,9 +1841,11 @@ def ncbi_metadata(
     ntry: int,
     redo_failed: bool,
     with_headers: bool,
+    batch_size: int,
+    concurrency: int,
+    no_crossref: bool,
 ):
     """Get NCBI metadata for citations."""
-    from datetime import datetime
     from html import escape
     from requests.exceptions import ConnectionError as RequestsConnectionError
 
@@ -522,55 +1862,175 @@ def ncbi_metadata(
     start = datetime.now()
     try:
         dometadata(
-            db, email, sleep, ntry=ntry, headers=HEADERS if with_headers else None
+            db,
+            email,
+            sleep,
+            ntry=ntry,
+            headers=HEADERS if with_headers else None,
+            batch_size=batch_size,
+            concurrency=concurrency,
         )
+        if not no_crossref:
+            docrossref(
+                db,
+                email,
+                sleep,
+                ntry=ntry,
+                headers=HEADERS if with_headers else None,
+                concurrency=concurrency,
+            )
+            show_meta_status(db)
         if not no_email:
-            sendmail(f"ncbi-metadata done in {datetime.now() - start}", email)
+            sendmail(
+                f"ncbi-metadata done in {datetime.now() - start}"
+                + metrics.summary_html(),
+                email,
+            )
     except KeyboardInterrupt:
         pass
     except Exception as e:  # pylint: disable=broad-except
-        click.secho(f"download failed after {ntry} retries: {e}", fg="red", err=True)
+        click.secho(f"download failed: {e}", fg="red", err=True)
         if not no_email:
             sendmail(
-                f"ncbi-metadata <b>failed!</b><br/><pre>{escape(str(e))}</pre>", email
+                f"ncbi-metadata <b>failed!</b><br/><pre>{escape(str(e))}</pre>"
+                + metrics.summary_html(),
+                email,
             )
         if not isinstance(e, RequestsConnectionError):
             raise
 
 
 @cli.command()
-@click.argument("email")
-@click.argument("message")
-def test_email(email, message):
-    """Test email."""
-    from .mailer import sendmail
+@click.option(
+    "--kind",
+    type=click.Choice(["ncbi-metadata", "ncbi-json", "crossref", "scan"]),
+    required=True,
+    help="what to work on",
+)
+@click.option("--email", help="email for NCBI and Crossref requests")
+@click.option(
+    "--sleep",
+    default=1.0,
+    help="initial time in seconds between requests (adapted while running)",
+    show_default=True,
+)
+@click.option(
+    "--concurrency",
+    default=1,
+    help="number of requests to keep in flight",
+    show_default=True,
+)
+@click.option(
+    "--workers",
+    default=1,
+    help="number of workers sharing the API rate limits",
+    show_default=True,
+)
+@click.option(
+    "--claim",
+    default=500,
+    help="number of jobs to lease at a time",
+    show_default=True,
+)
+@click.option(
+    "--lease",
+    type=Duration(),
+    default="10m",
+    help="how long a claimed job is ours without a heartbeat",
+    show_default=True,
+)
+@click.option("--no-populate", is_flag=True, help="don't queue outstanding work")
+@click.option("-h", "--with-headers", is_flag=True, help="add headers to http request")
+def worker(
+    kind,
+    email,
+    sleep,
+    concurrency,
+    workers,
+    claim,
+    lease,
+    no_populate,
+    with_headers,
+):
+    """Work through the shared job queue.
+
+    Any number of workers (on any host sharing the database) can run
+    at once. Jobs of a worker that dies are reclaimed once its lease
+    expires.
+    """
+    from . import jobs
+    from .governor import share
+
+    if kind != "scan" and not email:
+        raise click.UsageError(f"--email is required for {kind}")
+    headers = HEADERS if with_headers else None
+    db = initdb()
+    share(workers)
+    if not no_populate:
+        n = jobs.populate(db, kind)
+        click.secho(f"queued {n} new {kind} jobs", fg="blue")
+
+    def process(keys):
+        if kind == "ncbi-metadata":
+            return dometadata(
+                db,
+                email,
+                sleep,
+                headers=headers,
+                concurrency=concurrency,
+                dois=keys,
+                defer=True,
+            )
+        if kind == "crossref":
+            return docrossref(
+                db,
+                email,
+                sleep,
+                headers=headers,
+                concurrency=concurrency,
+                dois=keys,
+                defer=True,
+            )
+        if kind == "ncbi-json":
+            return doncbi(
+                db,
+                email,
+                sleep,
+                headers=headers,
+                concurrency=concurrency,
+                pmids=keys,
+                defer=True,
+            )
+        docitations(db, sleep, concurrency=concurrency, dois=keys)
+        return None
 
-    sendmail(message, email)
-    click.secho("email sent!", fg="green")
+    jobs.work(db, kind, process, batch_size=claim, lease=lease)
 
 
 @cli.command()
+@export_options
 @click.argument("table")
 @click.argument("filename", type=click.Path(dir_okay=False))
-def dump(table, filename):
-    """Dump citation table to FILENAME as CSV."""
+def dump(table, filename, columns, where, chunksize, flatten):
+    """Dump citation TABLE to FILENAME.
 
-    db = initdb()
-    df = pd.read_sql_table(table, con=db.engine)
-    df.to_csv(filename, index=False)  # pylint: disable=no-member
+    The format follows the extension: .parquet or .csv
+    optionally compressed with .gz, .bz2 or .xz.
+    """
+    doexport(table, filename, columns, where, chunksize, flatten)
 
 
 @cli.command()
 @click.option(
     "--sleep",
     default=1.0,
-    help="time to sleep in seconds between requests",
+    help="initial time in seconds between requests (adapted while running)",
     show_default=True,
 )
 @click.option(
     "--ntry",
-    default=4,
-    help="number of retries before failing",
+    default=8,
+    help="attempts per item before giving up on it",
     show_default=True,
 )
 @click.option(
@@ -579,6 +2039,18 @@ def dump(table, filename):
     help="remove any failed records before proceeding",
     is_flag=True,
 )
+@click.option(
+    "--batch-size",
+    default=BATCH_SIZE,
+    help="number of PMIDs to fetch per request",
+    show_default=True,
+)
+@click.option(
+    "--concurrency",
+    default=1,
+    help="number of requests to keep in flight",
+    show_default=True,
+)
 @click.option("-h", "--with-headers", is_flag=True, help="add headers to http request")
 @click.option("--no-email", is_flag=True, help="don't email me at end or on error")
 @click.argument("email")
@@ -589,9 +2061,10 @@ def ncbi_json(
     ntry: int,
     redo_failed: bool,
     with_headers: bool,
+    batch_size: int,
+    concurrency: int,
 ):
     """Get NCBI metadata for publications."""
-    from datetime import datetime
     from html import escape
     from requests.exceptions import ConnectionError as RequestsConnectionError
 
@@ -607,15 +2080,30 @@ def ncbi_json(
 
     start = datetime.now()
     try:
-        doncbi(db, email, sleep, ntry=ntry, headers=HEADERS if with_headers else None)
+        doncbi(
+            db,
+            email,
+            sleep,
+            ntry=ntry,
+            headers=HEADERS if with_headers else None,
+            batch_size=batch_size,
+            concurrency=concurrency,
+        )
         if not no_email:
-            sendmail(f"ncbi-json done in {datetime.now() - start}", email)
+            sendmail(
+                f"ncbi-json done in {datetime.now() - start}" + metrics.summary_html(),
+                email,
+            )
     except KeyboardInterrupt:
         pass
     except Exception as e:  # pylint: disable=broad-except
-        click.secho(f"download failed after {ntry} retries: {e}", fg="red", err=True)
+        click.secho(f"download failed: {e}", fg="red", err=True)
         if not no_email:
-            sendmail(f"ncbi-json <b>failed!</b><br/><pre>{escape(str(e))}</pre>", email)
+            sendmail(
+                f"ncbi-json <b>failed!</b><br/><pre>{escape(str(e))}</pre>"
+                + metrics.summary_html(),
+                email,
+            )
         if not isinstance(e, RequestsConnectionError):
             raise
 
@@ -624,20 +2112,33 @@ def ncbi_json(
 @click.option(
     "--sleep",
     default=1.0,
-    help="time to sleep in seconds between requests",
+    help="initial time in seconds between requests (adapted while running)",
+    show_default=True,
+)
+@click.option(
+    "--batch-size",
+    default=BATCH_SIZE,
+    help="number of PMIDs to fetch per request",
     show_default=True,
 )
 @click.option("-h", "--with-headers", is_flag=True, help="add headers to http request")
 @click.argument("email")
 @click.argument("pubmeds", nargs=-1)
-def add_publications(email: str, sleep: float, with_headers: bool, pubmeds: List[str]):
+def add_publications(
+    email: str, sleep: float, with_headers: bool, batch_size: int, pubmeds: List[str]
+):
     """Add PMIDs to publications table."""
     if len(pubmeds) == 0:
         return
 
     db = initdb()
     addpublications(
-        db, pubmeds, email, sleep, headers=HEADERS if with_headers else None
+        db,
+        pubmeds,
+        email,
+        sleep,
+        headers=HEADERS if with_headers else None,
+        batch_size=batch_size,
     )
 
 
@@ -648,11 +2149,30 @@ def add_publications(email: str, sleep: float, with_headers: bool, pubmeds: List
     default="mongodb://127.0.0.1:27018/personnel",
     show_default=True,
 )
-def update_from_petals(url):
+@click.option("--full", is_flag=True, help="read every petals publication")
+@click.option(
+    "--updated-field",
+    help="mongo field with the time a publication was last changed"
+    " (without it incremental syncs only see new publications, not edits)",
+)
+@click.option(
+    "--full-sync-every",
+    type=Duration(),
+    default="7d",
+    help="without --updated-field do a full sync if the last was longer ago than this",
+    show_default=True,
+)
+def update_from_petals(url, full, updated_field, full_sync_every):
     """update publications table from petals."""
     from .petals import update_from_petals as u
 
     if url == "mongodb://127.0.0.1:27018/personnel":
         click.secho("remember to ssh into croppal", fg="yellow", bold=True)
 
-    u(initdb(), url)
+    u(
+        initdb(),
+        url,
+        full=full,
+        updated_field=updated_field,
+        full_every=full_sync_every,
+    )
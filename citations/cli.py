@@ -1,10 +1,184 @@
+from importlib import import_module
+
 import click
 from click_didyoumean import DYMGroup
 
+from . import config
 from .config import VERSION
 
+# command name -> (module that defines it, short help)
+# the help is repeated here so that `citations --help` needn't import anything
+COMMANDS = {
+    "add-publications": ("citations.citations", "Add PMIDs to publications table."),
+    "backfill-authors": (
+        "citations.citations",
+        "Fill the authors tables from stored NCBI records.",
+    ),
+    "dump": ("citations.citations", "Dump citation TABLE to FILENAME."),
+    "fixdoi": ("citations.citations", "Fix any incorrect dois."),
+    "graph": (
+        "citations.citations",
+        "Co-citation and coupling queries over the citation graph.",
+    ),
+    "migrate": (
+        "citations.citations",
+        "Bring an existing database up to date with this version.",
+    ),
+    "ncbi-json": ("citations.citations", "Get NCBI metadata for publications."),
+    "ncbi-metadata": ("citations.citations", "Get NCBI metadata for citations."),
+    "rebuild-counts": (
+        "citations.citations",
+        "Recompute the citation count tables from scratch.",
+    ),
+    "report": (
+        "citations.citations",
+        "Citation metrics (h-index, i10) overall, per author and per lab.",
+    ),
+    "scan": ("citations.citations", "Scan https://opencitations.net."),
+    "test-email": ("citations.mailer", "Test email."),
+    "tocsv": (
+        "citations.citations",
+        "Dump citations to FILENAME as CSV (or .parquet, .csv.gz etc.).",
+    ),
+    "update-from-petals": (
+        "citations.citations",
+        "update publications table from petals.",
+    ),
+    "worker": ("citations.citations", "Work through the shared job queue."),
+}
+# commands that never make HTTP requests: they needn't import requests
+# (and the transport options are ignored)
+LOCAL_COMMANDS = {
+    "backfill-authors",
+    "dump",
+    "fixdoi",
+    "graph",
+    "migrate",
+    "rebuild-counts",
+    "report",
+    "test-email",
+    "tocsv",
+}
+
+
+class LazyGroup(DYMGroup):
+    """Group that only imports a command's module when it is run.
+
+    Commands register themselves with ``@cli.command()`` as usual;
+    :data:`COMMANDS` says which module to import to find them.
+    """
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(COMMANDS))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.commands and cmd_name in COMMANDS:
+            import_module(COMMANDS[cmd_name][0])
+        return super().get_command(ctx, cmd_name)
+
+    def format_commands(self, ctx, formatter):
+        rows = []
+        for name in self.list_commands(ctx):
+            if name in self.commands:
+                cmd = self.commands[name]
+                if cmd.hidden:
+                    continue
+                rows.append((name, cmd.get_short_help_str(formatter.width)))
+            else:
+                rows.append((name, COMMANDS[name][1]))
+        if rows:
+            with formatter.section("Commands"):
+                formatter.write_dl(rows)
 
-@click.group(cls=DYMGroup, epilog=click.style("Citation commands\n", fg="magenta"))
+
+@click.group(cls=LazyGroup, epilog=click.style("Citation commands\n", fg="magenta"))
 @click.version_option(VERSION)
-def cli():
-    pass
+@click.option(
+    "--db",
+    envvar="CITATIONS_DB",
+    help=f"database URL [default: {config.DATABASE}]",
+)
+@click.option(
+    "--timeout",
+    type=float,
+    envvar="CITATIONS_TIMEOUT",
+    help="HTTP timeout in seconds [default: 10s connect, 60s read]",
+)
+@click.option(
+    "--api-key",
+    envvar="NCBI_API_KEY",
+    help="NCBI api_key (allows 10 requests/sec) [env: NCBI_API_KEY]",
+)
+@click.option(
+    "--cache",
+    type=click.Path(dir_okay=False),
+    envvar="CITATIONS_CACHE",
+    help="HTTP response cache [default: citations-cache.db]",
+)
+@click.option("--no-cache", is_flag=True, help="don't cache HTTP responses")
+@click.option("--offline", is_flag=True, help="only use cached HTTP responses")
+@click.option(
+    "--metrics",
+    type=click.Path(dir_okay=False),
+    envvar="CITATIONS_METRICS",
+    help="write request/parse/db metrics here (.prom textfile or JSON lines)",
+)
+@click.option(
+    "--metrics-interval",
+    default=60.0,
+    help="seconds between metrics writes",
+    show_default=True,
+)
+@click.option(
+    "--profile",
+    type=click.Path(dir_okay=False),
+    help="run the command under cProfile and save the stats here",
+)
+@click.pass_context
+def cli(
+    ctx,
+    db,
+    timeout,
+    api_key,
+    cache,
+    no_cache,
+    offline,
+    metrics,
+    metrics_interval,
+    profile,
+):
+    if db:
+        config.DATABASE = db
+    if ctx.invoked_subcommand not in LOCAL_COMMANDS:
+        from .transport import configure
+
+        configure(
+            timeout=timeout,
+            api_key=api_key,
+            cache=cache,
+            no_cache=no_cache,
+            offline=offline,
+        )
+    if metrics:
+        from .metrics import Writer
+
+        writer = Writer(metrics, metrics_interval)
+        writer.start()
+        ctx.call_on_close(writer.stop)
+    if profile:
+        import cProfile
+
+        prof = cProfile.Profile()
+
+        def done():
+            prof.disable()
+            prof.dump_stats(profile)
+            click.secho(
+                f"profile saved to {profile}"
+                f" (python -m pstats {profile} then: sort cumulative, stats 30)",
+                fg="yellow",
+                err=True,
+            )
+
+        ctx.call_on_close(done)
+        prof.enable()
@@ -0,0 +1,116 @@
+import json
+import zlib
+from typing import Any, Dict, Iterator, Mapping, Optional
+
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+# stored records start with FORMAT_VERSION then a codec byte
+FORMAT_VERSION = 1
+ZLIB = ord("z")
+ZSTD = ord("s")
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 10
+
+
+def _zstd():
+    try:
+        import zstandard  # pylint: disable=import-outside-toplevel
+
+        return zstandard
+    except ImportError:
+        return None
+
+
+def encode(record: Mapping[str, Any]) -> bytes:
+    """Compress a record: zstd if the zstandard package is installed, else zlib."""
+    raw = json.dumps(dict(record), separators=(",", ":")).encode("utf-8")
+    zstd = _zstd()
+    if zstd is not None:
+        body = zstd.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+        return bytes([FORMAT_VERSION, ZSTD]) + body
+    return bytes([FORMAT_VERSION, ZLIB]) + zlib.compress(raw, ZLIB_LEVEL)
+
+
+def decode(blob: bytes) -> Dict[str, Any]:
+    version, codec = blob[0], blob[1]
+    if version != FORMAT_VERSION:
+        raise ValueError(f"unknown record format version {version}")
+    if codec == ZLIB:
+        raw = zlib.decompress(blob[2:])
+    elif codec == ZSTD:
+        zstd = _zstd()
+        if zstd is None:
+            raise RuntimeError("record is zstd compressed: pip install zstandard")
+        raw = zstd.ZstdDecompressor().decompress(blob[2:])
+    else:
+        raise ValueError(f"unknown record codec {codec!r}")
+    return json.loads(raw)
+
+
+class LazyRecord(Mapping):
+    """A stored record that is only decompressed when first looked at."""
+
+    __slots__ = ["blob", "_record"]
+
+    def __init__(self, blob: bytes):
+        self.blob = blob
+        self._record: Optional[Dict[str, Any]] = None
+
+    @property
+    def record(self) -> Dict[str, Any]:
+        if self._record is None:
+            self._record = decode(self.blob)
+        return self._record
+
+    def __getitem__(self, key):
+        return self.record[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.record)
+
+    def __len__(self) -> int:
+        return len(self.record)
+
+    def __repr__(self):
+        return f"LazyRecord({len(self.blob)} bytes)"
+
+
+class CompressedJSON(TypeDecorator):  # pylint: disable=abstract-method
+    """A JSON document stored compressed. Reads give a :class:`LazyRecord`."""
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, bytes):
+            return value
+        if isinstance(value, LazyRecord):
+            return value.blob
+        return encode(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return LazyRecord(bytes(value))
+
+
+def hot_columns(d: Optional[Mapping[str, Any]]) -> Dict[str, Any]:
+    """The fields of an NCBI record (see ncbi.parse_pubmed) kept as real columns."""
+    if not d:
+        return dict(
+            year=None,
+            journal=None,
+            pmc=None,
+            title=None,
+            n_authors=None,
+            has_affiliation=None,
+        )
+    authors = d.get("authors") or []
+    return dict(
+        year=d.get("year"),
+        journal=(d.get("journal") or None) and d["journal"][:256],
+        pmc=d.get("pmc"),
+        title=(d.get("title") or None) and d["title"][:512],
+        n_authors=len(authors),
+        has_affiliation=any(bool(a.get("affiliation")) for a in authors),
+    )
@@ -1,8 +1,21 @@
+import os
+
 VERSION = "0.1.11"
 MAIL_SERVER = "antivirus.uwa.edu.au"
 EMAIL = "citations.server@uwa.edu.au"
-# pylint: disable=line-too-long
-HEADERS = {
-    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.101 Safari/537.36",
-    "Accept": "text/html,application/xhtml+xml,application/xml,application/json;q=0.9,*/*;q=0.8",
-}
+# SQLAlchemy engine URL (e.g. postgresql://user@host/citations)
+DATABASE = os.environ.get("CITATIONS_DB", "sqlite:///./citations.db")
+# connection pool settings (ignored for SQLite)
+POOL_SIZE = int(os.environ.get("CITATIONS_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.environ.get("CITATIONS_MAX_OVERFLOW", "10"))
+POOL_RECYCLE = 3600
+# API endpoints (overridable e.g. to point at benchmarks/fakeserver.py)
+EUTILS = os.environ.get(
+    "CITATIONS_EUTILS", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
+)
+OPENCITATIONS = os.environ.get(
+    "CITATIONS_OPENCITATIONS", "https://w3id.org/oc/index/api/v1/citations/"
+)
+CROSSREF = os.environ.get("CITATIONS_CROSSREF", "https://api.crossref.org/works/")
+# where `citations report` keeps the frames it loads from the database
+REPORT_CACHE = os.environ.get("CITATIONS_REPORT_CACHE", "citations-report-cache")
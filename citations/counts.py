@@ -0,0 +1,121 @@
+"""Citation counts kept in tables so dashboards needn't aggregate ``citations``.
+
+``citation_counts`` has, for each cited DOI, the number of citations
+actually in the ``citations`` table and how many of those have a known
+year. ``citation_years`` splits them by the citing paper's year (from
+the ``metadata`` hot columns). Commands refresh the DOIs they touched
+as they finish (see :class:`Stale`); ``citations rebuild-counts``
+recomputes everything in one set-based pass.
+"""
+
+from datetime import datetime
+from typing import Iterable, List, Optional, Set
+
+
+def years_query(db, cited: Optional[List[int]] = None):
+    """Year of each citing DOI we have metadata for (only of those
+    citing one of ``cited`` if given)."""
+    from sqlalchemy import func
+
+    m = db.meta_table
+    q = (
+        db.select([m.c.doi_id, func.max(m.c.year).label("year")])
+        .where(m.c.status == 1)
+        .where(m.c.year.isnot(None))
+    )
+    if cited is not None:
+        # aliased so it isn't correlated with the citations it is joined to
+        c = db.citations.alias("cites")
+        citing = db.select([c.c.citedby_id]).where(c.c.doi_id.in_(cited))
+        q = q.where(m.c.doi_id.in_(citing))
+    return q.group_by(m.c.doi_id).alias("years")
+
+
+def refresh(db, doi_ids: Optional[Iterable[int]] = None) -> int:
+    """Recompute the counts of the cited ``doi_ids`` (all of them if None).
+
+    Returns the number of DOIs refreshed.
+    """
+    from sqlalchemy import func, literal
+
+    from .ncbi import chunks
+
+    c = db.citations
+    cc = db.citation_counts
+    cy = db.citation_years
+
+    def rebuild(conn, where=None):
+        # only aggregate the years of the papers citing ``where``
+        years = years_query(db, where)
+        j = c.outerjoin(years, years.c.doi_id == c.c.citedby_id)
+        totals = (
+            db.select(
+                [
+                    c.c.doi_id,
+                    func.count().label("total"),
+                    func.count(years.c.year).label("dated"),
+                    literal(datetime.utcnow()).label("updated"),
+                ]
+            )
+            .select_from(j)
+            .group_by(c.c.doi_id)
+        )
+        per_year = (
+            db.select([c.c.doi_id, years.c.year, func.count().label("n")])
+            .select_from(c.join(years, years.c.doi_id == c.c.citedby_id))
+            .group_by(c.c.doi_id, years.c.year)
+        )
+        for table, q, columns in [
+            (cc, totals, ["doi_id", "total", "dated", "updated"]),
+            (cy, per_year, ["doi_id", "year", "n"]),
+        ]:
+            d = table.delete()
+            if where is not None:
+                d = d.where(table.c.doi_id.in_(where))
+                q = q.where(c.c.doi_id.in_(where))
+            conn.execute(d)
+            conn.execute(table.insert().from_select(columns, q))
+
+    with db.engine.begin() as conn:
+        if doi_ids is None:
+            rebuild(conn)
+        else:
+            ids = sorted(set(doi_ids))
+            for chunk in chunks(ids, 500):
+                rebuild(conn, chunk)
+    return db.count(cc) if doi_ids is None else len(ids)
+
+
+def cited_by(db, citing_ids: Iterable[int]) -> Set[int]:
+    """The DOIs cited by any of ``citing_ids``."""
+    from .ncbi import chunks
+
+    c = db.citations
+    ret: Set[int] = set()
+    for chunk in chunks(sorted(set(citing_ids)), 500):
+        q = db.select([c.c.doi_id]).where(c.c.citedby_id.in_(chunk)).distinct()
+        ret.update(r.doi_id for r in db.execute(q))
+    return ret
+
+
+class Stale:
+    """Collect the DOIs a run changes and refresh their counts on exit.
+
+    Add cited DOI ids whose citations changed to :attr:`cited` and
+    citing DOI ids whose year may have changed to :attr:`citing`.
+    Enter it before the :class:`BufferedWriter` so that the writes
+    are flushed before the counts are recomputed.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.cited: Set[int] = set()
+        self.citing: Set[int] = set()
+
+    def __enter__(self) -> "Stale":
+        return self
+
+    def __exit__(self, *args):
+        ids = self.cited | cited_by(self.db, self.citing)
+        if ids:
+            refresh(self.db, ids)
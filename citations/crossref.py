@@ -0,0 +1,108 @@
+import json
+from typing import Any, Dict, List, Optional
+
+from . import config, metrics, transport
+
+WORKS = config.CROSSREF.rstrip("/")
+# number of DOIs in one filter=doi:a,doi:b,... query
+CROSSREF_BATCH_SIZE = 50
+SELECT = (
+    "DOI,title,container-title,short-container-title,issued,volume,issue,page,author"
+)
+
+
+def fetch_crossref_batch(
+    dois: List[str], mailto: str, session=None, headers=None
+) -> Dict[str, Optional[Dict[str, Any]]]:
+    """Look up a chunk of DOIs with one Crossref filter query.
+
+    Returns a dictionary keyed by *all* the requested DOIs: the work
+    as an NCBI shaped record (see :func:`crossref_record`) or None if
+    Crossref doesn't know it. ``mailto`` gets us into the polite pool.
+    Works are cached one by one (an empty entry for a DOI Crossref
+    doesn't know) and only the DOIs missing from the cache are asked for.
+    """
+    ret: Dict[str, Optional[Dict[str, Any]]] = {doi: None for doi in dois}
+    lookup = {doi.lower(): doi for doi in dois}
+    cached = transport.cached_records("crossref", list(lookup))
+    todo = [doi for doi in dois if doi.lower() not in cached]
+    # a comma would split the filter so these are looked up one by one
+    single = [doi for doi in todo if "," in doi]
+    batch = [doi for doi in todo if "," not in doi]
+    items = [json.loads(v) for v in cached.values() if v]
+    fetched: Dict[str, bytes] = {}
+    if batch:
+        params = dict(
+            filter=",".join(f"doi:{doi}" for doi in batch),
+            rows=str(len(batch)),
+            select=SELECT,
+            mailto=mailto,
+        )
+        r = transport.get(WORKS, params=params, headers=headers, session=session)
+        r.raise_for_status()
+        with metrics.timer("parse", source="crossref"):
+            found = r.json()["message"]["items"]
+        items.extend(found)
+        fetched.update(dict.fromkeys((doi.lower() for doi in batch), b""))
+        for item in found:
+            fetched[(item.get("DOI") or "").lower()] = json.dumps(item).encode()
+    for doi in single:
+        r = transport.get(
+            f"{WORKS}/{doi}",
+            params=dict(mailto=mailto),
+            headers=headers,
+            session=session,
+        )
+        if r.status_code == 404:
+            fetched[doi.lower()] = b""
+            continue
+        r.raise_for_status()
+        items.append(r.json()["message"])
+        fetched[doi.lower()] = json.dumps(items[-1]).encode()
+    transport.cache_records(
+        "crossref", {doi: v for doi, v in fetched.items() if doi in lookup}
+    )
+    for item in items:
+        doi = lookup.get((item.get("DOI") or "").lower())
+        if doi is not None:
+            ret[doi] = crossref_record(item)
+    return ret
+
+
+def first(values: Optional[List[str]]) -> Optional[str]:
+    return values[0] if values else None
+
+
+def crossref_record(item: Dict[str, Any]) -> Dict[str, Any]:
+    """A Crossref work with the same keys as :func:`ncbi.parse_pubmed` records."""
+
+    def author(a):
+        given = a.get("given") or ""
+        affiliations = [
+            dict(grid=None, isni=None, affiliation=aff["name"])
+            for aff in a.get("affiliation") or []
+            if aff.get("name")
+        ]
+        return {
+            "lastname": a.get("family") or a.get("name"),
+            "forename": given or None,
+            "initials": "".join(w[0] for w in given.replace("-", " ").split()) or None,
+            "affiliations": affiliations,
+            "affiliation": affiliations[0]["affiliation"] if affiliations else "",
+            "orcid": a.get("ORCID") or "",
+        }
+
+    parts = (item.get("issued") or {}).get("date-parts") or [[None]]
+    return {
+        "pubmed": None,
+        "year": parts[0][0] if parts[0] else None,
+        "title": first(item.get("title")),
+        "doi": item.get("DOI"),
+        "pmc": None,
+        "journal": first(item.get("short-container-title"))
+        or first(item.get("container-title")),
+        "volume": item.get("volume"),
+        "issue": item.get("issue"),
+        "pages": item.get("page"),
+        "authors": [author(a) for a in item.get("author") or []],
+    }
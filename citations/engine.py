@@ -0,0 +1,62 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Optional, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class Wait:
+    """Yield one of these from ``items`` to pause that worker for ``seconds``
+    (e.g. while waiting for a retry to fall due) without blocking the others.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+
+def run_concurrently(
+    items: Iterable[T],
+    fetch: Callable[[T], R],
+    on_result: Callable[[T, Optional[R], Optional[Exception]], Any],
+    concurrency: int = 1,
+):
+    """Run the blocking ``fetch(item)`` for every item with at most
+    ``concurrency`` requests in flight.
+
+    The request rate itself is policed by the per-host governors
+    (see :mod:`citations.governor`) inside each fetcher.
+
+    ``on_result(item, result, exception)`` is called in the calling
+    thread as each fetch completes, so it can write to the database
+    and update progress bars. Any exception it raises stops the run.
+    ``items`` is consumed lazily.
+    """
+    asyncio.run(_run(items, fetch, on_result, max(concurrency, 1)))
+
+
+async def _run(items, fetch, on_result, concurrency: int):
+    loop = asyncio.get_running_loop()
+    it = iter(items)
+
+    async def worker(pool):
+        # all workers pull from the same iterator; this is safe
+        # since they all run on the event loop thread
+        for item in it:
+            if isinstance(item, Wait):
+                await asyncio.sleep(item.seconds)
+                continue
+            try:
+                result = await loop.run_in_executor(pool, fetch, item)
+            except Exception as e:  # pylint: disable=broad-except
+                on_result(item, None, e)
+            else:
+                on_result(item, result, None)
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        tasks = [asyncio.ensure_future(worker(pool)) for _ in range(concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
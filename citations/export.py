@@ -0,0 +1,195 @@
+import bz2
+import gzip
+import json
+import lzma
+from collections.abc import Mapping
+from typing import IO, Any, Callable, Iterator, List, Optional
+
+import click
+import pandas as pd
+
+CHUNKSIZE = 50000
+
+OPENERS: dict = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+# typed columns pulled out of an NCBI record (see ncbi.parse_pubmed)
+FLAT = {
+    "year": "Int64",
+    "journal": "string",
+    "title": "string",
+    "volume": "string",
+    "issue": "string",
+    "pages": "string",
+    "pmc": "string",
+    "ncbi_doi": "string",
+    "n_authors": "Int64",
+    "first_author": "string",
+    "has_affiliation": "boolean",
+    "has_orcid": "boolean",
+}
+
+
+def flatten_record(d: Optional[dict]) -> dict:
+    if not d:
+        return {}
+    authors = d.get("authors") or []
+    first = authors[0] if authors else {}
+    return {
+        "year": d.get("year"),
+        "journal": d.get("journal"),
+        "title": d.get("title"),
+        "volume": d.get("volume"),
+        "issue": d.get("issue"),
+        "pages": d.get("pages"),
+        "pmc": d.get("pmc"),
+        "ncbi_doi": d.get("doi"),
+        "n_authors": len(authors),
+        "first_author": first.get("lastname"),
+        "has_affiliation": any(bool(a.get("affiliation")) for a in authors),
+        "has_orcid": any(bool(a.get("orcid")) for a in authors),
+    }
+
+
+def flatten(df: pd.DataFrame, column: str = "record") -> pd.DataFrame:
+    """Replace the JSON NCBI record in ``column`` with typed columns."""
+    flat = pd.DataFrame.from_records(
+        [flatten_record(d) for d in df[column]], index=df.index, columns=list(FLAT)
+    ).astype(FLAT)
+    df = df.drop(columns=[column])
+    # don't clash with existing columns (e.g. the hot columns like year)
+    # but give them the same types and fill them in for older rows
+    for c in flat.columns.intersection(df.columns):
+        df[c] = df[c].astype(FLAT[c]).fillna(flat[c])
+    flat = flat[[c for c in flat.columns if c not in df.columns]]
+    return pd.concat([df, flat], axis="columns")
+
+
+def export_query(table, db, columns: Optional[List[str]] = None, where: str = None):
+    """SELECT for ``table`` with optional column projection and WHERE clause."""
+    from sqlalchemy import text
+
+    if table == "citations":
+        base = db.citations_query().alias("citations")
+    elif table in (db.meta_table.name, db.ncbi_table.name):
+        # with the NCBI record they refer to
+        t = db.table(table)
+        r = db.records
+        q = db.select([*t.c, r.c.record]).select_from(
+            t.outerjoin(r, r.c.pubmed == t.c.pubmed)
+        )
+        base = q.alias(table)
+    else:
+        base = db.table(table)
+    cols = [base.c[c] for c in columns] if columns else list(base.c)
+    q = db.select(cols)
+    if where:
+        q = q.where(text(where))
+    return q
+
+
+def read_chunks(db, q, chunksize: int = CHUNKSIZE) -> Iterator[pd.DataFrame]:
+    """Stream the result of ``q`` in dataframes of ``chunksize`` rows."""
+    with db.engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True)
+        yield from pd.read_sql_query(q, con=conn, chunksize=chunksize)
+
+
+def jsonify(df: pd.DataFrame, json_columns: List[str]) -> pd.DataFrame:
+    for c in json_columns:
+        if c in df.columns:
+            df[c] = [
+                (
+                    None
+                    if v is None
+                    else json.dumps(dict(v) if isinstance(v, Mapping) else v)
+                )
+                for v in df[c]
+            ]
+    return df
+
+
+def open_text(filename: str) -> IO[str]:
+    for ext, opener in OPENERS.items():
+        if filename.endswith(ext):
+            return opener(filename, "wt", encoding="utf-8")
+    return open(filename, "wt", encoding="utf-8")
+
+
+def write_csv(chunks: Iterator[pd.DataFrame], filename: str) -> int:
+    n = 0
+    with open_text(filename) as fp:
+        for df in chunks:
+            df.to_csv(fp, index=False, header=n == 0)
+            n += len(df)
+    return n
+
+
+def write_parquet(chunks: Iterator[pd.DataFrame], filename: str) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise click.ClickException(
+            "parquet output needs pyarrow: pip install pyarrow"
+        ) from e
+
+    n = 0
+    writer = None
+    try:
+        for df in chunks:
+            tbl = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None:
+                # an all null first chunk can't tell us the column types
+                schema = pa.schema(
+                    [
+                        f.with_type(pa.string()) if pa.types.is_null(f.type) else f
+                        for f in tbl.schema
+                    ]
+                )
+                writer = pq.ParquetWriter(filename, schema, compression="zstd")
+            writer.write_table(tbl.cast(writer.schema))
+            n += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+    return n
+
+
+def export(
+    db,
+    table: str,
+    filename: str,
+    columns: Optional[List[str]] = None,
+    where: str = None,
+    chunksize: int = CHUNKSIZE,
+    flat: bool = False,
+) -> int:
+    """Stream ``table`` to ``filename`` in ``chunksize`` row pieces.
+
+    The format comes from the extension: .parquet or .csv optionally
+    compressed with .gz, .bz2 or .xz. Returns the number of rows written.
+    """
+    from sqlalchemy import JSON
+
+    from .codec import CompressedJSON
+
+    q = export_query(table, db, columns, where)
+    json_columns = [
+        c.name for c in q.alias().c if isinstance(c.type, (JSON, CompressedJSON))
+    ]
+
+    def chunks() -> Iterator[pd.DataFrame]:
+        for df in read_chunks(db, q, chunksize):
+            if flat and "record" in df.columns and "data" in df.columns:
+                # rows not yet moved by `citations migrate` still use data
+                df["record"] = df["record"].where(df["record"].notna(), df["data"])
+                df = df.drop(columns=["data"])
+            if flat:
+                for column in ["record", "data"]:
+                    if column in df.columns:
+                        df = flatten(df, column)
+            yield jsonify(df, json_columns)
+
+    write: Callable[[Iterator[pd.DataFrame], str], Any]
+    write = write_parquet if filename.endswith(".parquet") else write_csv
+    return write(chunks(), filename)
@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+# (initial, maximum) requests per second for each host
+# NCBI allow 3 requests/sec or 10 requests/sec with an api_key
+NCBI_HOST = "eutils.ncbi.nlm.nih.gov"
+LIMITS: Dict[str, Tuple[float, float]] = {
+    NCBI_HOST: (3.0, 3.0),
+    "w3id.org": (1.0, 5.0),
+    "opencitations.net": (1.0, 5.0),
+    "api.crossref.org": (2.0, 20.0),
+}
+NCBI_API_KEY_LIMIT = 10.0
+DEFAULT_LIMIT = (1.0, 5.0)
+# overrides every host's maximum rate (e.g. for benchmarks/fakeserver.py)
+MAX_RATE: Optional[float] = (
+    float(os.environ["CITATIONS_MAX_RATE"])
+    if os.environ.get("CITATIONS_MAX_RATE")
+    else None
+)
+# responses that mean "slow down"
+BACKOFF_STATUS = {429, 500, 502, 503, 504}
+# slowest a host is throttled to (requests per second)
+MIN_RATE = 0.5
+# additive increase per successful request as a fraction of the host's max rate
+INCREASE = 0.05
+
+
+class RateGovernor:
+    """Token bucket whose rate adapts to how the host is responding.
+
+    The rate creeps up additively while requests succeed (by
+    ``increase * max_rate`` each time, up to ``max_rate``) and is
+    halved on a 429 or 5xx response (down to ``min_rate``). A
+    ``Retry-After`` header blocks all requests to the host until
+    it expires.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        max_rate: float,
+        min_rate: float = MIN_RATE,
+        increase: float = INCREASE,
+        burst: float = 1.0,
+    ):
+        self.max_rate = max_rate
+        self.floor = min_rate
+        self.rate = min(max(rate, self.min_rate), max_rate)
+        self.increase = increase
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def min_rate(self) -> float:
+        return min(self.floor, self.max_rate)
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            # tokens can go negative: a debt later callers have to wait out
+            self.tokens -= 1
+            wait = max(-self.tokens / self.rate, self.blocked_until - now)
+        if wait > 0:
+            time.sleep(wait)
+
+    def success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase * self.max_rate)
+
+    def backoff(self, wait: Optional[float] = None):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            if wait:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + wait)
+
+    def feedback(self, resp) -> bool:
+        """Adjust the rate from a response. Returns True if the host wants us to back off."""
+        if resp.status_code in BACKOFF_STATUS:
+            self.backoff(retry_after(resp.headers.get("Retry-After")))
+            return True
+        self.success()
+        return False
+
+    def set_rate(self, rate: float):
+        with self.lock:
+            self.rate = min(max(rate, self.min_rate), self.max_rate)
+
+
+def retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+_governors: Dict[str, RateGovernor] = {}
+_lock = threading.Lock()
+_initial_rate: Optional[float] = None
+# number of processes sharing each host's limit
+_share = 1
+
+
+def limits(host: str) -> Tuple[float, float]:
+    from . import transport
+
+    rate, max_rate = LIMITS.get(host, DEFAULT_LIMIT)
+    if host == NCBI_HOST and transport.API_KEY:
+        max_rate = NCBI_API_KEY_LIMIT
+    if MAX_RATE:
+        rate, max_rate = min(rate, MAX_RATE), MAX_RATE
+    return rate / _share, max_rate / _share
+
+
+def governor(url: str) -> RateGovernor:
+    """Return the (shared) governor for the host of ``url``."""
+    host = urlparse(url).netloc or url
+    with _lock:
+        gov = _governors.get(host)
+        if gov is None:
+            rate, max_rate = limits(host)
+            if _initial_rate is not None:
+                rate = _initial_rate
+            gov = _governors[host] = RateGovernor(rate, max_rate)
+        return gov
+
+
+def configure(sleep: Optional[float] = None, max_rate: Optional[float] = None):
+    """Start every host at one request per ``sleep`` seconds (the old ``--sleep``)
+    and, if given, cap every host at ``max_rate`` requests per second."""
+    global _initial_rate, MAX_RATE  # pylint: disable=global-statement
+    with _lock:
+        _initial_rate = 1.0 / sleep if sleep else None
+        if max_rate is not None:
+            MAX_RATE = max_rate
+        for host, gov in _governors.items():
+            gov.max_rate = limits(host)[1]
+            gov.set_rate(gov.rate if _initial_rate is None else _initial_rate)
+
+
+def share(n: int):
+    """Split every host's rate limit evenly between ``n`` worker processes."""
+    global _share  # pylint: disable=global-statement
+    with _lock:
+        _share = max(n, 1)
+        for host, gov in _governors.items():
+            gov.max_rate = limits(host)[1]
+            gov.set_rate(gov.rate)
+
+
+def current_rate(url: str) -> str:
+    """Current rate for ``url``'s host, for tqdm postfixes."""
+    return f"{governor(url).rate:.2f}/s"
+
+
+def throttled(url: str, send: Callable[[], Any], retries: int = 3):
+    """Call ``send()`` when the governor for ``url`` allows it.
+
+    Requests the host rejects with 429 or 5xx are retried (after the
+    governor has backed off) up to ``retries`` times.
+    """
+    gov = governor(url)
+    attempt = 0
+    while True:
+        gov.acquire()
+        resp = send()
+        if not gov.feedback(resp) or attempt >= retries:
+            return resp
+        resp.close()
+        attempt += 1
@@ -0,0 +1,198 @@
+"""The citations table as an in-memory sparse graph.
+
+Edges run from a citing paper to one of our (cited) publications.
+DOI ids are renumbered densely on each side and the edges stored twice
+as NumPy index arrays: CSR (rows are citing papers) and CSC (rows are
+cited papers). Co-citation, bibliographic coupling and "cites several
+of ours" queries are then a gather and a ``bincount`` over those
+arrays. scipy is used for all-pairs co-citation if it is installed.
+"""
+
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def compress(
+    rows: np.ndarray, cols: np.ndarray, n: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(indptr, indices) of the ``n`` row sparse matrix with these entries."""
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    order = np.argsort(rows, kind="stable")
+    return indptr, cols[order].astype(np.int32)
+
+
+def gather(indptr: np.ndarray, indices: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """The column indices of all of ``rows`` concatenated."""
+    starts = indptr[rows]
+    lens = indptr[rows + 1] - starts
+    offsets = np.repeat(starts - (np.cumsum(lens) - lens), lens)
+    return indices[offsets + np.arange(len(offsets))]
+
+
+def topk(counts: np.ndarray, k: int) -> np.ndarray:
+    """Indexes of the ``k`` largest non-zero counts, largest first (ties
+    to the lowest index)."""
+    nz = np.flatnonzero(counts)
+    if len(nz) > k:
+        kth = np.partition(counts[nz], len(nz) - k)[len(nz) - k]
+        nz = nz[counts[nz] >= kth]
+    return nz[np.lexsort((nz, -counts[nz]))][:k]
+
+
+class CitationGraph:
+    """Bipartite graph of citing papers -> cited papers (both as dois.id)."""
+
+    def __init__(self, doi_id: np.ndarray, citedby_id: np.ndarray):
+        # dense numbering on each side: cited_ids[i] is the dois.id of cited i
+        self.cited_ids, dst = np.unique(doi_id, return_inverse=True)
+        self.citing_ids, src = np.unique(citedby_id, return_inverse=True)
+        self.nedges = len(src)
+        self.csr = compress(src, dst, len(self.citing_ids))
+        self.csc = compress(dst, src, len(self.cited_ids))
+
+    @classmethod
+    def load(cls, db, chunksize: int = 1_000_000) -> "CitationGraph":
+        """Read the whole citations table, ``chunksize`` rows at a time."""
+        c = db.citations
+        parts: List[np.ndarray] = []
+        with db.engine.connect() as conn:
+            conn = conn.execution_options(stream_results=True)
+            result = conn.execute(db.select([c.c.doi_id, c.c.citedby_id]))
+            while True:
+                rows = result.fetchmany(chunksize)
+                if not rows:
+                    break
+                flat = np.fromiter(
+                    chain.from_iterable(rows), dtype=np.int64, count=2 * len(rows)
+                )
+                parts.append(flat.reshape(-1, 2))
+        edges = np.concatenate(parts) if parts else np.zeros((0, 2), dtype=np.int64)
+        return cls(edges[:, 0], edges[:, 1])
+
+    def _index(self, ids: np.ndarray, doi_id: int) -> Optional[int]:
+        i = int(np.searchsorted(ids, doi_id))
+        return i if i < len(ids) and ids[i] == doi_id else None
+
+    def citers_degree(self) -> np.ndarray:
+        """How many of ours each citing paper cites."""
+        return np.diff(self.csr[0])
+
+    def cocited(self, doi_id: int, k: int = 20) -> Tuple[np.ndarray, np.ndarray]:
+        """Our papers most often cited together with ``doi_id``: (ids, counts)."""
+        p = self._index(self.cited_ids, doi_id)
+        if p is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        indptr, indices = self.csc
+        citers = indices[indptr[p] : indptr[p + 1]]
+        counts = np.bincount(gather(*self.csr, citers), minlength=len(self.cited_ids))
+        counts[p] = 0
+        top = topk(counts, k)
+        return self.cited_ids[top], counts[top]
+
+    def coupled(self, doi_id: int, k: int = 20) -> Tuple[np.ndarray, np.ndarray]:
+        """Citing papers sharing the most of our papers with citing ``doi_id``."""
+        q = self._index(self.citing_ids, doi_id)
+        if q is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        indptr, indices = self.csr
+        refs = indices[indptr[q] : indptr[q + 1]]
+        counts = np.bincount(gather(*self.csc, refs), minlength=len(self.citing_ids))
+        counts[q] = 0
+        top = topk(counts, k)
+        return self.citing_ids[top], counts[top]
+
+    def multi_citers(
+        self, at_least: int = 2, k: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """The (first ``k``) citing papers that cite ``at_least`` of ours,
+        most first."""
+        degree = self.citers_degree()
+        sel = np.flatnonzero(degree >= at_least)
+        sel = sel[np.lexsort((sel, -degree[sel]))][:k]
+        return self.citing_ids[sel], degree[sel]
+
+    def top_citers(
+        self, k: int = 20, among: Optional[Iterable[int]] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """The citing papers that cite most of ours (or of ``among``)."""
+        if among is None:
+            counts = self.citers_degree()
+        else:
+            ps = np.flatnonzero(np.isin(self.cited_ids, list(among)))
+            counts = np.bincount(gather(*self.csc, ps), minlength=len(self.citing_ids))
+        top = topk(counts, k)
+        return self.citing_ids[top], counts[top]
+
+    def cocited_pairs(self, k: int = 20) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """The ``k`` pairs of our papers most often cited together."""
+        try:
+            from scipy import sparse
+        except ImportError:
+            return self._cocited_pairs_numpy(k)
+        indptr, indices = self.csr
+        a = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.int32), indices, indptr),
+            shape=(len(self.citing_ids), len(self.cited_ids)),
+        )
+        c = sparse.triu(a.T @ a, k=1).tocoo()
+        top = topk(c.data, k)
+        return self.cited_ids[c.row[top]], self.cited_ids[c.col[top]], c.data[top]
+
+    def _cocited_pairs_numpy(self, k: int):
+        # one row of the co-citation matrix at a time keeps memory bounded
+        best: Dict[Tuple[int, int], int] = {}
+        floor = 0
+        indptr, indices = self.csc
+        for p in range(len(self.cited_ids)):
+            citers = indices[indptr[p] : indptr[p + 1]]
+            counts = np.bincount(
+                gather(*self.csr, citers), minlength=len(self.cited_ids)
+            )
+            counts[: p + 1] = 0
+            counts[counts <= floor] = 0
+            for q in topk(counts, k):
+                best[(p, int(q))] = int(counts[q])
+            if len(best) > k:
+                keep = sorted(best.items(), key=lambda kv: -kv[1])[:k]
+                best = dict(keep)
+                floor = keep[-1][1] - 1
+        pairs = sorted(best.items(), key=lambda kv: (-kv[1], kv[0]))[:k]
+        ps = np.array([p for (p, _), _ in pairs], dtype=np.int64)
+        qs = np.array([q for (_, q), _ in pairs], dtype=np.int64)
+        n = np.array([n for _, n in pairs], dtype=np.int64)
+        return self.cited_ids[ps], self.cited_ids[qs], n
+
+
+def doi_ids(db, dois: Iterable[str]) -> Dict[str, int]:
+    """DOI -> dois.id for those of (canonical) ``dois`` we know about, in
+    the order given."""
+    d = db.dois
+    dois = list(dois)
+    q = db.select([d.c.id, d.c.doi]).where(d.c.doi.in_(dois))
+    ids = {r.doi: r.id for r in db.execute(q)}
+    return {doi: ids[doi] for doi in dois if doi in ids}
+
+
+def doi_names(db, ids: Iterable[int]) -> Dict[int, str]:
+    """dois.id -> DOI for ``ids``."""
+    from .ncbi import chunks
+
+    d = db.dois
+    ret: Dict[int, str] = {}
+    for chunk in chunks(sorted({int(i) for i in ids}), 500):
+        for r in db.execute(db.select([d.c.id, d.c.doi]).where(d.c.id.in_(chunk))):
+            ret[r.id] = r.doi
+    return ret
+
+
+def frame(db, columns: Dict[str, np.ndarray], id_columns: List[str]) -> pd.DataFrame:
+    """A result as a DataFrame with the ``id_columns`` turned into DOIs."""
+    df = pd.DataFrame(columns)
+    names = doi_names(db, chain.from_iterable(df[c] for c in id_columns))
+    for c in id_columns:
+        df[c] = df[c].map(names)
+    return df
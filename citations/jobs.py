@@ -0,0 +1,285 @@
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import click
+
+# job status
+PENDING = 0
+LEASED = 1
+DONE = 2
+
+LEASE = timedelta(minutes=10)
+
+
+def make_owner() -> str:
+    """A name for this worker that is unique across hosts."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def todo_query(db, kind: str):
+    """SELECT of the keys that still need doing for ``kind``."""
+    from sqlalchemy import and_, null, or_
+
+    from .retry import due
+
+    if kind == "ncbi-metadata":
+        # citing DOIs without any metadata (or due a retry)
+        m, c, d = db.meta_table, db.citations, db.dois
+        j = c.join(d, c.c.citedby_id == d.c.id).outerjoin(m, m.c.doi_id == d.c.id)
+        return (
+            db.select([d.c.doi.label("key")])
+            .select_from(j)
+            .where(or_(m.c.id == null(), due(m)))
+            .distinct()
+        )
+    if kind == "ncbi-json":
+        p, n = db.publications, db.ncbi_table
+        j = p.outerjoin(n, p.c.pubmed == n.c.pubmed)
+        return (
+            db.select([p.c.pubmed.label("key")])
+            .select_from(j)
+            .where(or_(n.c.pubmed == null(), due(n)))
+            .where(and_(p.c.pubmed != null(), p.c.pubmed != ""))
+            .distinct()
+        )
+    if kind == "crossref":
+        # citing DOIs that aren't in PubMed
+        m, d = db.meta_table, db.dois
+        return (
+            db.select([d.c.doi.label("key")])
+            .select_from(m.join(d, m.c.doi_id == d.c.id))
+            .where((m.c.status == -1) & (m.c.source == "ncbi"))
+            .distinct()
+        )
+    if kind == "scan":
+        p = db.publications
+        return (
+            db.select([p.c.doi.label("key")])
+            .where(p.c.ncitations < 0)
+            .where(and_(p.c.doi != null(), p.c.doi != ""))
+            .distinct()
+        )
+    raise ValueError(f"unknown job kind {kind}")
+
+
+def populate(db, kind: str) -> int:
+    """Queue everything ``kind`` still has to do.
+
+    New keys are added and finished jobs whose keys need doing
+    again (e.g. after ``--redo-failed``) go back to pending.
+    """
+    from sqlalchemy import literal
+
+    j = db.jobs
+    todo = todo_query(db, kind).alias("todo")
+    with db.engine.begin() as conn:
+        r = conn.execute(
+            db.insert_ignore(j).from_select(
+                ["kind", "key"],
+                db.select([literal(kind), todo.c.key]),
+            )
+        )
+        added = r.rowcount
+        conn.execute(
+            j.update()  # pylint: disable=no-value-for-parameter
+            .where(j.c.kind == kind)
+            .where(j.c.status == DONE)
+            .where(j.c.key.in_(db.select([todo.c.key])))
+            .values(status=PENDING, updated=datetime.utcnow())
+        )
+    return added
+
+
+def claimable(db, kind: str, now: datetime):
+    from sqlalchemy import and_, null, or_
+
+    j = db.jobs
+    return and_(
+        j.c.kind == kind,
+        or_(
+            # unless it failed and isn't due another try yet
+            and_(
+                j.c.status == PENDING,
+                or_(j.c.next_attempt == null(), j.c.next_attempt <= now),
+            ),
+            # a worker that stopped heartbeating
+            and_(j.c.status == LEASED, j.c.lease_until < now),
+        ),
+    )
+
+
+def claim(
+    db, kind: str, owner: str, n: int, lease: timedelta = LEASE
+) -> Dict[int, str]:
+    """Lease up to ``n`` jobs of ``kind`` to ``owner``. Returns {job id: key}.
+
+    Jobs whose lease has expired are reclaimed. On PostgreSQL rows
+    locked by another claim are skipped; everywhere the UPDATE re-checks
+    that a job is still claimable so two workers never get the same job.
+    """
+    j = db.jobs
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        q = (
+            db.select([j.c.id])
+            .where(claimable(db, kind, now))
+            .order_by(j.c.id)
+            .limit(n)
+        )
+        if db.is_postgres:
+            q = q.with_for_update(skip_locked=True)
+        ids = [r.id for r in conn.execute(q)]
+        if not ids:
+            return {}
+        conn.execute(
+            j.update()  # pylint: disable=no-value-for-parameter
+            .where(j.c.id.in_(ids))
+            .where(claimable(db, kind, now))
+            .values(
+                status=LEASED,
+                owner=owner,
+                lease_until=now + lease,
+                attempts=j.c.attempts + 1,
+                next_attempt=None,
+                updated=now,
+            )
+        )
+        q = db.select([j.c.id, j.c.key]).where(j.c.id.in_(ids))
+        q = q.where(j.c.owner == owner).where(j.c.status == LEASED)
+        return {r.id: r.key for r in conn.execute(q)}
+
+
+def heartbeat(db, owner: str, lease: timedelta = LEASE) -> int:
+    """Extend the leases held by ``owner``."""
+    j = db.jobs
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        r = conn.execute(
+            j.update()  # pylint: disable=no-value-for-parameter
+            .where(j.c.owner == owner)
+            .where(j.c.status == LEASED)
+            .values(lease_until=now + lease, updated=now)
+        )
+    return r.rowcount
+
+
+def finish(db, owner: str, ids: List[int], status: int = DONE):
+    """Mark ``owner``'s jobs done (or, with ``status=PENDING``, hand them back)."""
+    j = db.jobs
+    with db.engine.begin() as conn:
+        conn.execute(
+            j.update()  # pylint: disable=no-value-for-parameter
+            .where(j.c.id.in_(ids))
+            .where(j.c.owner == owner)
+            .values(
+                status=status, owner=None, lease_until=None, updated=datetime.utcnow()
+            )
+        )
+
+
+def retry_later(db, owner: str, delays: Dict[int, float]):
+    """Hand ``owner``'s jobs back to be claimed again after {job id: seconds}."""
+    from sqlalchemy import bindparam
+
+    if not delays:
+        return
+    j = db.jobs
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(
+            j.update()  # pylint: disable=no-value-for-parameter
+            .where(j.c.id == bindparam("b_id"))
+            .where(j.c.owner == owner)
+            .values(
+                status=PENDING,
+                owner=None,
+                lease_until=None,
+                next_attempt=bindparam("b_next"),
+                updated=now,
+            ),
+            [
+                dict(b_id=i, b_next=now + timedelta(seconds=delay))
+                for i, delay in delays.items()
+            ],
+        )
+
+
+def waiting(db, kind: str) -> Tuple[int, Optional[datetime]]:
+    """Number of ``kind`` jobs waiting for a retry and when the first falls due."""
+    from sqlalchemy import func
+
+    j = db.jobs
+    q = db.select([func.count(), func.min(j.c.next_attempt)])
+    q = q.where(j.c.kind == kind).where(j.c.status == PENDING)
+    q = q.where(j.c.next_attempt > datetime.utcnow())
+    n, first = db.execute(q)[0]
+    return n, first
+
+
+class Heartbeat(threading.Thread):
+    """Keep our leases alive while a batch is being worked on."""
+
+    def __init__(self, db, owner: str, lease: timedelta = LEASE):
+        super().__init__(daemon=True)
+        self.db = db
+        self.owner = owner
+        self.lease = lease
+        self.stopped = threading.Event()
+
+    def run(self):
+        interval = self.lease.total_seconds() / 3
+        while not self.stopped.wait(interval):
+            heartbeat(self.db, self.owner, self.lease)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def work(
+    db,
+    kind: str,
+    process: Callable[[List[str]], Optional[Dict[str, float]]],
+    batch_size: int = 500,
+    lease: timedelta = LEASE,
+    owner: Optional[str] = None,
+) -> int:
+    """Claim batches of ``kind`` jobs and ``process`` their keys until
+    no job is ready. Returns the number of jobs done.
+
+    ``process`` can return {key: seconds} for keys that failed: rather
+    than waiting for them (and keeping the lease alive meanwhile) their
+    jobs are handed back to be claimed after that long. If ``process``
+    raises, the batch is handed back for another worker.
+    """
+    owner = owner or make_owner()
+    done = 0
+    beat = Heartbeat(db, owner, lease)
+    beat.start()
+    try:
+        while True:
+            jobs = claim(db, kind, owner, batch_size, lease)
+            if not jobs:
+                break
+            try:
+                later = process(list(jobs.values())) or {}
+            except BaseException:
+                finish(db, owner, list(jobs), status=PENDING)
+                raise
+            delays = {i: later[key] for i, key in jobs.items() if key in later}
+            retry_later(db, owner, delays)
+            finish(db, owner, [i for i in jobs if i not in delays])
+            done += len(jobs) - len(delays)
+            click.secho(f"{owner}: {done} {kind} jobs done", fg="green")
+    finally:
+        beat.stop()
+    n, first = waiting(db, kind)
+    if n:
+        click.secho(
+            f"{n} {kind} jobs to retry from {first:%Y-%m-%d %H:%M} UTC", fg="yellow"
+        )
+    return done
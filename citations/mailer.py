@@ -4,7 +4,10 @@ import smtplib
 from email.mime.text import MIMEText
 from typing import List, Optional, Union
 
+import click
+
 from . import config
+from .cli import cli
 
 
 def sendmail(
@@ -26,3 +29,12 @@ def sendmail(
     with smtplib.SMTP() as s:
         s.connect(mailhost)
         s.sendmail(me, [you], msg.as_string())
+
+
+@cli.command()
+@click.argument("email")
+@click.argument("message")
+def test_email(email, message):
+    """Test email."""
+    sendmail(message, email)
+    click.secho("email sent!", fg="green")
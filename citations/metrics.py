@@ -0,0 +1,238 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# latency buckets in seconds
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+PREFIX = "citations_"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the ``q`` quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        n = 0
+        for b, c in zip(self.buckets, self.counts):
+            n += c
+            if n >= rank:
+                return b
+        return self.buckets[-1]
+
+
+class Registry:
+    """Thread safe counters and histograms keyed on name and labels."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.start = time.time()
+
+    def inc(self, name: str, value: float = 1.0, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = Histogram()
+            h.observe(value)
+
+    def prometheus(self) -> str:
+        """The Prometheus text exposition format."""
+
+        def fmt(labels: Labels, **extra) -> str:
+            items = list(labels) + list(extra.items())
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        lines: List[str] = []
+        with self.lock:
+            for (name, labels), v in sorted(self.counters.items()):
+                lines.append(f"{PREFIX}{name}{fmt(labels)} {v:g}")
+            for (name, labels), h in sorted(self.histograms.items()):
+                n = 0
+                for b, c in zip(h.buckets, h.counts):
+                    n += c
+                    le = "+Inf" if b == float("inf") else f"{b:g}"
+                    lines.append(f"{PREFIX}{name}_bucket{fmt(labels, le=le)} {n}")
+                lines.append(f"{PREFIX}{name}_sum{fmt(labels)} {h.sum:g}")
+                lines.append(f"{PREFIX}{name}_count{fmt(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(
+                time=time.time(),
+                uptime=time.time() - self.start,
+                counters=[
+                    dict(name=name, labels=dict(labels), value=v)
+                    for (name, labels), v in self.counters.items()
+                ],
+                histograms=[
+                    dict(
+                        name=name,
+                        labels=dict(labels),
+                        count=h.count,
+                        sum=h.sum,
+                        p50=h.quantile(0.5),
+                        p95=h.quantile(0.95),
+                    )
+                    for (name, labels), h in self.histograms.items()
+                ],
+            )
+
+    def summary(self) -> List[dict]:
+        """One row per endpoint: requests, errors, bytes and latency."""
+        rows: Dict[str, dict] = {}
+        with self.lock:
+            for (name, labels), v in self.counters.items():
+                ep = dict(labels).get("endpoint")
+                if ep is None:
+                    continue
+                row = rows.setdefault(ep, dict(endpoint=ep))
+                row[name] = row.get(name, 0) + v
+            for (name, labels), h in self.histograms.items():
+                ep = dict(labels).get("endpoint")
+                if ep is None or name != "request_seconds":
+                    continue
+                row = rows.setdefault(ep, dict(endpoint=ep))
+                row["mean"] = h.sum / h.count if h.count else 0.0
+                row["p95"] = h.quantile(0.95)
+        return [rows[k] for k in sorted(rows)]
+
+    def timings(self) -> List[Tuple[str, int, float]]:
+        """(name, count, total seconds) for the non request timers."""
+        with self.lock:
+            return sorted(
+                (name + "".join(f" {v}" for _, v in labels), h.count, h.sum)
+                for (name, labels), h in self.histograms.items()
+                if name != "request_seconds"
+            )
+
+
+REGISTRY = Registry()
+
+
+def inc(name: str, value: float = 1.0, **labels: str):
+    REGISTRY.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels: str):
+    REGISTRY.observe(name, value, **labels)
+
+
+@contextmanager
+def timer(name: str, **labels: str) -> Iterator[None]:
+    """Record how long the block takes in the ``<name>_seconds`` histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+
+
+def request(
+    endpoint: str,
+    seconds: float,
+    nbytes: int = 0,
+    status: Optional[int] = None,
+    error: bool = False,
+):
+    """Record one HTTP request to ``endpoint``."""
+    observe("request_seconds", seconds, endpoint=endpoint)
+    inc("requests_total", endpoint=endpoint)
+    inc("response_bytes_total", nbytes, endpoint=endpoint)
+    if error or (status is not None and status >= 400):
+        inc("request_errors_total", endpoint=endpoint)
+
+
+def write(path: str):
+    """Write the metrics to ``path``: a Prometheus textfile if it
+    ends with .prom, otherwise append a JSON line."""
+    if path.endswith(".prom"):
+        # write then rename so node_exporter never sees half a file
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wt", encoding="utf-8") as fp:
+            fp.write(REGISTRY.prometheus())
+        os.replace(tmp, path)
+    else:
+        with open(path, "at", encoding="utf-8") as fp:
+            fp.write(json.dumps(REGISTRY.snapshot()) + "\n")
+
+
+class Writer(threading.Thread):
+    """Write the metrics to a file every ``interval`` seconds."""
+
+    def __init__(self, path: str, interval: float = 60.0):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            write(self.path)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        write(self.path)
+
+
+def summary_html() -> str:
+    """Metrics summary for the end of run email."""
+    from html import escape
+
+    rows = REGISTRY.summary()
+    if not rows:
+        return ""
+    out = [
+        "<table><tr><th>endpoint</th><th>requests</th><th>errors</th>"
+        "<th>cache hits</th><th>MB</th><th>mean s</th><th>p95 s</th></tr>"
+    ]
+    for r in rows:
+        out.append(
+            f"<tr><td>{escape(r['endpoint'])}</td>"
+            f"<td>{r.get('requests_total', 0):.0f}</td>"
+            f"<td>{r.get('request_errors_total', 0):.0f}</td>"
+            f"<td>{r.get('cache_hits_total', 0):.0f}</td>"
+            f"<td>{r.get('response_bytes_total', 0) / 1e6:.1f}</td>"
+            f"<td>{r.get('mean', 0):.2f}</td>"
+            f"<td>{r.get('p95', 0):g}</td></tr>"
+        )
+    out.append("</table>")
+    timings = REGISTRY.timings()
+    if timings:
+        out.append("<table><tr><th>timer</th><th>count</th><th>total s</th></tr>")
+        for name, n, total in timings:
+            out.append(
+                f"<tr><td>{escape(name)}</td><td>{n}</td><td>{total:.1f}</td></tr>"
+            )
+        out.append("</table>")
+    return "\n".join(out)
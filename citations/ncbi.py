@@ -1,166 +1,332 @@
-import time
+import json
+import re
 from io import BytesIO
-from typing import Any, Dict, Iterable
+from itertools import islice
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Union,
+)
 
-import requests
+from . import config, metrics, transport
 
+ESEARCH2 = f"{config.EUTILS}/esearch.fcgi"
+EFETCH = f"{config.EUTILS}/efetch.fcgi"
 
-ESEARCH2 = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
-EFETCH = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
 
+# EFetch takes a comma separated list of ids
+BATCH_SIZE = 200
+# number of DOIs OR'ed together into one ESearch term
+DOI_BATCH_SIZE = 50
+# an article of an EFetch response and its PMID (the first PMID
+# is the MedlineCitation's: CommentsCorrections ones come later)
+ARTICLE = re.compile(rb"<PubmedArticle>.*?</PubmedArticle>", re.S)
+PMID = re.compile(rb"<PMID[^>]*>(\d+)</PMID>")
 
-def fetchncbimeta(pubmed, email, session=None, headers=None):
+
+def chunks(it: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    it = iter(it)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def fetchncbimeta(pubmed: Union[str, List[str]], email, session=None, headers=None):
+    if not isinstance(pubmed, str):
+        pubmed = ",".join(pubmed)
     params = dict(db="pubmed", retmode="xml", id=pubmed, email=email)
-    resp = (session or requests).get(EFETCH, params=params, headers=headers)
+    if transport.API_KEY:
+        params["api_key"] = transport.API_KEY
 
+    # NCBI asks for POST when requesting many ids
+    if len(pubmed) > 300:
+        resp = transport.post(EFETCH, data=params, headers=headers, session=session)
+    else:
+        resp = transport.get(EFETCH, params=params, headers=headers, session=session)
+    resp.raise_for_status()
     return resp
 
 
-# pylint: disable=too-many-locals
+def split_articles(content: bytes) -> Dict[str, bytes]:
+    """The PubmedArticle elements of an EFetch response keyed by PMID."""
+    ret = {}
+    for m in ARTICLE.finditer(content):
+        pmid = PMID.search(m.group(0))
+        if pmid:
+            ret[pmid.group(1).decode("ascii")] = m.group(0)
+    return ret
+
+
+def fetch_articles(pmids: List[str], email: str, session=None, headers=None) -> bytes:
+    """An EFetch PubmedArticleSet for ``pmids``.
+
+    Articles are cached one by one (an empty entry for a PMID NCBI
+    didn't return) and only the PMIDs missing from the cache are
+    asked for.
+    """
+    got = transport.cached_records("ncbi-efetch", pmids)
+    todo = [pmid for pmid in pmids if pmid not in got]
+    if todo:
+        resp = fetchncbimeta(todo, email, session=session, headers=headers)
+        fetched = split_articles(resp.content)
+        # don't remember PMIDs as missing from a truncated response
+        if resp.content.rstrip().endswith(b"</PubmedArticleSet>"):
+            fetched.update((pmid, b"") for pmid in todo if pmid not in fetched)
+        transport.cache_records("ncbi-efetch", fetched)
+        got.update(fetched)
+    return (
+        b"<PubmedArticleSet>"
+        + b"".join(got.get(pmid, b"") for pmid in dict.fromkeys(pmids))
+        + b"</PubmedArticleSet>"
+    )
+
+
 def fetchncbi(
-    pubmed: str, email: str, full=True, session=None, headers=None
+    pubmed: Union[str, List[str]], email: str, full=True, session=None, headers=None
 ) -> Iterable[Dict[str, Any]]:
+
+    pmids = [pubmed] if isinstance(pubmed, str) else pubmed
+    content = fetch_articles(pmids, email, session=session, headers=headers)
+    with metrics.timer("parse", source="ncbi-efetch"):
+        records = list(parse_pubmed(content, full=full))
+    yield from records
+
+
+def fetchncbi_batch(
+    pmids: List[str], email: str, full=True, session=None, headers=None
+) -> Dict[str, Optional[Dict[str, Any]]]:
+    """Fetch a chunk of PMIDs in one EFetch request.
+
+    Returns a dictionary keyed by *all* the requested PMIDs. PMIDs
+    that NCBI didn't return are mapped to None.
+    """
+    ret: Dict[str, Optional[Dict[str, Any]]] = {pmid: None for pmid in pmids}
+    if not pmids:
+        return ret
+    for d in fetchncbi(pmids, email, full=full, session=session, headers=headers):
+        if d["pubmed"] in ret:
+            ret[d["pubmed"]] = d
+    return ret
+
+
+def parse_pubmed(content: bytes, full=True) -> Iterable[Dict[str, Any]]:
+    """The articles of an EFetch response.
+
+    An article that can't be parsed is reported and skipped so that
+    it doesn't take the rest of the batch down with it.
+    """
+    import click
     from lxml import etree as ET
 
-    resp = fetchncbimeta(pubmed, email, session=session, headers=headers)
-    try:
-        ipt = BytesIO(resp.content)
-        tree = ET.parse(ipt)
-        error = tree.getroot().tag
-        if error == "ERROR":  # no id
-            return
-        articles = tree.findall("PubmedArticle")
-        for pm_article in articles:
-            # for citation in citations:
-            citation = pm_article.find("MedlineCitation")
-            pmid = citation.findtext("PMID")
-            article = citation.find("Article")
+    tree = ET.parse(BytesIO(content))
+    if tree.getroot().tag == "ERROR":  # no id
+        return
+    for pm_article in tree.findall("PubmedArticle"):
+        try:
+            d = parse_article(pm_article, full=full)
+        except Exception as e:  # pylint: disable=broad-except
+            pmid = pm_article.findtext("MedlineCitation/PMID")
+            metrics.inc("parse_errors", source="ncbi-efetch")
+            click.secho(f"{pmid}: can't parse article: {e}", fg="red", err=True)
+            continue
+        yield d
 
-            title = article.findtext("ArticleTitle")
-            journal = article.find("Journal")
 
-            year = journal.findtext("JournalIssue/PubDate/Year")
-            year = year or journal.findtext("JournalIssue/PubDate/MedlineDate")
-            year = year.strip()[:4]
+# pylint: disable=too-many-locals
+def parse_article(pm_article, full=True) -> Dict[str, Any]:
+    # for citation in citations:
+    citation = pm_article.find("MedlineCitation")
+    pmid = citation.findtext("PMID")
+    article = citation.find("Article")
 
-            year = int(year)
+    title = article.findtext("ArticleTitle")
+    journal = article.find("Journal")
 
-            ids = pm_article.findall(
-                "PubmedData/ArticleIdList/ArticleId[@IdType='doi']"
-            )
-            pmc = pm_article.findall(
-                "PubmedData/ArticleIdList/ArticleId[@IdType='pmc']"
-            )
-            doi = ids[0].text if ids else None
-            pmc = pmc[0].text if pmc else None
-            # if doi: doi = 'http://dx.doi.org/'+doi
-            if not full:
-                yield {
-                    "pubmed": pmid,
-                    "year": year,
-                    "title": title,
-                    "doi": doi,
-                    "pmc": pmc,
-                }
-                continue
-                # doi = [i.text for i in ids if i.attrib.get('IdType') == 'doi']
-                # if doi: doi=doi[0]
-                # else: doi=''
-            name = journal.findtext("ISOAbbreviation", None) or journal.findtext(
-                "Title", ""
-            )
-            volume = journal.findtext("JournalIssue/Volume")
-            issue = journal.findtext("JournalIssue/Issue")
-            abstract = article.findtext("Abstract/AbstractText")
-            pages = article.findtext("Pagination/MedlinePgn")
-            authors = article.findall("AuthorList/Author")
-
-            # elementtree tries to encode everything as ascii
-            # or if that fails it leaves the string alone
-            def findaffiliation(node):
-                return node.findtext("AffiliationInfo/Affiliation") or ""
-
-            def aff(node):
-                # affiliation = n.findtext('AffiliationInfo/Affiliation')
-                for ai in node.xpath(".//AffiliationInfo"):
-                    grid = [a.text for a in ai.xpath('.//Identifier[@Source="GRID"]')]
-                    isni = [a.text for a in ai.xpath('.//Identifier[@Source="ISNI"]')]
-                    affiliation = [a.text for a in ai.xpath(".//Affiliation")]
-                    yield dict(
-                        grid=grid[0] if grid else None,
-                        isni=isni[0] if isni else None,
-                        affiliation=affiliation[0],
-                    )
-
-            def toadict(a):
-                return {
-                    "lastname": a.findtext("LastName"),
-                    "forename": a.findtext("ForeName"),
-                    "initials": a.findtext("Initials"),
-                    "affiliations": list(aff(a)),
-                    "affiliation": findaffiliation(a),
-                    "orcid": " ".join(
-                        [o.text for o in a.xpath('.//Identifier[@Source="ORCID"]')]
-                    ),
-                }
-
-            alist = [
-                toadict(a) for a in authors if not list(a.xpath(".//CollectiveName"))
-            ]
-
-            alist.extend(
-                [
-                    toadict(a)
-                    for a in pm_article.xpath(".//InvestigatorList/Investigator")
-                ]
+    year = journal.findtext("JournalIssue/PubDate/Year")
+    year = year or journal.findtext("JournalIssue/PubDate/MedlineDate")
+    year = year.strip()[:4]
+
+    year = int(year)
+
+    ids = pm_article.findall("PubmedData/ArticleIdList/ArticleId[@IdType='doi']")
+    pmc = pm_article.findall("PubmedData/ArticleIdList/ArticleId[@IdType='pmc']")
+    doi = ids[0].text if ids else None
+    pmc = pmc[0].text if pmc else None
+    # if doi: doi = 'http://dx.doi.org/'+doi
+    if not full:
+        return {
+            "pubmed": pmid,
+            "year": year,
+            "title": title,
+            "doi": doi,
+            "pmc": pmc,
+        }
+        # doi = [i.text for i in ids if i.attrib.get('IdType') == 'doi']
+        # if doi: doi=doi[0]
+        # else: doi=''
+    name = journal.findtext("ISOAbbreviation", None) or journal.findtext("Title", "")
+    volume = journal.findtext("JournalIssue/Volume")
+    issue = journal.findtext("JournalIssue/Issue")
+    abstract = article.findtext("Abstract/AbstractText")
+    pages = article.findtext("Pagination/MedlinePgn")
+    authors = article.findall("AuthorList/Author")
+
+    # elementtree tries to encode everything as ascii
+    # or if that fails it leaves the string alone
+    def findaffiliation(node):
+        return node.findtext("AffiliationInfo/Affiliation") or ""
+
+    def aff(node):
+        # affiliation = n.findtext('AffiliationInfo/Affiliation')
+        for ai in node.xpath(".//AffiliationInfo"):
+            grid = [a.text for a in ai.xpath('.//Identifier[@Source="GRID"]')]
+            isni = [a.text for a in ai.xpath('.//Identifier[@Source="ISNI"]')]
+            affiliation = [a.text for a in ai.xpath(".//Affiliation")]
+            yield dict(
+                grid=grid[0] if grid else None,
+                isni=isni[0] if isni else None,
+                affiliation=affiliation[0],
             )
-            # author = alist[0]
-            yield {
-                "pubmed": pmid,
-                "year": year,
-                "title": title,
-                "abstract": abstract,
-                "authors": alist,
-                "journal": name,
-                "volume": volume,
-                "issue": issue,
-                "pages": pages,
-                "doi": doi,
-                "pmc": pmc
-                # 'xml':xml
-            }
 
-    finally:
-        pass
+    def toadict(a):
+        return {
+            "lastname": a.findtext("LastName"),
+            "forename": a.findtext("ForeName"),
+            "initials": a.findtext("Initials"),
+            "affiliations": list(aff(a)),
+            "affiliation": findaffiliation(a),
+            "orcid": " ".join(
+                [o.text for o in a.xpath('.//Identifier[@Source="ORCID"]')]
+            ),
+        }
+
+    alist = [toadict(a) for a in authors if not list(a.xpath(".//CollectiveName"))]
+
+    alist.extend(
+        [toadict(a) for a in pm_article.xpath(".//InvestigatorList/Investigator")]
+    )
+    # author = alist[0]
+    return {
+        "pubmed": pmid,
+        "year": year,
+        "title": title,
+        "abstract": abstract,
+        "authors": alist,
+        "journal": name,
+        "volume": volume,
+        "issue": issue,
+        "pages": pages,
+        "doi": doi,
+        "pmc": pmc,
+        # 'xml':xml
+    }
 
 
 def ncbi_esearch(
-    query: str, email: str, retmax=10000, session=None, headers: dict = None
+    query: str,
+    email: str,
+    retmax=10000,
+    session=None,
+    headers: dict = None,
+    cache: bool = True,
 ) -> Dict[str, Any]:
 
     values = dict(
         db="pubmed", retmode="json", retmax=str(retmax), term=query, email=email
     )
+    if transport.API_KEY:
+        values["api_key"] = transport.API_KEY
     if len(query) > 300:
-        fp = (session or requests).post(ESEARCH2, data=values, headers=headers)
+        fp = transport.post(
+            ESEARCH2,
+            data=values,
+            headers=headers,
+            session=session,
+            cache="ncbi-esearch" if cache else None,
+        )
     else:
-        fp = (session or requests).get(ESEARCH2, params=values, headers=headers)
+        fp = transport.get(
+            ESEARCH2,
+            params=values,
+            headers=headers,
+            session=session,
+            cache="ncbi-esearch" if cache else None,
+        )
     try:
-        return fp.json()
+        fp.raise_for_status()
+        with metrics.timer("parse", source="ncbi-esearch"):
+            return fp.json()
 
     finally:
         fp.close()
 
 
 def ncbi_fetchdoi(
-    doi: str, email: str, sleep=1.0, session=None, headers=None
+    doi: str, email: str, session=None, headers=None
 ) -> Iterable[Dict[str, Any]]:
 
     r = ncbi_esearch(f"{doi}[DOI]", email, session=session, headers=headers)
     if "esearchresult" in r:
         for pmid in r["esearchresult"]["idlist"]:
-            if sleep:
-                time.sleep(sleep)
             yield from fetchncbi(
                 pmid, email, full=True, session=session, headers=headers
             )
+
+
+def ncbi_fetchdois(
+    dois: List[str],
+    email: str,
+    session=None,
+    headers=None,
+    known: Optional[Callable[[List[str]], Mapping[str, Mapping[str, Any]]]] = None,
+) -> Dict[str, List[Mapping[str, Any]]]:
+    """Resolve a chunk of DOIs with one (OR'ed) ESearch query.
+
+    Returns a dictionary keyed by *all* the requested DOIs with the
+    list of full NCBI records whose ``doi`` matches. DOIs without a
+    PubMed entry are mapped to an empty list. ``known(pmids)`` can
+    supply records we already have so they aren't fetched again.
+    """
+    ret: Dict[str, List[Mapping[str, Any]]] = {doi: [] for doi in dois}
+    if not dois:
+        return ret
+    lookup = {doi.lower(): doi for doi in dois}
+    # DOI -> PMIDs found by earlier searches (cached per DOI so they
+    # are found whichever batch the DOI falls in)
+    cached = transport.cached_records("ncbi-esearch", list(lookup))
+    pmids = [pmid for v in cached.values() for pmid in json.loads(v)]
+    todo = [doi for doi in dois if doi.lower() not in cached]
+    if todo:
+        term = " OR ".join(f'"{doi}"[DOI]' for doi in todo)
+        r = ncbi_esearch(term, email, session=session, headers=headers, cache=False)
+        if "esearchresult" not in r:
+            todo = []
+        else:
+            pmids.extend(r["esearchresult"]["idlist"])
+    pmids = list(dict.fromkeys(pmids))
+    have = known(pmids) if known is not None and pmids else {}
+    records: List[Mapping[str, Any]] = list(have.values())
+    for chunk in chunks([pmid for pmid in pmids if pmid not in have], BATCH_SIZE):
+        records.extend(
+            fetchncbi(chunk, email, full=True, session=session, headers=headers)
+        )
+    for d in records:
+        doi = lookup.get((d["doi"] or "").lower())
+        if doi is not None:
+            ret[doi].append(d)
+    transport.cache_records(
+        "ncbi-esearch",
+        {
+            doi.lower(): json.dumps([d["pubmed"] for d in ret[doi]]).encode()
+            for doi in todo
+        },
+    )
+    return ret
@@ -1,28 +1,18 @@
-import click
+def update_from_petals(
+    db,
+    url="mongodb://127.0.0.1:27018/personnel",
+    full=False,
+    updated_field=None,
+    full_every=None,
+):
+    from .sync import sync_from_mongo
 
-
-def update_from_petals(db, url="mongodb://127.0.0.1:27018/personnel"):
-    import pandas as pd
-    from pymongo import MongoClient
-    from sqlalchemy import select
-
-    c = MongoClient(url)
-    mdb = c.get_default_database()
-    all_pubs = list(
-        mdb.publications.find({}, projection=["title", "doi", "pubmed", "year"])
+    # petals publications are keyed by pubmed id
+    return sync_from_mongo(
+        db,
+        url,
+        require="pubmed",
+        full=full,
+        updated_field=updated_field,
+        full_every=full_every,
     )
-    all_pubs = pd.DataFrame.from_records(all_pubs)
-    all_pubs = all_pubs.drop("_id", axis="columns")
-    all_pubs.year = all_pubs.year.astype(int)
-    all_pubs.ncitations = -1
-    all_pubs = all_pubs[~all_pubs.pubmed.isna()]
-
-    p = db.publications
-    q = select([p.c.pubmed]).where(p.c.pubmed.in_(all_pubs.pubmed.to_list()))
-
-    done = {r.pubmed for r in db.execute(q)}
-
-    all_pubs = all_pubs[~all_pubs.pubmed.isin(done)]
-    click.secho(f"found {len(all_pubs)} new publications", fg="green")
-
-    all_pubs.to_sql("publications", con=db.engine, index=False, if_exists="append")
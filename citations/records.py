@@ -0,0 +1,66 @@
+"""The ``records`` table: every NCBI record we have, stored once by PMID.
+
+ncbi-json, ncbi-metadata and add-publications all look here before
+asking EFetch for a record, and ``metadata``/``ncbi_meta`` rows refer
+to their record by ``pubmed`` rather than holding a copy.
+"""
+
+from datetime import datetime
+from functools import partial
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+
+from .codec import LazyRecord
+
+
+def lookup(db, pmids: Iterable[str]) -> Dict[str, LazyRecord]:
+    """The stored records of any of ``pmids`` we already have."""
+    from .ncbi import chunks
+
+    r = db.records
+    ret: Dict[str, LazyRecord] = {}
+    with db.engine.connect() as conn:
+        for chunk in chunks(sorted(set(pmids)), 500):
+            q = db.select([r.c.pubmed, r.c.record]).where(r.c.pubmed.in_(chunk))
+            for row in conn.execute(q):
+                ret[row.pubmed] = row.record
+    return ret
+
+
+def fetch_missing(
+    db, pmids: List[str], email: str, headers=None
+) -> Dict[str, Optional[Mapping[str, Any]]]:
+    """:func:`ncbi.fetchncbi_batch` that only asks EFetch for records we don't have."""
+    from .ncbi import fetchncbi_batch
+
+    have = lookup(db, pmids)
+    got = fetchncbi_batch(
+        [pmid for pmid in pmids if pmid not in have], email, full=True, headers=headers
+    )
+    return {pmid: have.get(pmid) or got.get(pmid) for pmid in pmids}
+
+
+def is_new(d: Optional[Mapping[str, Any]]) -> bool:
+    """True for a record that has just been fetched (rather than looked up)."""
+    return bool(d) and not isinstance(d, LazyRecord)
+
+
+def save(db, writer, records: Iterable[Optional[Mapping[str, Any]]]) -> int:
+    """Store newly fetched ``records`` and their authors (see :mod:`authors`)
+    in the same flush of ``writer``, so a record is never stored without
+    its authors.
+
+    Records that came out of the store are skipped. Returns the number saved.
+    """
+    from .authors import write_authors
+
+    new = {d["pubmed"]: d for d in records if is_new(d)}
+    if not new:
+        return 0
+    now = datetime.utcnow()
+    # queued first: the execute below may flush straight away
+    writer.call(partial(write_authors, db, records=list(new.values())))
+    writer.execute(
+        db.add_record,
+        [dict(pubmed=pmid, record=d, fetched=now) for pmid, d in new.items()],
+    )
+    return len(new)
@@ -0,0 +1,187 @@
+"""Bibliometrics of our publications: h-index, i10 and citation totals,
+overall, per author and per lab and year.
+
+Citation numbers come from ``citation_counts`` (see :mod:`counts`) and
+authors from the ``authors`` table (see :mod:`authors`). A lab is the
+last author of a paper (by the usual convention, the head of the lab).
+The frames loaded from the database are cached on disk keyed by a
+fingerprint of the tables they come from, so a repeat report against
+an unchanged database doesn't touch it again.
+"""
+
+import hashlib
+import os
+from glob import glob
+from html import escape
+from typing import Dict, Optional
+
+import click
+import pandas as pd
+
+Frames = Dict[str, pd.DataFrame]
+
+
+def fingerprint(db) -> str:
+    """Changes whenever any table the report reads from changes."""
+    from sqlalchemy import func
+
+    p, a, cc = db.publications, db.authors, db.citation_counts
+    qs = [
+        db.select(
+            [
+                func.count(),
+                func.max(p.c.id),
+                func.count(p.c.doi),
+                func.count(p.c.pubmed),
+                func.sum(p.c.year),
+            ]
+        ),
+        db.select([func.count(), func.max(a.c.id)]),
+        db.select([func.count(), func.sum(cc.c.total), func.max(cc.c.updated)]),
+    ]
+    version = repr([tuple(db.execute(q)[0]) for q in qs])
+    return hashlib.sha1(version.encode("utf-8")).hexdigest()
+
+
+def load(db) -> Frames:
+    """Our publications with their citation counts, who wrote them and
+    when they were cited."""
+    from sqlalchemy import func
+
+    p, d, cc, a = db.publications, db.dois, db.citation_counts, db.authors
+    cy = db.citation_years
+    j = p.outerjoin(d, d.c.doi == func.lower(p.c.doi)).outerjoin(
+        cc, cc.c.doi_id == d.c.id
+    )
+    q = db.select(
+        [
+            p.c.id,
+            p.c.doi,
+            p.c.pubmed,
+            p.c.year,
+            d.c.id.label("doi_id"),
+            func.coalesce(cc.c.total, 0).label("citations"),
+        ]
+    ).select_from(j)
+    pubs = pd.read_sql_query(q, con=db.engine)
+    pubs["year"] = pubs["year"].astype("Int64")
+
+    q = db.select(
+        [p.c.id, a.c.position, a.c.lastname, a.c.initials, a.c.orcid]
+    ).select_from(p.join(a, a.c.pubmed == p.c.pubmed))
+    authorship = pd.read_sql_query(q, con=db.engine)
+    cited = pd.read_sql_query(db.select([cy]), con=db.engine)
+    return dict(pubs=pubs, authorship=authorship, cited=cited)
+
+
+def cached_load(db, cache_dir: Optional[str] = None) -> Frames:
+    """:func:`load` through the on-disk cache (none if ``cache_dir`` is None)."""
+    if cache_dir is None:
+        return load(db)
+    stem = hashlib.sha1(str(db.engine.url).encode("utf-8")).hexdigest()[:12]
+    path = os.path.join(cache_dir, f"report-{stem}-{fingerprint(db)[:16]}.pkl")
+    if os.path.exists(path):
+        return pd.read_pickle(path)
+    frames = load(db)
+    os.makedirs(cache_dir, exist_ok=True)
+    # only the latest version of each database is worth keeping
+    for old in glob(os.path.join(cache_dir, f"report-{stem}-*.pkl")):
+        os.remove(old)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    pd.to_pickle(frames, tmp)
+    os.replace(tmp, path)
+    return frames
+
+
+def impact(df: pd.DataFrame, by) -> pd.DataFrame:
+    """Publications, citations, h-index and i10-index of each ``by`` group.
+
+    ``df`` has one row per (group, publication) with a ``citations`` column.
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    df = df.sort_values(by + ["citations"], ascending=[True] * len(by) + [False])
+    rank = df.groupby(by, sort=False, dropna=False).cumcount() + 1
+    # citations are descending within a group so this is true for exactly
+    # the first h papers
+    df = df.assign(h=df["citations"] >= rank, i10=df["citations"] >= 10)
+    g = df.groupby(by, sort=False, dropna=False)
+    out = pd.DataFrame(
+        {
+            "publications": g.size(),
+            "citations": g["citations"].sum(),
+            "h_index": g["h"].sum(),
+            "i10": g["i10"].sum(),
+        }
+    )
+    return out.reset_index().sort_values(
+        ["h_index", "citations"], ascending=False, ignore_index=True
+    )
+
+
+def report(frames: Frames) -> Frames:
+    """The report tables: summary, years, authors and labs."""
+    pubs, authorship, cited = frames["pubs"], frames["authorship"], frames["cited"]
+
+    summary = impact(pubs.assign(all="all"), "all").drop(columns=["all"])
+    summary["mean_citations"] = (summary.citations / summary.publications).round(2)
+
+    cited = cited[cited.doi_id.isin(pubs.doi_id.dropna().unique())]
+    years = cited.groupby("year", as_index=False).agg(
+        citations=("n", "sum"), publications_cited=("doi_id", "nunique")
+    )
+
+    name = authorship.lastname.fillna("") + " " + authorship.initials.fillna("")
+    authorship = authorship.assign(name=name.str.strip())
+    # the same person under one key where we can
+    authorship["author"] = authorship.orcid.fillna(authorship["name"])
+    per_paper = authorship.merge(pubs[["id", "year", "citations"]], on="id")
+
+    last = per_paper.position == per_paper.groupby("id").position.transform("max")
+    labs = impact(per_paper[last].rename(columns={"name": "lab"}), ["lab", "year"])
+    labs = labs.sort_values(["lab", "year"], ignore_index=True)
+
+    per_paper = per_paper.drop_duplicates(["author", "id"])
+    authors = impact(per_paper, "author")
+    # show a name alongside ORCID iDs
+    names = per_paper.groupby("author")["name"].first()
+    authors.insert(1, "name", authors.author.map(names))
+    return dict(summary=summary, years=years, authors=authors, labs=labs)
+
+
+TITLES = {
+    "summary": "All publications",
+    "years": "Citations by citing year",
+    "authors": "Per author",
+    "labs": "Per lab (last author) and publication year",
+}
+
+
+def to_html(tables: Frames, top: Optional[int] = None) -> str:
+    """The report as an HTML fragment (e.g. for :func:`mailer.sendmail`)."""
+    out = []
+    for name, df in tables.items():
+        out.append(f"<h3>{escape(TITLES.get(name, name))}</h3>")
+        if top is not None and name in ("authors", "labs") and len(df) > top:
+            df = df.head(top)
+            out.append(f"<p>top {top} of {len(tables[name])}</p>")
+        out.append(df.to_html(index=False, border=0, na_rep=""))
+    return "\n".join(out)
+
+
+def write(tables: Frames, filename: str, top: Optional[int] = None):
+    """Write the report to ``filename``: one HTML page or, for .csv and
+    .parquet, a ``<name>-<table>.<ext>`` file per table."""
+    if filename.endswith((".html", ".htm")):
+        with open(filename, "wt", encoding="utf-8") as fp:
+            fp.write(f"<html><body>{to_html(tables, top)}</body></html>")
+        return
+    stem, ext = os.path.splitext(filename)
+    if ext not in (".csv", ".parquet"):
+        raise click.BadParameter(f"{filename}: expected .html, .csv or .parquet")
+    for name, df in tables.items():
+        fname = f"{stem}-{name}{ext}"
+        if ext == ".csv":
+            df.to_csv(fname, index=False)
+        else:
+            df.to_parquet(fname, index=False)
+        click.secho(f"wrote {len(df)} rows to {fname}", fg="green")
@@ -0,0 +1,140 @@
+import heapq
+import random
+import time
+from datetime import datetime
+from typing import (
+    Dict,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from requests.exceptions import HTTPError
+
+from .cache import OfflineError
+from .engine import Wait
+
+K = TypeVar("K")
+
+# failures recorded in the metadata and ncbi_meta status columns
+FAILED = -2  # will be tried again after next_attempt
+DEAD = -3  # gave up after too many attempts
+
+
+class RetryQueue(Generic[K]):
+    """Schedule items that failed to be tried again with exponential backoff.
+
+    :meth:`items` hands out batches of fresh keys interleaved with any
+    failed keys whose backoff has expired and, once the fresh keys run
+    out, waits for the stragglers. A key that has failed
+    ``max_attempts`` times is dropped (dead-lettered).
+
+    With ``defer`` failed keys aren't retried in this run but collected
+    in :attr:`deferred` (key -> delay) for the caller to reschedule,
+    e.g. as jobs that fall due later.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        max_attempts: int = 8,
+        base: float = 30.0,
+        factor: float = 2.0,
+        max_delay: float = 3600.0,
+        defer: bool = False,
+    ):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+        self.heap: List[Tuple[float, int, K]] = []
+        self.seq = 0
+        self.inflight = 0
+        self.defer = defer
+        self.deferred: Dict[K, float] = {}
+
+    def delay(self, attempts: int) -> float:
+        d = min(self.base * self.factor ** (attempts - 1), self.max_delay)
+        # jitter so that a batch that failed together spreads out
+        return d * random.uniform(0.75, 1.0)
+
+    def schedule(self, key: K, attempts: int) -> Optional[float]:
+        """Queue ``key`` after its ``attempts``-th failure.
+
+        Returns the delay before it is tried again or None if it is dead.
+        """
+        if attempts >= self.max_attempts:
+            return None
+        d = self.delay(attempts)
+        if self.defer:
+            self.deferred[key] = d
+            return d
+        self.seq += 1
+        heapq.heappush(self.heap, (time.monotonic() + d, self.seq, key))
+        return d
+
+    def finished(self, _batch: List[K]):
+        """Call once a batch handed out by :meth:`items` has been dealt with."""
+        self.inflight -= 1
+
+    def ready(self) -> List[K]:
+        now = time.monotonic()
+        batch = []
+        while self.heap and self.heap[0][0] <= now and len(batch) < self.batch_size:
+            batch.append(heapq.heappop(self.heap)[2])
+        return batch
+
+    def items(self, fresh: Iterable[K]) -> Iterator[Union[List[K], Wait]]:
+        from .ncbi import chunks
+
+        it = chunks(fresh, self.batch_size)
+        while True:
+            batch = self.ready() or next(it, None)
+            if batch:
+                self.inflight += 1
+                yield batch
+                continue
+            if not self.heap and self.inflight == 0:
+                return
+            # nothing to do until a retry falls due or a batch in flight fails
+            wait = self.heap[0][0] - time.monotonic() if self.heap else 1.0
+            yield Wait(min(max(wait, 0.1), 5.0))
+
+    def __len__(self):
+        return len(self.heap)
+
+
+def retryable(exc: BaseException) -> bool:
+    """Whether trying again later could help.
+
+    Not if we are offline and nothing is cached or the server rejected
+    the request itself (a 4xx other than 429 Too Many Requests).
+    """
+    if isinstance(exc, OfflineError):
+        return False
+    if isinstance(exc, HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+        return not (400 <= status < 500 and status != 429)
+    return True
+
+
+def due(table, now: Optional[datetime] = None):
+    """Rows of ``table`` that failed and are ready to be tried again."""
+    from sqlalchemy import and_, null, or_
+
+    now = now or datetime.utcnow()
+    return and_(
+        table.c.status == FAILED,
+        or_(table.c.next_attempt == null(), table.c.next_attempt <= now),
+    )
+
+
+def attempts_so_far(rows: Iterable[Tuple[K, Optional[int]]]) -> Dict[K, int]:
+    """{key: attempts} for rows that failed before (older rows have no count)."""
+    return {key: attempts or 1 for key, attempts in rows}
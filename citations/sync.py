@@ -0,0 +1,287 @@
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+import click
+
+BATCH_SIZE = 1000
+FIELDS = ["doi", "pubmed", "title", "year"]
+# publications.title is a VARCHAR(256)
+TITLE_LENGTH = 256
+
+
+def mongo_batches(
+    url: str,
+    since: Optional[str] = None,
+    updated_field: Optional[str] = None,
+    updated_since: Optional[Any] = None,
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[List[dict]]:
+    """Stream publications from mongo in ``batch_size`` lists.
+
+    Only documents with an ``_id`` past ``since`` (or, if the collection
+    has one, an ``updated_field`` past ``updated_since``) are read.
+    """
+    from bson import ObjectId
+    from pymongo import MongoClient
+
+    c = MongoClient(url)
+    mdb = c.get_default_database()
+    clauses: List[Dict[str, Any]] = []
+    if since:
+        clauses.append({"_id": {"$gt": ObjectId(since)}})
+    if updated_field and updated_since is not None:
+        clauses.append({updated_field: {"$gt": updated_since}})
+    query = {"$or": clauses} if since else {}
+    projection = FIELDS + ([updated_field] if updated_field else [])
+    cursor = mdb.publications.find(query, projection=projection).batch_size(batch_size)
+    batch = []
+    try:
+        for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        cursor.close()
+        c.close()
+
+
+def to_rows(docs: List[dict]) -> List[dict]:
+    import pandas as pd
+
+    from .citations import canonical_dois
+
+    df = pd.DataFrame.from_records(docs, columns=["_id"] + FIELDS)
+    df["mongo_id"] = df["_id"].astype(str)
+    df["doi"] = canonical_dois(df.doi.where(df.doi.notna() & (df.doi != ""), None))
+    df["pubmed"] = df.pubmed.where(df.pubmed.notna() & (df.pubmed != ""), None)
+    df["pubmed"] = [None if p is None else str(p) for p in df.pubmed]
+    df["year"] = pd.to_numeric(df.year, errors="coerce").astype("Int64")
+    df["title"] = [t[:TITLE_LENGTH] if isinstance(t, str) else None for t in df.title]
+    df = df.drop(columns=["_id"]).astype(object).where(df.notna(), None)
+    return df.to_dict(orient="records")
+
+
+class SyncResult:
+    def __init__(self):
+        self.read = 0
+        self.added = 0
+        self.changed = 0
+        self.doi_changed = 0
+        self.adopted = 0
+
+    def __str__(self):
+        return (
+            f"read {self.read}, added {self.added}, changed {self.changed}"
+            f" ({self.doi_changed} new dois), matched {self.adopted} old rows"
+        )
+
+
+def sync_publications(
+    db, batches: Iterator[List[dict]], require: str = "doi"
+) -> SyncResult:
+    """Merge mongo publications into the publications table.
+
+    Documents are streamed into a temporary staging table and diffed
+    against publications there: rows we already have (by ``mongo_id``)
+    pick up DOI/PMID/title/year changes, rows from before we kept
+    ``mongo_id`` are matched by DOI or PMID and new rows are added
+    unless their DOI or PMID is already present. Only documents with
+    a ``require`` field ("doi" or "pubmed") are added.
+
+    A changed DOI resets ``ncitations`` so the publication is scanned again.
+    """
+    from sqlalchemy import (
+        Column,
+        Integer,
+        MetaData,
+        String,
+        Table,
+        and_,
+        case,
+        exists,
+        func,
+        literal,
+        null,
+        or_,
+    )
+
+    p = db.publications
+    staging = Table(
+        "publications_staging",
+        MetaData(),
+        Column("mongo_id", String(24), primary_key=True),
+        Column("doi", String(256)),
+        Column("pubmed", String(16)),
+        Column("title", String(TITLE_LENGTH)),
+        Column("year", Integer),
+        prefixes=["TEMPORARY"],
+    )
+    s = staging.alias("s")
+    res = SyncResult()
+
+    with db.engine.begin() as conn:
+        staging.create(bind=conn)
+        try:
+            for docs in batches:
+                rows = to_rows(docs)
+                db.copy_rows(conn, staging, rows)
+                res.read += len(rows)
+            if not res.read:
+                return res
+
+            def sub(col, *where):
+                return db.select([col]).where(and_(*where)).limit(1).as_scalar()
+
+            # rows loaded before we recorded mongo_id
+            p2 = p.alias("p2")
+            for key in ["doi", "pubmed"]:
+                match = and_(s.c[key] == p.c[key], s.c[key].isnot(None))
+                claimed = exists().where(p2.c.mongo_id == s.c.mongo_id)
+                r = conn.execute(
+                    p.update()  # pylint: disable=no-value-for-parameter
+                    .values(mongo_id=sub(s.c.mongo_id, match, ~claimed))
+                    .where(p.c.mongo_id.is_(None))
+                    .where(exists().where(match).where(~claimed))
+                )
+                res.adopted += r.rowcount
+
+            same = s.c.mongo_id == p.c.mongo_id
+            new_doi = and_(s.c.doi.isnot(None), s.c.doi.is_distinct_from(p.c.doi))
+            changed = or_(
+                new_doi,
+                s.c.pubmed.is_distinct_from(p.c.pubmed),
+                s.c.title.is_distinct_from(p.c.title),
+                s.c.year.is_distinct_from(p.c.year),
+            )
+            res.doi_changed = conn.execute(
+                db.select([func.count()])
+                .select_from(p)
+                .where(exists().where(same).where(new_doi))
+            ).scalar()
+            # a new doi means new citations: scan again
+            rescan = exists().where(same).where(new_doi)
+            r = conn.execute(
+                p.update()  # pylint: disable=no-value-for-parameter
+                .values(
+                    doi=func.coalesce(sub(s.c.doi, same), p.c.doi),
+                    pubmed=sub(s.c.pubmed, same),
+                    title=sub(s.c.title, same),
+                    year=sub(s.c.year, same),
+                    ncitations=case([(rescan, -1)], else_=p.c.ncitations),
+                    last_checked=case([(rescan, null())], else_=p.c.last_checked),
+                )
+                .where(exists().where(same).where(changed))
+            )
+            res.changed = r.rowcount
+
+            # only the first document (by _id) for each doi/pubmed
+            s2 = staging.alias("s2")
+            first = and_(
+                *[
+                    ~exists().where(
+                        and_(s2.c[key] == s.c[key], s2.c.mongo_id < s.c.mongo_id)
+                    )
+                    for key in ["doi", "pubmed"]
+                ]
+            )
+            have = exists().where(
+                or_(
+                    p.c.mongo_id == s.c.mongo_id,
+                    and_(s.c.doi.isnot(None), p.c.doi == s.c.doi),
+                    and_(s.c.pubmed.isnot(None), p.c.pubmed == s.c.pubmed),
+                )
+            )
+            q = db.select(
+                [
+                    s.c.mongo_id,
+                    s.c.doi,
+                    s.c.pubmed,
+                    s.c.title,
+                    s.c.year,
+                    literal(-1),
+                ]
+            ).where(and_(s.c[require].isnot(None), first, ~have))
+            r = conn.execute(
+                p.insert().from_select(
+                    ["mongo_id", "doi", "pubmed", "title", "year", "ncitations"], q
+                )
+            )
+            res.added = r.rowcount
+        finally:
+            staging.drop(bind=conn)
+    return res
+
+
+def sync_from_mongo(
+    db,
+    url: str,
+    require: str = "doi",
+    full: bool = False,
+    updated_field: Optional[str] = None,
+    batch_size: int = BATCH_SIZE,
+    full_every: Optional[timedelta] = None,
+) -> SyncResult:
+    """Incrementally sync mongo publications at ``url`` into ``db``.
+
+    The largest ``_id`` (and ``updated_field`` value) seen is kept in the
+    ``sync_state`` table so the next run only reads documents added (or
+    updated) since. ``full`` reads the whole collection again.
+
+    Without an ``updated_field`` only new documents are seen, not edits
+    to old ones, so a full sync is done anyway if the last one was longer
+    than ``full_every`` ago.
+    """
+    from bson import json_util
+
+    # don't keep passwords in the database
+    name = "mongo:" + re.sub(r"//[^@/]*@", "//", url)
+    if not full and not updated_field and full_every is not None:
+        last = db.get_mark(name + ":full")
+        if (
+            last is None
+            or datetime.utcnow() - datetime.fromisoformat(last) >= full_every
+        ):
+            click.secho(
+                "mongo sync: reading every publication to pick up edits"
+                " (use --updated-field to see them incrementally)",
+                fg="yellow",
+            )
+            full = True
+    started = datetime.utcnow()
+    since = None if full else db.get_mark(name)
+    updated_since = None
+    if updated_field and not full:
+        u = db.get_mark(name + ":updated")
+        updated_since = json_util.loads(u) if u else None
+
+    marks: Dict[str, Any] = {}
+
+    def track(batches):
+        for docs in batches:
+            for doc in docs:
+                oid = str(doc["_id"])
+                if oid > marks.get("_id", ""):
+                    marks["_id"] = oid
+                u = doc.get(updated_field) if updated_field else None
+                if u is not None and (marks.get("u") is None or u > marks["u"]):
+                    marks["u"] = u
+            yield docs
+
+    if since is None:
+        # rows from older versions are matched on their (canonical) DOI
+        db.migrate_publication_dois()
+    batches = mongo_batches(url, since, updated_field, updated_since, batch_size)
+    res = sync_publications(db, track(batches), require=require)
+    # only move the marks on once the publications have been committed
+    if "_id" in marks:
+        db.set_mark(name, max(marks["_id"], since or ""))
+    if "u" in marks:
+        db.set_mark(name + ":updated", json_util.dumps(marks["u"]))
+    if since is None:
+        db.set_mark(name + ":full", started.isoformat())
+    click.secho(f"mongo sync: {res}", fg="green")
+    return res
@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics
+from .cache import OfflineError, ResponseCache
+from .governor import throttled
+
+# pylint: disable=line-too-long
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.101 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml,application/json;q=0.9,*/*;q=0.8",
+}
+# https://ncbiinsights.ncbi.nlm.nih.gov/2017/11/02/new-api-keys-for-the-e-utilities/
+API_KEY = os.environ.get("NCBI_API_KEY")
+
+# (connect, read) timeouts in seconds
+TIMEOUT: Union[float, Tuple[float, float]] = (10.0, 60.0)
+# connection level retries (DNS failures, refused/reset connections, read timeouts)
+RETRIES = 3
+# keep-alive connections kept per host
+POOLSIZE = 16
+
+# on-disk response cache (None to disable)
+CACHE_PATH: Optional[str] = os.environ.get("CITATIONS_CACHE", "citations-cache.db")
+# only serve responses from the cache
+OFFLINE = False
+
+_session: Optional[requests.Session] = None
+_cache: Optional[ResponseCache] = None
+_lock = threading.Lock()
+
+
+def configure(
+    timeout: Optional[float] = None,
+    api_key: Optional[str] = None,
+    retries: Optional[int] = None,
+    cache: Optional[str] = None,
+    no_cache: bool = False,
+    offline: Optional[bool] = None,
+):
+    # pylint: disable=global-statement
+    global TIMEOUT, API_KEY, RETRIES, CACHE_PATH, OFFLINE, _session, _cache
+    if timeout is not None:
+        TIMEOUT = timeout
+    if api_key is not None:
+        API_KEY = api_key
+    if retries is not None:
+        RETRIES = retries
+        _session = None  # rebuild adapters
+    if cache is not None or no_cache:
+        CACHE_PATH = None if no_cache else cache
+        _cache = None
+    if offline is not None:
+        OFFLINE = offline
+
+
+def get_session() -> requests.Session:
+    """The shared session: pooled keep-alive connections per host."""
+    global _session  # pylint: disable=global-statement
+    with _lock:
+        if _session is None:
+            retry = Retry(
+                total=RETRIES,
+                connect=RETRIES,
+                read=RETRIES,
+                # HTTP status codes are left to the rate governor
+                status=0,
+                backoff_factor=0.5,
+                allowed_methods=frozenset(["GET", "POST"]),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=POOLSIZE, pool_maxsize=POOLSIZE, max_retries=retry
+            )
+            s = requests.Session()
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            s.headers["Accept-Encoding"] = "gzip, deflate"
+            _session = s
+        return _session
+
+
+def get_cache() -> Optional[ResponseCache]:
+    global _cache  # pylint: disable=global-statement
+    with _lock:
+        if _cache is None and CACHE_PATH:
+            _cache = ResponseCache(CACHE_PATH)
+        return _cache
+
+
+def request(
+    method: str,
+    url: str,
+    params: Optional[Dict[str, Any]] = None,
+    data: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, str]] = None,
+    session: Optional[requests.Session] = None,
+    cache: Optional[str] = None,
+    refresh: bool = False,
+) -> requests.Response:
+    """Send a request through the shared session and the host's rate governor.
+
+    If ``cache`` names a source (see :data:`citations.cache.TTLS`) successful
+    responses are kept in the on-disk cache and served from there while fresh.
+    ``refresh`` skips the cached response (unless offline) and replaces it.
+    """
+    endpoint = cache or urlparse(url).netloc
+    c = get_cache() if cache else None
+    if c is not None:
+        key = c.key(method, url, params, data)
+    if c is not None and (OFFLINE or not refresh):
+        resp = c.get(key, cache, offline=OFFLINE)
+        if resp is not None:
+            metrics.inc("cache_hits_total", endpoint=endpoint)
+            return resp
+    if OFFLINE:
+        raise OfflineError(f"offline and no cached response for {url}")
+
+    s = session or get_session()
+
+    def send():
+        start = time.perf_counter()
+        try:
+            r = s.request(
+                method, url, params=params, data=data, headers=headers, timeout=TIMEOUT
+            )
+        except requests.RequestException:
+            metrics.request(endpoint, time.perf_counter() - start, error=True)
+            raise
+        metrics.request(
+            endpoint, time.perf_counter() - start, len(r.content), r.status_code
+        )
+        return r
+
+    resp = throttled(url, send)
+    if c is not None and resp.status_code == 200:
+        c.put(key, cache, resp)
+    return resp
+
+
+def cached_records(source: str, idents: Iterable[str]) -> Dict[str, bytes]:
+    """The records (e.g. EFetch articles by PMID) of ``source`` that are in the cache.
+
+    Callers send a batched request for the rest only and hand the
+    records in its response to :func:`cache_records`.
+    """
+    c = get_cache()
+    if c is None:
+        return {}
+    ret = c.get_records(source, idents, offline=OFFLINE)
+    if ret:
+        metrics.inc("cache_hits_total", len(ret), endpoint=source)
+    return ret
+
+
+def cache_records(source: str, records: Dict[str, bytes]):
+    c = get_cache()
+    if c is not None:
+        c.put_records(source, records)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
@@ -18,6 +18,8 @@ setup(
     packages=find_packages(),
     # include_package_data=True,
     install_requires=req,
+    # PostgreSQL (bulk loads use COPY)
+    extras_require={"postgresql": ["psycopg2>=2.8"]},
     entry_points="""
         [console_scripts]
         citations=citations.__main__:cli
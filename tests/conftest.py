@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+# a scratch PostgreSQL database: every table in it is dropped before each test
+PG = os.environ.get("CITATIONS_TEST_PG")
+
+
+def drop_all(url: str):
+    from sqlalchemy import MetaData, create_engine
+
+    engine = create_engine(url)
+    meta = MetaData()
+    meta.reflect(bind=engine)
+    meta.drop_all(bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def db(request, tmp_path):
+    """An empty database on each backend (PostgreSQL only if CITATIONS_TEST_PG is set)."""
+    from citations.citations import initdb
+
+    if request.param == "sqlite":
+        url = f"sqlite:///{tmp_path / 'citations.db'}"
+    else:
+        if not PG:
+            pytest.skip("set CITATIONS_TEST_PG to test against PostgreSQL")
+        url = PG
+        drop_all(url)
+    db = initdb(url)
+    yield db
+    db.engine.dispose()
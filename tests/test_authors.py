@@ -0,0 +1,95 @@
+from citations.authors import backfill, orcid, store_authors
+
+
+def record(pubmed, *authors):
+    return dict(pubmed=pubmed, title=f"title {pubmed}", authors=list(authors))
+
+
+SMITH_ORCID = "0000-0002-1825-0097"
+UWA = dict(affiliation="UWA, Perth", grid="grid.1012.2", isni="0000 0004 1936 7910")
+SMITH = dict(
+    lastname="Smith",
+    forename="Jo",
+    initials="J",
+    orcid=f"https://orcid.org/{SMITH_ORCID}",
+    affiliations=[UWA],
+)
+JONES = dict(lastname="Jones", forename="Al", initials="A", affiliation="Somewhere")
+
+
+def authors(db):
+    a = db.authors
+    q = db.select([a.c.pubmed, a.c.position, a.c.lastname, a.c.orcid])
+    return [tuple(r) for r in db.execute(q.order_by(a.c.pubmed, a.c.position))]
+
+
+def grids(db):
+    """Citing PMIDs per GRID (the query in the authors module docstring)."""
+    a, aa, af = db.authors, db.author_affiliations, db.affiliations
+    rows = db.execute(
+        "SELECT af.grid, count(DISTINCT a.pubmed) AS n"
+        f" FROM {a.name} a JOIN {aa.name} aa ON aa.author_id = a.id"
+        f" JOIN {af.name} af ON af.id = aa.affiliation_id"
+        " WHERE af.grid IS NOT NULL GROUP BY af.grid"
+    )
+    return {r.grid: r.n for r in rows}
+
+
+def test_orcid():
+    assert orcid("https://orcid.org/0000-0002-1825-009X") == "0000-0002-1825-009X"
+    assert orcid("not one") is None
+    assert orcid(None) is None
+
+
+def test_store_authors(db):
+    assert store_authors(db, [record("1", SMITH, JONES), record("2", SMITH)]) == 3
+    assert authors(db) == [
+        ("1", 0, "Smith", SMITH_ORCID),
+        ("1", 1, "Jones", None),
+        ("2", 0, "Smith", SMITH_ORCID),
+    ]
+    af = db.affiliations
+    rows = db.execute(db.select([af.c.name, af.c.grid, af.c.isni]).order_by(af.c.name))
+    # UWA is interned once
+    assert [tuple(r) for r in rows] == [
+        ("Somewhere", None, None),
+        ("UWA, Perth", "grid.1012.2", "0000000419367910"),
+    ]
+    assert grids(db) == {"grid.1012.2": 2}
+    # a record fetched again replaces its authors
+    assert store_authors(db, [record("1", JONES)]) == 1
+    assert authors(db) == [("1", 0, "Jones", None), ("2", 0, "Smith", SMITH_ORCID)]
+    assert grids(db) == {"grid.1012.2": 1}
+
+
+def test_backfill(db):
+    with db.engine.begin() as conn:
+        conn.execute(db.add_record, dict(pubmed="1", record=record("1", SMITH)))
+        # JSON written by older versions and not yet migrated
+        conn.execute(
+            db.ncbi_table.insert(),
+            dict(pubmed="2", status=1, data=record("2", JONES, SMITH)),
+        )
+        conn.execute(
+            db.meta_table.insert(),
+            dict(
+                doi="10.1/c",
+                pubmed="3",
+                source="ncbi",
+                status=1,
+                data=record("3", JONES),
+            ),
+        )
+    store_authors(db, [record("4", JONES)])
+    assert backfill(db, chunksize=1) == 4
+    assert [r[:3] for r in authors(db)] == [
+        ("1", 0, "Smith"),
+        ("2", 0, "Jones"),
+        ("2", 1, "Smith"),
+        ("3", 0, "Jones"),
+        ("4", 0, "Jones"),
+    ]
+    # only PMIDs without authors are looked at
+    assert backfill(db) == 0
+    assert backfill(db, rebuild=True) == 4
+    assert grids(db) == {"grid.1012.2": 2}
@@ -0,0 +1,39 @@
+import pandas as pd
+
+
+def pairs(db):
+    got = pd.read_sql_query(db.citations_query(), con=db.engine)
+    return sorted(zip(got.doi, got.citedby))
+
+
+def test_sync_citations_adds_and_removes(db):
+    with db.writer() as writer:
+        assert db.sync_citations("10.1/a", ["10.2/x", "10.2/y"], writer) == (2, 0)
+        assert db.sync_citations("10.1/b", ["10.2/x"], writer) == (1, 0)
+    assert pairs(db) == [
+        ("10.1/a", "10.2/x"),
+        ("10.1/a", "10.2/y"),
+        ("10.1/b", "10.2/x"),
+    ]
+    with db.writer() as writer:
+        # 10.2/x has gone (retracted) and 10.2/z is new
+        assert db.sync_citations("10.1/a", ["10.2/y", "10.2/z"], writer) == (1, 1)
+    assert pairs(db) == [
+        ("10.1/a", "10.2/y"),
+        ("10.1/a", "10.2/z"),
+        ("10.1/b", "10.2/x"),
+    ]
+    with db.writer() as writer:
+        assert db.sync_citations("10.1/a", ["10.2/z", "10.2/y"], writer) == (0, 0)
+        assert db.sync_citations("10.1/b", [], writer) == (0, 1)
+    assert pairs(db) == [("10.1/a", "10.2/y"), ("10.1/a", "10.2/z")]
+
+
+def test_duplicate_citations_are_ignored(db):
+    ids = db.intern(["10.1/a", "10.2/x"])
+    row = dict(doi_id=ids["10.1/a"], citedby_id=ids["10.2/x"])
+    with db.writer() as writer:
+        writer.execute(db.add_citation, [row, row])
+    with db.writer() as writer:
+        writer.execute(db.add_citation, row)
+    assert pairs(db) == [("10.1/a", "10.2/x")]
@@ -0,0 +1,77 @@
+import pytest
+
+from citations import codec
+from citations.codec import ZLIB, ZSTD, LazyRecord, decode, encode
+from citations.records import is_new, lookup
+
+RECORD = {
+    "pubmed": "1",
+    "title": "Title — with ünicode",
+    "year": 2020,
+    "authors": [{"lastname": "A", "affiliation": "x" * 200}],
+}
+
+
+@pytest.fixture(params=["zstd", "zlib"])
+def compressor(request, monkeypatch):
+    """Each codec: zstd, and zlib as if zstandard wasn't installed."""
+    if request.param == "zstd":
+        pytest.importorskip("zstandard")
+        return ZSTD
+    monkeypatch.setattr(codec, "_zstd", lambda: None)
+    return ZLIB
+
+
+def test_round_trip(compressor):
+    blob = encode(RECORD)
+    assert blob[:2] == bytes([codec.FORMAT_VERSION, compressor])
+    assert decode(blob) == RECORD
+
+
+def test_zlib_records_read_with_zstd_installed(monkeypatch):
+    pytest.importorskip("zstandard")
+    with monkeypatch.context() as m:
+        m.setattr(codec, "_zstd", lambda: None)
+        blob = encode(RECORD)
+    assert blob[1] == ZLIB
+    assert decode(blob) == RECORD
+
+
+def test_zstd_records_need_zstandard(monkeypatch):
+    pytest.importorskip("zstandard")
+    blob = encode(RECORD)
+    monkeypatch.setattr(codec, "_zstd", lambda: None)
+    with pytest.raises(RuntimeError, match="zstandard"):
+        decode(blob)
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        decode(bytes([99, ZLIB]))
+    with pytest.raises(ValueError):
+        decode(bytes([codec.FORMAT_VERSION, ord("?")]))
+
+
+def test_lazy_record():
+    rec = LazyRecord(encode(RECORD))
+    assert rec._record is None  # pylint: disable=protected-access
+    assert rec["title"] == RECORD["title"]
+    assert dict(rec) == RECORD and len(rec) == len(RECORD)
+
+
+def test_stored_records(db, compressor):
+    with db.writer() as writer:
+        writer.execute(
+            db.add_record,
+            [
+                dict(pubmed="1", record=RECORD),
+                # a record that was read back is stored as is
+                dict(pubmed="2", record=LazyRecord(encode(dict(RECORD, pubmed="2")))),
+            ],
+        )
+    got = lookup(db, ["1", "2", "3"])
+    assert sorted(got) == ["1", "2"]
+    assert all(isinstance(rec, LazyRecord) and not is_new(rec) for rec in got.values())
+    assert got["1"].blob[1] == compressor
+    assert dict(got["1"]) == RECORD
+    assert got["2"]["pubmed"] == "2"
@@ -0,0 +1,84 @@
+from citations.counts import Stale, refresh
+
+
+def cite(db, cited, citing):
+    with db.writer() as writer:
+        for doi, citedby in cited.items():
+            db.sync_citations(doi, citedby, writer)
+    ids = db.intern(list(cited) + list(citing))
+    rows = [
+        dict(doi=doi, doi_id=ids[doi], source="ncbi", status=1, year=year)
+        for doi, year in citing.items()
+    ]
+    with db.engine.begin() as conn:
+        conn.execute(db.meta_table.insert(), rows)
+    return ids
+
+
+def counts(db):
+    cc, cy, d = db.citation_counts, db.citation_years, db.dois
+    q = db.select([d.c.doi, cc.c.total, cc.c.dated]).select_from(
+        cc.join(d, d.c.id == cc.c.doi_id)
+    )
+    totals = {r.doi: (r.total, r.dated) for r in db.execute(q)}
+    q = db.select([d.c.doi, cy.c.year, cy.c.n]).select_from(
+        cy.join(d, d.c.id == cy.c.doi_id)
+    )
+    years = {(r.doi, r.year): r.n for r in db.execute(q)}
+    return totals, years
+
+
+CITED = {"10.1/a": ["10.2/x", "10.2/y", "10.2/z"], "10.1/b": ["10.2/x"]}
+# 10.2/z has no year
+CITING = {"10.2/x": 2020, "10.2/y": 2021, "10.2/z": None}
+
+
+def test_refresh_all(db):
+    cite(db, CITED, CITING)
+    assert refresh(db) == 2
+    assert counts(db) == (
+        {"10.1/a": (3, 2), "10.1/b": (1, 1)},
+        {("10.1/a", 2020): 1, ("10.1/a", 2021): 1, ("10.1/b", 2020): 1},
+    )
+
+
+def test_refresh_some(db):
+    ids = cite(db, CITED, CITING)
+    refresh(db)
+    m = db.meta_table
+    with db.engine.begin() as conn:
+        conn.execute(m.update().where(m.c.doi == "10.2/x").values(year=2019))
+        conn.execute(m.update().where(m.c.doi == "10.2/z").values(year=2019))
+    assert refresh(db, [ids["10.1/b"]]) == 1
+    # only 10.1/b is up to date
+    assert counts(db) == (
+        {"10.1/a": (3, 2), "10.1/b": (1, 1)},
+        {("10.1/a", 2020): 1, ("10.1/a", 2021): 1, ("10.1/b", 2019): 1},
+    )
+    refresh(db, [ids["10.1/a"], ids["10.1/b"]])
+    assert counts(db) == (
+        {"10.1/a": (3, 3), "10.1/b": (1, 1)},
+        {("10.1/a", 2019): 2, ("10.1/a", 2021): 1, ("10.1/b", 2019): 1},
+    )
+    # the same as recomputing everything
+    before = counts(db)
+    refresh(db)
+    assert counts(db) == before
+
+
+def test_stale(db):
+    ids = cite(db, CITED, CITING)
+    refresh(db)
+    with Stale(db) as stale, db.writer() as writer:
+        db.sync_citations("10.1/a", ["10.2/y"], writer)
+        stale.cited.add(ids["10.1/a"])
+        writer.execute(
+            db.meta_table.update().where(db.meta_table.c.doi == "10.2/x"),
+            dict(year=2018),
+        )
+        stale.citing.add(ids["10.2/x"])
+    # the citing 10.2/x is still cited by 10.1/b
+    assert counts(db) == (
+        {"10.1/a": (1, 1), "10.1/b": (1, 1)},
+        {("10.1/a", 2021): 1, ("10.1/b", 2018): 1},
+    )
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+import requests
+
+from citations import citations, governor, transport
+from citations.crossref import WORKS, fetch_crossref_batch
+
+# the works Crossref knows (it gives DOIs in its own case)
+WORKS_BY_DOI = {
+    "10.1/a": {"DOI": "10.1/A", "title": ["A"], "issued": {"date-parts": [[2019]]}},
+    "10.1/b": {"DOI": "10.1/b", "title": ["B"], "container-title": ["Journal"]},
+    "10.1/c,d": {"DOI": "10.1/c,d", "title": ["C,D"]},
+}
+
+
+class Crossref:
+    """Stands in for requests.Session: answers filter and single DOI queries."""
+
+    def __init__(self):
+        self.asked = []
+
+    def request(self, method, url, params=None, **kwargs):
+        r = requests.Response()
+        r.url = url
+        r.status_code = 200
+        if url == WORKS:
+            dois = [f[len("doi:") :] for f in params["filter"].split(",")]
+            assert params["rows"] == str(len(dois))
+            self.asked.append(dois)
+            items = [WORKS_BY_DOI[d.lower()] for d in dois if d.lower() in WORKS_BY_DOI]
+            message = {"items": items}
+        else:
+            doi = url[len(WORKS) + 1 :]
+            self.asked.append(doi)
+            message = WORKS_BY_DOI.get(doi.lower())
+            if message is None:
+                r.status_code = 404
+        content = json.dumps({"message": message})
+        r._content = content.encode()  # pylint: disable=protected-access
+        return r
+
+
+@pytest.fixture
+def crossref(monkeypatch):
+    """A fake Crossref behind the shared session, with no response cache."""
+    session = Crossref()
+    monkeypatch.setattr(transport, "CACHE_PATH", None)
+    monkeypatch.setattr(transport, "_cache", None)
+    monkeypatch.setattr(transport, "OFFLINE", False)
+    monkeypatch.setattr(transport, "get_session", lambda: session)
+    monkeypatch.setattr(governor, "_governors", {})
+    monkeypatch.setattr(governor, "_initial_rate", None)
+    return session
+
+
+def test_fetch_crossref_batch(crossref):
+    got = fetch_crossref_batch(
+        ["10.1/a", "10.1/B", "10.1/c,d", "10.1/e,f", "10.1/x"], "me@x"
+    )
+    # one filter query for the DOIs without commas and one request for each other
+    assert crossref.asked == [["10.1/a", "10.1/B", "10.1/x"], "10.1/c,d", "10.1/e,f"]
+    assert got["10.1/a"]["year"] == 2019 and got["10.1/a"]["doi"] == "10.1/A"
+    assert got["10.1/B"]["journal"] == "Journal"
+    assert got["10.1/c,d"]["title"] == "C,D"
+    assert got["10.1/e,f"] is None and got["10.1/x"] is None
+
+
+def test_docrossref(db, crossref):
+    dois = ["10.1/a", "10.1/b", "10.1/c,d", "10.1/x"]
+    ids = db.intern(dois + ["10.1/pubmed"])
+    m = db.meta_table
+    rows = [dict(doi=doi, doi_id=ids[doi], source="ncbi", status=-1) for doi in dois]
+    # found in PubMed so not asked for
+    rows.append(
+        dict(doi="10.1/pubmed", doi_id=ids["10.1/pubmed"], source="ncbi", status=1)
+    )
+    with db.engine.begin() as conn:
+        conn.execute(m.insert(), rows)
+    assert citations.docrossref(db, "me@x", 0.001, batch_size=2) == {}
+    # batches of DOIs in order; the one with a comma on its own
+    assert crossref.asked == [["10.1/a", "10.1/b"], ["10.1/x"], "10.1/c,d"]
+    q = db.select([m.c.doi, m.c.source, m.c.status, m.c.title, m.c.year])
+    rows = db.execute(q.order_by(m.c.doi))
+    assert [tuple(r) for r in rows] == [
+        ("10.1/a", "crossref", 1, "A", 2019),
+        ("10.1/b", "crossref", 1, "B", None),
+        ("10.1/c,d", "crossref", 1, "C,D", None),
+        ("10.1/pubmed", "ncbi", 1, None, None),
+        # Crossref doesn't know it either: not asked again
+        ("10.1/x", "crossref", -1, None, None),
+    ]
+    crossref.asked.clear()
+    assert citations.docrossref(db, "me@x", 0.001) == {}
+    assert crossref.asked == []
@@ -0,0 +1,62 @@
+import pandas as pd
+import pytest
+from sqlalchemy import inspect
+
+from citations import citations
+
+# as long as the widest DOI columns allow
+LONG_DOI = "10.1/" + "x" * 251
+
+
+@pytest.fixture
+def copies(monkeypatch):
+    """The tables pg_copy_insert has loaded (it is only used on PostgreSQL)."""
+    loaded = []
+    copy = citations.pg_copy_insert
+
+    def spy(table, conn, keys, data_iter):
+        loaded.append(table.name)
+        copy(table, conn, keys, data_iter)
+
+    monkeypatch.setattr(citations, "pg_copy_insert", spy)
+    return loaded
+
+
+def test_copy_rows(db, copies):
+    p = db.publications
+    rows = [
+        dict(doi=LONG_DOI, mongo_id=None, pubmed="1", title="", year=2020),
+        dict(
+            doi="10.1/b", mongo_id="a" * 24, pubmed=None, title='a "b", c\nd', year=None
+        ),
+    ]
+    with db.engine.begin() as conn:
+        db.copy_rows(conn, p, rows)
+    assert copies == (["publications"] if db.is_postgres else [])
+    q = db.select([p.c.doi, p.c.mongo_id, p.c.pubmed, p.c.title, p.c.year])
+    got = sorted(tuple(r) for r in db.execute(q.order_by(p.c.doi)))
+    # NULLs stay NULL and empty strings stay empty
+    assert got == sorted(
+        tuple(r[k] for k in ["doi", "mongo_id", "pubmed", "title", "year"])
+        for r in rows
+    )
+
+
+def test_bulk_load(db, copies):
+    df = pd.DataFrame({"doi": [LONG_DOI, "10.1/a"]})
+    db.bulk_load(df, "dois")
+    assert copies == (["dois"] if db.is_postgres else [])
+    got = {r.doi for r in db.execute(db.select([db.dois.c.doi]))}
+    assert got == {LONG_DOI, "10.1/a"}
+
+
+def test_doi_columns(db):
+    for table in ["dois", "publications", "metadata"]:
+        columns = {c["name"]: c["type"] for c in inspect(db.engine).get_columns(table)}
+        assert columns["doi"].length == 256, table
+    # PostgreSQL would reject a DOI longer than the column
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.meta_table.insert(), dict(doi=LONG_DOI, source="ncbi", status=-1)
+        )
+    assert db.execute(db.select([db.meta_table.c.doi]))[0].doi == LONG_DOI
@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+
+from citations.citations import canonical_dois, fixdoi
+
+DOIS = [
+    "10.1093/JXB/ERA123",
+    "  10.1093/jxb/era123 ",
+    "https://doi.org/10.1104/pp.19.00001",
+    "http://dx.doi.org/10.1104/PP.19.00001",
+    "doi:10.1111/tpj.14000",
+    "10.1002/%28SICI%291097-0134",
+    "10.1016/S0092-8674(00)80000-0",
+]
+
+
+@pytest.mark.parametrize("doi", DOIS)
+def test_fixdoi(doi):
+    assert fixdoi(doi) == fixdoi(fixdoi(doi))
+    assert fixdoi(doi) == fixdoi(doi).lower()
+    assert fixdoi(doi).startswith("10.")
+
+
+def test_canonical_dois_is_vectorized_fixdoi():
+    got = canonical_dois(pd.Series(DOIS + [None]))
+    assert list(got[:-1]) == [fixdoi(doi) for doi in DOIS]
+    assert got.iloc[-1] is None or pd.isna(got.iloc[-1])
+    assert got[2] == got[3] == "10.1104/pp.19.00001"
+    assert got[5] == "10.1002/(sici)1097-0134"
+
+
+def test_intern(db):
+    ids = db.intern(["10.1/a", "10.1/b"])
+    assert len(set(ids.values())) == 2
+    assert db.intern(["10.1/b", "10.1/c"])["10.1/b"] == ids["10.1/b"]
+
+    # another process (with an empty cache) gets the same ids
+    db._doi_ids.clear()  # pylint: disable=protected-access
+    assert db.intern(["10.1/a", "10.1/b"]) == ids
+
+    many = [f"10.1/{i}" for i in range(1200)]
+    got = db.intern(many)
+    assert sorted(got) == sorted(many)
+    assert len(set(got.values())) == len(many)
+    assert db.count(db.dois) == 1203
+
+
+def test_intern_series(db):
+    s = pd.Series(["10.1/a", None, "10.1/a", "10.1/b"])
+    ids = db.intern_series(s)
+    assert ids[0] == ids[2] != ids[3]
+    assert pd.isna(ids[1])
+
+
+def test_update_citations(db):
+    df = pd.DataFrame(
+        dict(
+            doi=["10.1/A", "10.1/a", "10.1/a"],
+            citedby=["10.2/x", "10.2/X", "https://doi.org/10.2/y"],
+        )
+    )
+    db.update_citations(df)
+    db.update_citations(df)
+    got = pd.read_sql_query(db.citations_query(), con=db.engine)
+    assert sorted(zip(got.doi, got.citedby)) == [
+        ("10.1/a", "10.2/x"),
+        ("10.1/a", "10.2/y"),
+    ]
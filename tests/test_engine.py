@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+from citations.engine import Wait, run_concurrently
+
+
+class Fetcher:
+    """A blocking fetch that records how many calls overlap."""
+
+    def __init__(self, seconds=0.01, fail=()):
+        self.seconds = seconds
+        self.fail = set(fail)
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.most = 0
+
+    def __call__(self, item):
+        with self.lock:
+            self.inflight += 1
+            self.most = max(self.most, self.inflight)
+        try:
+            time.sleep(self.seconds)
+            if item in self.fail:
+                raise ValueError(item)
+            return item * 2
+        finally:
+            with self.lock:
+                self.inflight -= 1
+
+
+@pytest.mark.parametrize("concurrency", [1, 3, 8])
+def test_results(concurrency):
+    fetch = Fetcher(seconds=0.05)
+    results = {}
+    threads = set()
+
+    def on_result(item, result, exc):
+        assert exc is None
+        threads.add(threading.get_ident())
+        results[item] = result
+
+    run_concurrently(range(16), fetch, on_result, concurrency=concurrency)
+    assert results == {i: i * 2 for i in range(16)}
+    assert fetch.most == concurrency
+    # the database writes in on_result rely on this
+    assert threads == {threading.get_ident()}
+
+
+def test_fetch_errors_reach_on_result():
+    fetch = Fetcher(fail={3, 5})
+    errors = {}
+    results = {}
+
+    def on_result(item, result, exc):
+        if exc is not None:
+            errors[item] = exc
+        else:
+            results[item] = result
+
+    run_concurrently(range(10), fetch, on_result, concurrency=4)
+    assert sorted(errors) == [3, 5]
+    assert all(isinstance(e, ValueError) for e in errors.values())
+    assert sorted(results) == [0, 1, 2, 4, 6, 7, 8, 9]
+
+
+def test_errors_propagate():
+    fetch = Fetcher(seconds=0.05, fail={2})
+    seen = []
+
+    def on_result(item, result, exc):
+        if exc is not None:
+            raise exc
+        seen.append(item)
+
+    start = time.monotonic()
+    with pytest.raises(ValueError):
+        run_concurrently(range(1000), fetch, on_result, concurrency=4)
+    # the run stops rather than working through everything else
+    assert time.monotonic() - start < 2
+    assert len(seen) < 20
+
+
+def test_items_errors_propagate():
+    def items():
+        yield from range(3)
+        raise RuntimeError("no more")
+
+    with pytest.raises(RuntimeError):
+        run_concurrently(items(), Fetcher(), lambda *args: None, concurrency=2)
+
+
+def test_wait():
+    fetch = Fetcher(seconds=0)
+    done = []
+    start = time.monotonic()
+    run_concurrently(
+        [1, Wait(0.2), 2], fetch, lambda item, *_: done.append(item), concurrency=1
+    )
+    assert done == [1, 2]
+    assert time.monotonic() - start >= 0.2
@@ -0,0 +1,97 @@
+import pandas as pd
+import pytest
+
+from citations.codec import hot_columns
+from citations.export import export
+
+RECORD = {
+    "pubmed": "1",
+    "year": 2020,
+    "title": "a title",
+    "journal": "J",
+    "doi": "10.1/a",
+    "pmc": "PMC1",
+    "authors": [
+        {"lastname": "Smith", "affiliation": "UWA", "orcid": ""},
+        {"lastname": "Jones", "affiliation": "", "orcid": "0000-0001"},
+    ],
+}
+
+
+@pytest.fixture
+def meta(db):
+    ids = db.intern(["10.1/a", "10.1/b"])
+    with db.engine.begin() as conn:
+        conn.execute(db.records.insert(), dict(pubmed="1", record=RECORD))
+        conn.execute(
+            db.meta_table.insert(),
+            [
+                # no record: the first chunk has nothing to flatten
+                dict(
+                    doi="10.1/b",
+                    doi_id=ids["10.1/b"],
+                    pubmed=None,
+                    source="ncbi",
+                    status=-1,
+                    **hot_columns(None),
+                ),
+                dict(
+                    doi="10.1/a",
+                    doi_id=ids["10.1/a"],
+                    pubmed="1",
+                    source="ncbi",
+                    status=1,
+                    **hot_columns(RECORD),
+                ),
+            ],
+        )
+    return db
+
+
+@pytest.mark.parametrize("ext", [".csv", ".csv.gz", ".csv.xz", ".parquet"])
+def test_dump_flatten(meta, tmp_path, ext):
+    if ext == ".parquet":
+        pytest.importorskip("pyarrow")
+    filename = str(tmp_path / f"metadata{ext}")
+    # one row per chunk
+    assert export(meta, "metadata", filename, chunksize=1, flat=True) == 2
+    df = pd.read_parquet(filename) if ext == ".parquet" else pd.read_csv(filename)
+    assert "record" not in df.columns and "data" not in df.columns
+    df = df.set_index("doi")
+    a, b = df.loc["10.1/a"], df.loc["10.1/b"]
+    assert (a.year, a.journal, a.pmc, a.n_authors) == (2020, "J", "PMC1", 2)
+    assert (a.first_author, a.ncbi_doi) == ("Smith", "10.1/a")
+    assert bool(a.has_affiliation) and bool(a.has_orcid)
+    assert pd.isna(b.journal) and pd.isna(b.n_authors)
+
+
+def test_flatten_fills_in_older_rows(meta, tmp_path):
+    # written before the hot columns existed
+    with meta.engine.begin() as conn:
+        conn.execute(meta.meta_table.update().values(year=None, journal=None))
+    filename = str(tmp_path / "metadata.csv")
+    export(meta, "metadata", filename, flat=True, where="status = 1")
+    df = pd.read_csv(filename)
+    assert (df.year[0], df.journal[0]) == (2020, "J")
+
+
+def test_dump_record_as_json(meta, tmp_path):
+    filename = str(tmp_path / "metadata.csv")
+    export(meta, "metadata", filename, columns=["doi", "record"], where="status = 1")
+    df = pd.read_csv(filename)
+    assert list(df.columns) == ["doi", "record"]
+    assert list(df.doi) == ["10.1/a"]
+    assert pd.io.json.loads(df.record[0])["authors"][0]["lastname"] == "Smith"
+
+
+def test_tocsv(db, tmp_path):
+    with db.writer() as writer:
+        db.sync_citations("10.1/a", ["10.2/x", "10.2/y"], writer)
+    filename = str(tmp_path / "citations.parquet")
+    pytest.importorskip("pyarrow")
+    assert export(db, "citations", filename, chunksize=1) == 2
+    df = pd.read_parquet(filename)
+    assert sorted(zip(df.doi, df.citedby)) == [
+        ("10.1/a", "10.2/x"),
+        ("10.1/a", "10.2/y"),
+    ]
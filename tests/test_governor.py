@@ -0,0 +1,74 @@
+import pytest
+
+from citations import governor, transport
+from citations.governor import MIN_RATE, NCBI_HOST, RateGovernor
+
+
+@pytest.fixture
+def fresh(monkeypatch):
+    monkeypatch.setattr(governor, "_governors", {})
+    monkeypatch.setattr(governor, "_initial_rate", None)
+    monkeypatch.setattr(governor, "_share", 1)
+    monkeypatch.setattr(governor, "MAX_RATE", None)
+
+
+def test_backoff_halves_down_to_the_floor():
+    gov = RateGovernor(5.0, 5.0)
+    rates = []
+    for _ in range(5):
+        gov.backoff()
+        rates.append(gov.rate)
+    assert rates == [2.5, 1.25, 0.625, MIN_RATE, MIN_RATE]
+
+
+def test_recovers_in_proportion_to_the_max_rate():
+    for max_rate in [3.0, 5.0, 20.0]:
+        gov = RateGovernor(max_rate, max_rate)
+        for _ in range(10):
+            gov.backoff()
+        assert gov.rate == MIN_RATE
+        n = 0
+        while gov.rate < max_rate:
+            gov.success()
+            n += 1
+        # the same number of successes whatever the host's limit
+        assert n <= 20
+        assert gov.rate == max_rate
+
+
+def test_floor_never_exceeds_max_rate():
+    gov = RateGovernor(0.2, 0.2)
+    gov.backoff()
+    assert gov.rate == 0.2
+
+
+@pytest.mark.usefixtures("fresh")
+def test_ncbi_limit(monkeypatch):
+    monkeypatch.setattr(transport, "API_KEY", None)
+    assert governor.limits(NCBI_HOST) == (3.0, 3.0)
+    gov = governor.governor(f"https://{NCBI_HOST}/entrez/eutils/efetch.fcgi")
+    for _ in range(100):
+        gov.success()
+    assert gov.rate == 3.0
+
+
+@pytest.mark.usefixtures("fresh")
+def test_ncbi_limit_with_api_key(monkeypatch):
+    monkeypatch.setattr(transport, "API_KEY", "secret")
+    assert governor.limits(NCBI_HOST) == (3.0, 10.0)
+    gov = governor.governor(f"https://{NCBI_HOST}/entrez/eutils/efetch.fcgi")
+    for _ in range(100):
+        gov.success()
+    assert gov.rate == 10.0
+
+
+@pytest.mark.usefixtures("fresh")
+def test_max_rate_override():
+    # localhost is limited like any other host...
+    assert governor.limits("127.0.0.1:8765") == governor.DEFAULT_LIMIT
+    gov = governor.governor("http://127.0.0.1:8765/oc/10.1/a")
+    # ...unless the limits are lifted (CITATIONS_MAX_RATE)
+    governor.configure(0.001, max_rate=1000.0)
+    assert governor.limits("127.0.0.1:8765") == (1.0, 1000.0)
+    assert gov.max_rate == 1000.0 and gov.rate == 1000.0
+    assert governor.limits(NCBI_HOST) == (3.0, 1000.0)
@@ -0,0 +1,135 @@
+from collections import Counter
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from citations.graph import CitationGraph, doi_ids
+
+
+def by_count(items):
+    return sorted(items, key=lambda kv: (-kv[1], kv[0]))
+
+
+def random_graph(seed):
+    rng = np.random.default_rng(seed)
+    cited = rng.integers(0, 60, 2000) + 5
+    citing = rng.integers(1000, 1300, 2000)
+    edges = sorted(set(zip(cited.tolist(), citing.tolist())))
+    cites = {}
+    refs = {}
+    for p, c in edges:
+        cites.setdefault(p, set()).add(c)
+        refs.setdefault(c, set()).add(p)
+    g = CitationGraph(np.array([e[0] for e in edges]), np.array([e[1] for e in edges]))
+    return g, cites, refs
+
+
+@pytest.fixture(params=[0, 1, 2])
+def graph(request):
+    return random_graph(request.param)
+
+
+def pairs(ids, counts):
+    return list(zip(ids.tolist(), counts.tolist()))
+
+
+def test_cocited(graph):
+    g, cites, _ = graph
+    for p in list(cites)[:10]:
+        expect = [
+            (q, len(cites[p] & cites[q]))
+            for q in cites
+            if q != p and cites[p] & cites[q]
+        ]
+        assert pairs(*g.cocited(p, 5)) == by_count(expect)[:5]
+    assert pairs(*g.cocited(-1)) == []
+
+
+def test_coupled(graph):
+    g, _, refs = graph
+    for c in list(refs)[:10]:
+        expect = [
+            (q, len(refs[c] & refs[q])) for q in refs if q != c and refs[c] & refs[q]
+        ]
+        assert pairs(*g.coupled(c, 5)) == by_count(expect)[:5]
+
+
+def test_citers(graph):
+    g, _, refs = graph
+    expect = by_count((c, len(r)) for c, r in refs.items())
+    assert pairs(*g.top_citers(7)) == expect[:7]
+    multi = [kv for kv in expect if kv[1] >= 9]
+    assert pairs(*g.multi_citers(9)) == multi
+    assert pairs(*g.multi_citers(9, 3)) == multi[:3]
+    among = {5, 6, 7}
+    expect = by_count((c, len(r & among)) for c, r in refs.items() if r & among)
+    assert pairs(*g.top_citers(7, among=among)) == expect[:7]
+
+
+def test_cocited_pairs(graph):
+    g, _, refs = graph
+    expect = Counter()
+    for r in refs.values():
+        expect.update(combinations(sorted(r), 2))
+    x, y, n = g.cocited_pairs(10)
+    got = list(zip(zip(x.tolist(), y.tolist()), n.tolist()))
+    assert got == by_count(expect.items())[:10]
+    # pylint: disable=protected-access
+    x, y, n = g._cocited_pairs_numpy(10)
+    assert list(zip(zip(x.tolist(), y.tolist()), n.tolist())) == got
+
+
+def add_citations(db):
+    df = pd.DataFrame(
+        dict(
+            doi=["10.1/a", "10.1/a", "10.1/b", "10.1/c"],
+            citedby=["10.2/x", "10.2/y", "10.2/x", "10.2/x"],
+        )
+    )
+    db.update_citations(df)
+
+
+def test_load(db):
+    add_citations(db)
+    ids = db.intern(["10.1/a", "10.1/b", "10.1/c", "10.2/x", "10.2/y"])
+    g = CitationGraph.load(db, chunksize=2)
+    assert g.nedges == 4
+    assert pairs(*g.cocited(ids["10.1/a"])) == by_count(
+        [(ids["10.1/b"], 1), (ids["10.1/c"], 1)]
+    )
+    assert pairs(*g.top_citers(1)) == [(ids["10.2/x"], 3)]
+
+
+def test_doi_ids(db):
+    add_citations(db)
+    ids = db.intern(["10.1/a", "10.1/c"])
+    # in the order given, without the unknown ones
+    got = doi_ids(db, ["10.1/c", "10.1/unknown", "10.1/a"])
+    assert list(got.items()) == [("10.1/c", ids["10.1/c"]), ("10.1/a", ids["10.1/a"])]
+
+
+def test_graph_command(db, tmp_path, monkeypatch):
+    from click.testing import CliRunner
+
+    from citations import citations, config
+
+    monkeypatch.setattr(config, "DATABASE", str(db.engine.url))
+    add_citations(db)
+    out = tmp_path / "cocited.csv"
+    r = CliRunner().invoke(citations.graph, ["cocited", "10.1/A", "-o", str(out)])
+    assert r.exit_code == 0, r.output
+    got = pd.read_csv(out)
+    assert sorted(zip(got.doi, got.cocitations)) == [("10.1/b", 1), ("10.1/c", 1)]
+    r = CliRunner().invoke(citations.graph, ["citers", "-k", "1"])
+    assert r.exit_code == 0, r.output
+    assert "10.2/x" in r.output and "10.2/y" not in r.output
+    r = CliRunner().invoke(citations.graph, ["cocited", "10.1/unknown"])
+    assert r.exit_code != 0 and "unknown DOI" in r.output
+    # each unknown DOI is named, even alongside known ones
+    r = CliRunner().invoke(citations.graph, ["citers", "10.1/a", "10.1/u", "10.1/v"])
+    assert r.exit_code != 0 and "unknown DOI(s): 10.1/u 10.1/v" in r.output
+    r = CliRunner().invoke(citations.graph, ["multi", "--at-least", "1", "-k", "1"])
+    assert r.exit_code == 0, r.output
+    assert "10.2/x" in r.output and "10.2/y" not in r.output
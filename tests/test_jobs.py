@@ -0,0 +1,139 @@
+from datetime import timedelta
+
+import pytest
+
+from citations.jobs import (
+    DONE,
+    LEASED,
+    PENDING,
+    claim,
+    finish,
+    heartbeat,
+    populate,
+    retry_later,
+    waiting,
+    work,
+)
+from citations.retry import RetryQueue
+
+
+def add_scan_jobs(db, n=5):
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.publications.insert(),
+            [dict(doi=f"10.1/{i}", ncitations=-1) for i in range(n)]
+            + [dict(doi="10.1/done", ncitations=3)],
+        )
+    return populate(db, "scan")
+
+
+def statuses(db):
+    j = db.jobs
+    return {r.key: r for r in db.execute(db.select([j]))}
+
+
+def test_populate_is_idempotent(db):
+    assert add_scan_jobs(db) == 5
+    assert populate(db, "scan") == 0
+    assert sorted(statuses(db)) == [f"10.1/{i}" for i in range(5)]
+
+
+def test_claims_are_disjoint(db):
+    add_scan_jobs(db)
+    a = claim(db, "scan", "a", 3)
+    b = claim(db, "scan", "b", 3)
+    assert len(a) == 3 and len(b) == 2
+    assert not set(a) & set(b)
+    assert claim(db, "scan", "c", 3) == {}
+    rows = statuses(db)
+    assert all(r.status == LEASED and r.attempts == 1 for r in rows.values())
+    assert {rows[k].owner for k in a.values()} == {"a"}
+
+
+def test_expired_leases_are_reclaimed(db):
+    add_scan_jobs(db, 2)
+    claim(db, "scan", "a", 2, lease=timedelta(seconds=-1))
+    got = claim(db, "scan", "b", 5)
+    assert len(got) == 2
+    assert all(r.owner == "b" and r.attempts == 2 for r in statuses(db).values())
+
+
+def test_heartbeat_keeps_leases(db):
+    add_scan_jobs(db, 2)
+    claim(db, "scan", "a", 2, lease=timedelta(seconds=-1))
+    assert heartbeat(db, "a") == 2
+    assert claim(db, "scan", "b", 5) == {}
+
+
+def test_finish(db):
+    add_scan_jobs(db, 3)
+    jobs = claim(db, "scan", "a", 3)
+    ids = sorted(jobs)
+    finish(db, "a", ids[:1])
+    finish(db, "a", ids[1:2], status=PENDING)
+    # not ours
+    finish(db, "b", ids[2:])
+    rows = statuses(db)
+    assert rows[jobs[ids[0]]].status == DONE
+    assert rows[jobs[ids[1]]].status == PENDING
+    assert rows[jobs[ids[1]]].owner is None
+    assert rows[jobs[ids[2]]].status == LEASED
+    assert list(claim(db, "scan", "c", 5)) == [ids[1]]
+
+
+def test_retry_later(db):
+    add_scan_jobs(db, 2)
+    jobs = claim(db, "scan", "a", 2)
+    first, second = sorted(jobs)
+    retry_later(db, "a", {first: 3600, second: -1})
+    rows = statuses(db)
+    assert all(r.status == PENDING and r.owner is None for r in rows.values())
+    assert waiting(db, "scan")[0] == 1
+    # only the one that is due already
+    got = claim(db, "scan", "b", 5)
+    assert got == {second: jobs[second]}
+    assert statuses(db)[jobs[second]].next_attempt is None
+
+
+def test_work_hands_back_failed_keys(db):
+    add_scan_jobs(db, 4)
+    seen = []
+
+    def process(keys):
+        seen.extend(keys)
+        return {key: 600 for key in keys if key.endswith(("1", "3"))}
+
+    assert work(db, "scan", process, batch_size=3, owner="a") == 2
+    # each job was tried once and the failures weren't waited for
+    assert sorted(seen) == [f"10.1/{i}" for i in range(4)]
+    rows = statuses(db)
+    assert {k for k, r in rows.items() if r.status == DONE} == {"10.1/0", "10.1/2"}
+    assert {k for k, r in rows.items() if r.status == PENDING} == {"10.1/1", "10.1/3"}
+    assert all(r.next_attempt for r in rows.values() if r.status == PENDING)
+    assert waiting(db, "scan")[0] == 2
+
+
+def test_work_hands_back_batch_on_error(db):
+    add_scan_jobs(db, 2)
+
+    def process(keys):
+        raise RuntimeError(keys)
+
+    with pytest.raises(RuntimeError):
+        work(db, "scan", process, owner="a")
+    rows = statuses(db)
+    assert all(r.status == PENDING and r.owner is None for r in rows.values())
+
+
+def test_deferred_retries():
+    retry: RetryQueue[str] = RetryQueue(2, max_attempts=2, defer=True)
+    batches = retry.items(["a", "b", "c"])
+    assert next(batches) == ["a", "b"]
+    assert retry.schedule("a", 1) > 0
+    assert retry.schedule("b", 2) is None
+    retry.finished(["a", "b"])
+    # "a" isn't waited for
+    assert next(batches) == ["c"]
+    retry.finished(["c"])
+    assert next(batches, None) is None
+    assert list(retry.deferred) == ["a"]
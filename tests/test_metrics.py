@@ -0,0 +1,77 @@
+import json
+
+import pytest
+import requests
+
+from citations import metrics, transport
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    reg = metrics.Registry()
+    monkeypatch.setattr(metrics, "REGISTRY", reg)
+    return reg
+
+
+def counter(reg, name, **labels):
+    return reg.counters.get((name, tuple(sorted(labels.items()))), 0.0)
+
+
+class Session:
+    """Answers with the status code at the end of the URL."""
+
+    def request(self, method, url, **kwargs):
+        r = requests.Response()
+        r.status_code = int(url.rsplit("/", 1)[-1])
+        r.url = url
+        r._content = b"x" * 10  # pylint: disable=protected-access
+        return r
+
+
+def test_request_counters(registry, tmp_path, monkeypatch):
+    monkeypatch.setattr(transport, "CACHE_PATH", str(tmp_path / "cache.db"))
+    monkeypatch.setattr(transport, "_cache", None)
+    monkeypatch.setattr(transport, "OFFLINE", False)
+    s = Session()
+    for status in [200, 200, 404]:
+        transport.get(f"http://localhost/{status}", session=s, cache="opencitations")
+    transport._cache.close()  # pylint: disable=protected-access
+    ep = dict(endpoint="opencitations")
+    # the second 200 came from the cache
+    assert counter(registry, "requests_total", **ep) == 2
+    assert counter(registry, "request_errors_total", **ep) == 1
+    assert counter(registry, "cache_hits_total", **ep) == 1
+    assert counter(registry, "response_bytes_total", **ep) == 20
+    [row] = registry.summary()
+    assert row["endpoint"] == "opencitations" and row["requests_total"] == 2
+
+
+def test_db_write_counters(db, registry):
+    with db.writer() as writer:
+        writer.insert(db.dois, [dict(doi="10.1/a"), dict(doi="10.1/b")])
+        writer.insert(db.dois, dict(doi="10.1/c"))
+    assert counter(registry, "db_rows_written_total") == 3
+    h = registry.histograms[("db_write_seconds", (("op", "flush"),))]
+    assert h.count == 1
+    assert [name for name, _, _ in registry.timings()] == ["db_write_seconds flush"]
+
+
+def test_write(registry, tmp_path):
+    registry.inc("requests_total", endpoint="crossref")
+    registry.observe("request_seconds", 0.2, endpoint="crossref")
+    prom = tmp_path / "citations.prom"
+    metrics.write(str(prom))
+    lines = prom.read_text().splitlines()
+    assert 'citations_requests_total{endpoint="crossref"} 1' in lines
+    assert 'citations_request_seconds_bucket{endpoint="crossref",le="0.1"} 0' in lines
+    assert 'citations_request_seconds_bucket{endpoint="crossref",le="+Inf"} 1' in lines
+    assert 'citations_request_seconds_count{endpoint="crossref"} 1' in lines
+    log = tmp_path / "metrics.jsonl"
+    metrics.write(str(log))
+    metrics.write(str(log))
+    snapshots = [json.loads(line) for line in log.read_text().splitlines()]
+    assert len(snapshots) == 2
+    assert snapshots[0]["counters"] == [
+        dict(name="requests_total", labels=dict(endpoint="crossref"), value=1.0)
+    ]
+    assert snapshots[0]["histograms"][0]["p50"] == 0.25
@@ -0,0 +1,100 @@
+import pandas as pd
+import pytest
+from sqlalchemy import inspect, text
+
+from citations.citations import initdb
+
+
+def test_migrate_citations(db):
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP TABLE citation_counts"))
+        conn.execute(text("DROP TABLE citation_years"))
+        conn.execute(text("DROP TABLE citations"))
+        conn.execute(
+            text(
+                "CREATE TABLE citations"
+                " (id INTEGER PRIMARY KEY, doi VARCHAR(64), citedby VARCHAR(64))"
+            )
+        )
+        conn.execute(
+            text(
+                "INSERT INTO citations (id, doi, citedby) VALUES (:id, :doi, :citedby)"
+            ),
+            [
+                dict(id=1, doi="10.1/A", citedby="10.2/x"),
+                dict(id=2, doi="10.1/a", citedby="https://doi.org/10.2/X"),
+                dict(id=3, doi="10.1/a", citedby="10.2/y"),
+                dict(id=4, doi="10.1/b", citedby=None),
+            ],
+        )
+    db = initdb(str(db.engine.url))
+    db.migrate()
+    got = pd.read_sql_query(db.citations_query(), con=db.engine)
+    assert sorted(zip(got.doi, got.citedby)) == [
+        ("10.1/a", "10.2/x"),
+        ("10.1/a", "10.2/y"),
+    ]
+    assert not inspect(db.engine).has_table("citations_old")
+    assert not inspect(db.engine).has_table("citations_load")
+    c = db.citation_counts
+    assert [tuple(r) for r in db.execute(db.select([c.c.total]))] == [(2,)]
+
+
+def test_widens_columns(db):
+    if not db.is_postgres:
+        pytest.skip("SQLite doesn't enforce VARCHAR lengths")
+    with db.engine.begin() as conn:
+        conn.execute(text("ALTER TABLE metadata ALTER COLUMN doi TYPE VARCHAR(64)"))
+    db = initdb(str(db.engine.url))
+    columns = {c["name"]: c["type"] for c in inspect(db.engine).get_columns("metadata")}
+    assert columns["doi"].length == 256
+
+
+def test_adds_missing_indexes(db):
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_metadata_pmc"))
+        conn.execute(text("DROP INDEX ix_ncbi_meta_has_affiliation"))
+        conn.execute(text("DROP INDEX ix_ncbi_meta_title"))
+        conn.execute(text("DROP INDEX ix_metadata_n_authors"))
+    db = initdb(str(db.engine.url))
+    insp = inspect(db.engine)
+    for table, column in [
+        ("metadata", "pmc"),
+        ("metadata", "n_authors"),
+        ("ncbi_meta", "has_affiliation"),
+        ("ncbi_meta", "title"),
+    ]:
+        indexed = {c for ix in insp.get_indexes(table) for c in ix["column_names"]}
+        assert column in indexed, table
+
+
+def test_migrate_publication_dois(db):
+    from citations.sync import sync_publications
+
+    p = db.publications
+    with db.engine.begin() as conn:
+        conn.execute(
+            p.insert(),
+            [
+                dict(doi="10.1093/JXB/ERA123", pubmed=None, ncitations=4),
+                dict(doi="https://doi.org/10.1/B", pubmed="7", ncitations=2),
+                dict(doi="10.1/b", pubmed=None, ncitations=-1),
+                dict(doi="10.1/c", pubmed=None, ncitations=1),
+            ],
+        )
+    assert db.migrate_publication_dois() == 3
+    assert db.migrate_publication_dois() == 0
+    rows = db.execute(db.select([p.c.doi, p.c.pubmed, p.c.ncitations]).order_by(p.c.id))
+    assert [tuple(r) for r in rows] == [
+        ("10.1093/jxb/era123", None, 4),
+        ("10.1/b", "7", 2),
+        ("10.1/c", None, 1),
+    ]
+
+    docs = [
+        dict(_id=f"{1:024x}", doi="10.1093/JXB/ERA123", pubmed=None, title="t", year=1),
+        dict(_id=f"{2:024x}", doi="10.1/B", pubmed="7", title="t", year=1),
+    ]
+    res = sync_publications(db, iter([docs]))
+    assert (res.added, res.adopted, res.doi_changed) == (0, 2, 0)
+    assert db.npubs() == 3
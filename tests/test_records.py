@@ -0,0 +1,103 @@
+import json
+import re
+
+import pytest
+import requests
+
+from citations import authors, citations, governor, transport
+from citations.records import save
+
+ARTICLE = """<PubmedArticle><MedlineCitation><PMID Version="1">{pmid}</PMID>
+<Article><Journal><JournalIssue><PubDate><Year>2020</Year></PubDate></JournalIssue>
+</Journal><ArticleTitle>title {pmid}</ArticleTitle>
+<AuthorList><Author><LastName>Smith</LastName><Initials>J</Initials></Author>
+</AuthorList></Article></MedlineCitation>
+<PubmedData><ArticleIdList><ArticleId IdType="doi">10.1/{pmid}</ArticleId>
+</ArticleIdList></PubmedData></PubmedArticle>"""
+
+
+class NCBI:
+    """Stands in for requests.Session: answers EFetch and ESearch for any
+    PMID and its DOI 10.1/<pmid>, counting the PMIDs EFetch is asked for."""
+
+    def __init__(self):
+        self.efetched = []
+
+    def request(self, method, url, params=None, data=None, **kwargs):
+        args = params or data
+        r = requests.Response()
+        r.url = url
+        r.status_code = 200
+        if url.endswith("efetch.fcgi"):
+            ids = args["id"].split(",")
+            self.efetched.extend(ids)
+            articles = "".join(ARTICLE.format(pmid=i) for i in ids)
+            content = f"<PubmedArticleSet>{articles}</PubmedArticleSet>"
+        else:
+            dois = re.findall(r'"([^"]+)"\[DOI\]', args["term"])
+            pmids = [d.split("/")[1] for d in dois]
+            content = json.dumps({"esearchresult": {"idlist": pmids}})
+        r._content = content.encode()  # pylint: disable=protected-access
+        return r
+
+
+@pytest.fixture
+def ncbi(monkeypatch):
+    """A fake NCBI behind the shared session, with no response cache."""
+    session = NCBI()
+    monkeypatch.setattr(transport, "CACHE_PATH", None)
+    monkeypatch.setattr(transport, "_cache", None)
+    monkeypatch.setattr(transport, "OFFLINE", False)
+    monkeypatch.setattr(transport, "get_session", lambda: session)
+    monkeypatch.setattr(governor, "_governors", {})
+    monkeypatch.setattr(governor, "_initial_rate", None)
+    return session
+
+
+def stored(db):
+    r, a = db.records, db.authors
+    records = {row.pubmed for row in db.execute(db.select([r.c.pubmed]))}
+    names = {(row.pubmed, row.lastname) for row in db.execute(db.select([a]))}
+    return records, names
+
+
+def test_records_shared_between_commands(db, ncbi):
+    assert citations.doncbi(db, "me@x", 0.001, pmids=["1", "2"]) == {}
+    assert sorted(ncbi.efetched) == ["1", "2"]
+    assert stored(db) == ({"1", "2"}, {("1", "Smith"), ("2", "Smith")})
+
+    # the records fetched by ncbi-json aren't fetched again
+    ncbi.efetched.clear()
+    assert citations.dometadata(db, "me@x", 0.001, dois=["10.1/1", "10.1/3"]) == {}
+    assert ncbi.efetched == ["3"]
+    m = db.meta_table
+    rows = db.execute(db.select([m.c.doi, m.c.pubmed, m.c.title]).order_by(m.c.doi))
+    assert [tuple(r) for r in rows] == [
+        ("10.1/1", "1", "title 1"),
+        ("10.1/3", "3", "title 3"),
+    ]
+
+    ncbi.efetched.clear()
+    citations.addpublications(db, ["2", "3"], "me@x", 0.001)
+    assert ncbi.efetched == []
+    p = db.publications
+    rows = db.execute(db.select([p.c.pubmed, p.c.doi]).order_by(p.c.pubmed))
+    assert [tuple(r) for r in rows] == [("2", "10.1/2"), ("3", "10.1/3")]
+    assert stored(db)[0] == {"1", "2", "3"}
+
+
+@pytest.mark.usefixtures("ncbi")
+def test_save_with_authors(db, monkeypatch):
+    from citations.records import fetch_missing
+
+    records = fetch_missing(db, ["1"], "me@x")
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("crash")
+
+    # a failure writing the authors doesn't leave the record without them
+    monkeypatch.setattr(authors, "write_authors", fail)
+    with pytest.raises(RuntimeError):
+        with db.writer() as writer:
+            assert save(db, writer, records.values()) == 1
+    assert stored(db) == (set(), set())
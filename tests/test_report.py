@@ -0,0 +1,108 @@
+import pandas as pd
+import pytest
+
+from citations import report
+from citations.authors import store_authors
+from citations.counts import refresh
+
+SMITH = dict(lastname="Smith", initials="J", orcid="0000-0002-1825-0097")
+JONES = dict(lastname="Jones", initials="A")
+LEE = dict(lastname="Lee", initials="K")
+# DOI: (PMID, year, citations, authors)
+PUBS = {
+    "10.1/a": ("1", 2020, 12, [SMITH, JONES]),
+    "10.1/b": ("2", 2020, 3, [SMITH, LEE]),
+    "10.1/c": ("3", 2021, 1, [JONES]),
+    "10.1/d": (None, 2021, 0, []),
+}
+
+
+@pytest.mark.parametrize(
+    "citations, h, i10",
+    [
+        ([10, 8, 5, 4, 3], 4, 1),
+        ([3, 3, 3, 3], 3, 0),
+        ([25, 11], 2, 2),
+        ([0, 0], 0, 0),
+    ],
+)
+def test_impact(citations, h, i10):
+    df = pd.DataFrame({"who": "x", "citations": citations})
+    [row] = report.impact(df, "who").to_dict("records")
+    assert (row["publications"], row["citations"]) == (len(citations), sum(citations))
+    assert (row["h_index"], row["i10"]) == (h, i10)
+
+
+def populate(db):
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.publications.insert(),
+            [
+                dict(doi=doi, pubmed=pmid, year=year, ncitations=n)
+                for doi, (pmid, year, n, _) in PUBS.items()
+            ],
+        )
+    with db.writer() as writer:
+        for doi, (_, _, n, _) in PUBS.items():
+            db.sync_citations(doi, [f"10.2/{doi[-1]}{i}" for i in range(n)], writer)
+    # half of 10.1/a's citations are dated
+    citing = [f"10.2/a{i}" for i in range(6)]
+    ids = db.intern(citing)
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.meta_table.insert(),
+            [
+                dict(doi=doi, doi_id=ids[doi], source="ncbi", status=1, year=2022)
+                for doi in citing
+            ],
+        )
+    store_authors(
+        db,
+        [dict(pubmed=pmid, authors=a) for pmid, _, _, a in PUBS.values() if pmid],
+    )
+    refresh(db)
+
+
+def records(df):
+    return [tuple(r) for r in df.itertuples(index=False)]
+
+
+def test_report(db):
+    populate(db)
+    tables = report.report(report.load(db))
+    # 12, 3, 1, 0 citations
+    assert records(tables["summary"]) == [(4, 16, 2, 1, 4.0)]
+    assert records(tables["years"]) == [(2022, 6, 1)]
+    authors = tables["authors"][["name", "publications", "citations", "h_index"]]
+    assert records(authors) == [
+        ("Smith J", 2, 15, 2),
+        ("Jones A", 2, 13, 1),
+        ("Lee K", 1, 3, 1),
+    ]
+    assert tables["authors"].author[0] == SMITH["orcid"]
+    labs = tables["labs"][["lab", "year", "publications", "citations", "h_index"]]
+    assert records(labs) == [
+        ("Jones A", 2020, 1, 12, 1),
+        ("Jones A", 2021, 1, 1, 1),
+        ("Lee K", 2020, 1, 3, 1),
+    ]
+
+
+def test_cached_load(db, tmp_path, monkeypatch):
+    populate(db)
+    cache = str(tmp_path / "cache")
+    first = report.cached_load(db, cache)
+    loads = []
+    load = report.load
+    monkeypatch.setattr(report, "load", lambda db: loads.append(1) or load(db))
+    again = report.cached_load(db, cache)
+    assert loads == []
+    assert records(again["pubs"]) == records(first["pubs"])
+    # new citations change the fingerprint
+    with db.writer() as writer:
+        db.sync_citations("10.1/d", ["10.2/new"], writer)
+    refresh(db)
+    got = report.cached_load(db, cache)
+    assert loads == [1]
+    assert got["pubs"].set_index("doi").citations["10.1/d"] == 1
+    assert len(list((tmp_path / "cache").iterdir())) == 1
@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+
+import pytest
+import requests
+
+from citations import citations, transport
+from citations.cache import OfflineError
+from citations.engine import Wait
+from citations.retry import DEAD, FAILED, RetryQueue, attempts_so_far, due, retryable
+
+
+def test_backoff_grows_and_is_capped():
+    q = RetryQueue(10, max_attempts=20, base=1.0, factor=2.0, max_delay=8.0)
+    for attempts, top in [(1, 1.0), (2, 2.0), (3, 4.0), (4, 8.0), (10, 8.0)]:
+        d = q.delay(attempts)
+        assert 0.75 * top <= d <= top
+
+
+def test_dead_after_max_attempts():
+    q = RetryQueue(10, max_attempts=3, base=0.01)
+    assert q.schedule("a", 1) is not None
+    assert q.schedule("b", 2) is not None
+    assert q.schedule("c", 3) is None
+    assert len(q) == 2
+
+
+def test_items_retries_failed_keys():
+    q = RetryQueue(2, max_attempts=3, base=0.01, max_delay=0.01)
+    attempts = {}
+    seen = []
+    for item in q.items(["a", "b", "c"]):
+        if isinstance(item, Wait):
+            assert item.seconds <= 5.0
+            continue
+        seen.append(item)
+        for key in item:
+            # "b" always fails
+            if key == "b":
+                attempts[key] = attempts.get(key, 0) + 1
+                q.schedule(key, attempts[key])
+        q.finished(item)
+    assert seen[:2] == [["a", "b"], ["c"]]
+    assert sorted(k for batch in seen for k in batch).count("b") == 3
+    assert attempts == {"b": 3}
+
+
+def test_items_waits_for_batches_in_flight():
+    q = RetryQueue(2, base=0.01)
+    it = q.items(["a"])
+    assert next(it) == ["a"]
+    # the batch hasn't finished so it might still fail and come back
+    assert isinstance(next(it), Wait)
+    q.finished(["a"])
+    assert list(it) == []
+
+
+def test_attempts_so_far():
+    assert attempts_so_far([("a", None), ("b", 3)]) == {"a": 1, "b": 3}
+
+
+def test_due(db):
+    n = db.ncbi_table
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(
+            n.insert(),
+            [
+                dict(pubmed="1", status=FAILED, next_attempt=None),
+                dict(pubmed="2", status=FAILED, next_attempt=now - timedelta(1)),
+                dict(pubmed="3", status=FAILED, next_attempt=now + timedelta(1)),
+                dict(pubmed="4", status=1, next_attempt=None),
+            ],
+        )
+    rows = db.execute(db.select([n.c.pubmed]).where(due(n, now)))
+    assert sorted(r.pubmed for r in rows) == ["1", "2"]
+
+
+def http_error(status):
+    resp = requests.Response()
+    resp.status_code = status
+    return requests.HTTPError(f"{status}", response=resp)
+
+
+def test_retryable():
+    assert retryable(requests.ConnectionError())
+    assert retryable(http_error(429))
+    assert retryable(http_error(503))
+    assert not retryable(http_error(400))
+    assert not retryable(http_error(404))
+    assert not retryable(OfflineError("not cached"))
+
+
+@pytest.fixture
+def offline(monkeypatch, tmp_path):
+    """Offline with an empty response cache."""
+    monkeypatch.setattr(transport, "CACHE_PATH", str(tmp_path / "cache.db"))
+    monkeypatch.setattr(transport, "_cache", None)
+    monkeypatch.setattr(transport, "OFFLINE", True)
+
+
+def test_offline_cache_misses_are_not_failures(db, offline):
+    with db.writer() as writer:
+        db.sync_citations("10.1/a", ["10.2/x", "10.2/y"], writer)
+    with db.engine.begin() as conn:
+        conn.execute(db.publications.insert(), dict(doi="10.1/a", pubmed="1"))
+        # not in PubMed so up for Crossref
+        conn.execute(
+            db.meta_table.insert(),
+            dict(
+                doi="10.2/y",
+                doi_id=db.intern(["10.2/y"])["10.2/y"],
+                source="ncbi",
+                status=-1,
+            ),
+        )
+    assert citations.dometadata(db, "a@b.c", 0, ntry=1, dois=["10.2/x"]) == {}
+    assert citations.docrossref(db, "a@b.c", 0, ntry=1) == {}
+    assert citations.doncbi(db, "a@b.c", 0, ntry=1) == {}
+    m, n = db.meta_table, db.ncbi_table
+    assert [tuple(r) for r in db.execute(db.select([m.c.source, m.c.status]))] == [
+        ("ncbi", -1)
+    ]
+    assert db.execute(db.select([n.c.pubmed])) == []
+    # and nothing was dead-lettered
+    for table in [m, n]:
+        q = db.select([table.c.status]).where(table.c.status.in_([FAILED, DEAD]))
+        assert db.execute(q) == []
@@ -0,0 +1,66 @@
+import json
+import os
+import subprocess
+import sys
+from importlib import import_module
+
+import pytest
+
+from citations import transport
+from citations.cli import COMMANDS, LOCAL_COMMANDS, cli
+
+# modules `citations --help` mustn't import: they make every command slow to start
+HEAVY = ["pandas", "numpy", "sqlalchemy", "lxml", "requests", "urllib3"]
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, sys
+from citations.cli import cli
+try:
+    cli.main(args=sys.argv[1:], prog_name="citations", standalone_mode=False)
+except SystemExit:
+    pass
+print(json.dumps(sorted({m.split(".")[0] for m in sys.modules})), file=sys.stderr)
+"""
+
+
+def imported(args):
+    """The top level modules a fresh ``citations *args`` has imported."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT] + sys.path))
+    r = subprocess.run(
+        [sys.executable, "-c", PROBE, *args],
+        capture_output=True,
+        text=True,
+        check=False,
+        cwd=ROOT,
+        env=env,
+    )
+    return set(json.loads(r.stderr.strip().splitlines()[-1]))
+
+
+@pytest.mark.parametrize("args", [["--help"], ["test-email", "--help"]])
+def test_light_startup(args):
+    assert sorted(imported(args) & set(HEAVY)) == []
+
+
+def test_registry():
+    """Every lazily listed command exists (with the same help) and vice versa."""
+    for module in {m for m, _ in COMMANDS.values()}:
+        import_module(module)
+    assert sorted(cli.commands) == sorted(COMMANDS)
+    for name, (_, short_help) in COMMANDS.items():
+        assert cli.commands[name].get_short_help_str(1000) == short_help, name
+    assert LOCAL_COMMANDS <= set(COMMANDS)
+
+
+def test_transport_options(monkeypatch):
+    from click.testing import CliRunner
+
+    for name in ["TIMEOUT", "API_KEY", "OFFLINE"]:
+        monkeypatch.setattr(transport, name, getattr(transport, name))
+    args = ["--timeout", "5", "--api-key", "k", "--offline"]
+    r = CliRunner().invoke(cli, [*args, "report", "--help"])
+    assert r.exit_code == 0 and transport.TIMEOUT != 5.0
+    r = CliRunner().invoke(cli, [*args, "scan", "--help"])
+    assert r.exit_code == 0
+    assert (transport.TIMEOUT, transport.API_KEY, transport.OFFLINE) == (5, "k", True)
@@ -0,0 +1,178 @@
+import json
+import re
+
+import pytest
+import requests
+
+from citations import transport
+from citations.crossref import fetch_crossref_batch
+from citations.ncbi import fetchncbi_batch, ncbi_fetchdois
+
+
+class Session:
+    """Stands in for requests.Session: answers with a counter."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        r = requests.Response()
+        r.status_code = 200
+        r.url = url
+        r._content = str(self.calls).encode()  # pylint: disable=protected-access
+        return r
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    monkeypatch.setattr(transport, "CACHE_PATH", str(tmp_path / "cache.db"))
+    monkeypatch.setattr(transport, "_cache", None)
+    monkeypatch.setattr(transport, "OFFLINE", False)
+    yield Session()
+    if transport._cache is not None:  # pylint: disable=protected-access
+        transport._cache.close()  # pylint: disable=protected-access
+
+
+def test_session(monkeypatch):
+    monkeypatch.setattr(transport, "_session", None)
+    monkeypatch.setattr(transport, "RETRIES", transport.RETRIES)
+    transport.configure(retries=5)
+    s = transport.get_session()
+    assert transport.get_session() is s
+    for url in ["https://api.crossref.org/works", "http://localhost/"]:
+        adapter = s.get_adapter(url)
+        retry = adapter.max_retries
+        assert (retry.total, retry.connect, retry.read, retry.status) == (5, 5, 5, 0)
+        assert retry.allowed_methods == {"GET", "POST"}
+        # pylint: disable=protected-access
+        assert adapter._pool_connections == transport.POOLSIZE
+        assert adapter._pool_maxsize == transport.POOLSIZE
+
+
+def test_timeout(monkeypatch):
+    sent = []
+
+    class Recorder(Session):
+        def request(self, method, url, **kwargs):
+            sent.append(kwargs["timeout"])
+            return super().request(method, url, **kwargs)
+
+    monkeypatch.setattr(transport, "TIMEOUT", transport.TIMEOUT)
+    transport.get("http://localhost/a", session=Recorder())
+    transport.configure(timeout=3.0)
+    transport.get("http://localhost/b", session=Recorder())
+    assert sent == [(10.0, 60.0), 3.0]
+
+
+def get(session, **kwargs):
+    url = "http://localhost/api/10.1/a"
+    return transport.get(url, session=session, cache="opencitations", **kwargs).text
+
+
+def test_cached(session):
+    assert get(session) == "1"
+    assert get(session) == "1"
+    assert session.calls == 1
+
+
+def test_refresh_goes_past_the_cache(session):
+    assert get(session) == "1"
+    assert get(session, refresh=True) == "2"
+    # and the cache now has the new response
+    assert get(session) == "2"
+    assert session.calls == 2
+
+
+def test_offline(session, monkeypatch):
+    get(session)
+    monkeypatch.setattr(transport, "OFFLINE", True)
+    assert get(session, refresh=True) == "1"
+    with pytest.raises(transport.OfflineError):
+        transport.get("http://localhost/other", session=session, cache="opencitations")
+
+
+ARTICLE = """<PubmedArticle><MedlineCitation><PMID Version="1">{pmid}</PMID>
+<Article><Journal><JournalIssue><PubDate><Year>2020</Year></PubDate></JournalIssue>
+</Journal><ArticleTitle>title {pmid}</ArticleTitle></Article></MedlineCitation>
+<PubmedData><ArticleIdList><ArticleId IdType="doi">10.1/{pmid}</ArticleId>
+</ArticleIdList></PubmedData></PubmedArticle>"""
+
+
+class NCBI(Session):
+    """Answers EFetch and ESearch for PMIDs below 100 and their DOIs 10.1/<pmid>."""
+
+    def __init__(self):
+        super().__init__()
+        self.asked = []
+
+    def request(self, method, url, **kwargs):
+        r = super().request(method, url, **kwargs)
+        args = kwargs.get("params") or kwargs.get("data")
+        if url.endswith("efetch.fcgi"):
+            ids = args["id"].split(",")
+            self.asked.append(ids)
+            articles = "".join(ARTICLE.format(pmid=i) for i in ids if int(i) < 100)
+            content = f"<PubmedArticleSet>{articles}</PubmedArticleSet>"
+            r._content = content.encode()  # pylint: disable=protected-access
+        else:
+            dois = re.findall(r'"([^"]+)"\[DOI\]', args["term"])
+            self.asked.append(dois)
+            pmids = [d.split("/")[1] for d in dois if int(d.split("/")[1]) < 100]
+            content = json.dumps({"esearchresult": {"idlist": pmids}})
+            r._content = content.encode()  # pylint: disable=protected-access
+        return r
+
+
+def test_efetch_cached_per_pmid(session, monkeypatch):
+    ncbi = NCBI()
+    got = fetchncbi_batch(["1", "2", "300"], "me@x", session=ncbi)
+    assert got["1"]["title"] == "title 1" and got["300"] is None
+    # a batch on different boundaries only asks for the new PMID
+    got = fetchncbi_batch(["2", "3", "300"], "me@x", session=ncbi)
+    assert got["3"]["title"] == "title 3" and got["300"] is None
+    assert ncbi.asked == [["1", "2", "300"], ["3"]]
+    monkeypatch.setattr(transport, "OFFLINE", True)
+    assert fetchncbi_batch(["1", "3"], "me@x", session=ncbi)["1"]["pubmed"] == "1"
+    with pytest.raises(transport.OfflineError):
+        fetchncbi_batch(["1", "4"], "me@x", session=ncbi)
+
+
+def test_esearch_cached_per_doi(session):
+    ncbi = NCBI()
+    got = ncbi_fetchdois(["10.1/1", "10.1/200"], "me@x", session=ncbi)
+    assert [d["pubmed"] for d in got["10.1/1"]] == ["1"] and got["10.1/200"] == []
+    got = ncbi_fetchdois(["10.1/200", "10.1/1", "10.1/2"], "me@x", session=ncbi)
+    assert [d["pubmed"] for d in got["10.1/2"]] == ["2"] and got["10.1/200"] == []
+    assert ncbi.asked == [["10.1/1", "10.1/200"], ["1"], ["10.1/2"], ["2"]]
+
+
+class Crossref(Session):
+    """Answers Crossref filter queries: it knows DOIs 10.1/<n> for n below 100."""
+
+    def __init__(self):
+        super().__init__()
+        self.asked = []
+
+    def request(self, method, url, **kwargs):
+        r = super().request(method, url, **kwargs)
+        dois = [f[len("doi:") :] for f in kwargs["params"]["filter"].split(",")]
+        self.asked.append(dois)
+        items = [
+            {"DOI": doi, "title": [f"title {doi}"]}
+            for doi in dois
+            if int(doi.split("/")[1]) < 100
+        ]
+        content = json.dumps({"message": {"items": items}})
+        r._content = content.encode()  # pylint: disable=protected-access
+        return r
+
+
+def test_crossref_cached_per_doi(session):
+    cr = Crossref()
+    got = fetch_crossref_batch(["10.1/1", "10.1/200"], "me@x", session=cr)
+    assert got["10.1/1"]["title"] == "title 10.1/1" and got["10.1/200"] is None
+    got = fetch_crossref_batch(["10.1/200", "10.1/1", "10.1/2"], "me@x", session=cr)
+    assert got["10.1/1"]["title"] == "title 10.1/1" and got["10.1/200"] is None
+    assert got["10.1/2"]["title"] == "title 10.1/2"
+    assert cr.asked == [["10.1/1", "10.1/200"], ["10.1/2"]]
@@ -0,0 +1,63 @@
+import pytest
+from sqlalchemy import bindparam
+
+
+def dois(db):
+    return sorted(r.doi for r in db.execute(db.select([db.dois.c.doi])))
+
+
+def test_nothing_written_until_flushed(db):
+    writer = db.writer(max_rows=3, max_wait=3600)
+    writer.insert(db.dois, [dict(doi="a"), dict(doi="b")])
+    assert dois(db) == []
+    writer.insert(db.dois, dict(doi="c"))
+    assert dois(db) == ["a", "b", "c"]
+    assert writer.nrows == 0
+
+
+def test_statements_run_in_the_order_first_seen(db):
+    d = db.dois
+    rename = (
+        d.update().where(d.c.doi == bindparam("b_old")).values(doi=bindparam("b_new"))
+    )
+    with db.writer() as writer:
+        writer.insert(d, dict(doi="a"))
+        # updates a row inserted in the same flush
+        writer.execute(rename, dict(b_old="a", b_new="x"))
+        # joins the earlier insert group so it is written before the update
+        writer.insert(d, dict(doi="b"))
+        writer.execute(rename, dict(b_old="b", b_new="y"))
+    assert dois(db) == ["x", "y"]
+
+
+def test_rows_with_different_keys_are_separate_groups(db):
+    with db.writer() as writer:
+        writer.insert(db.dois, [dict(doi="a"), dict(id=10, doi="b")])
+        assert len(writer.pending) == 2
+    rows = db.execute(db.select([db.dois.c.id, db.dois.c.doi]))
+    assert {r.doi: r.id for r in rows}["b"] == 10
+
+
+def test_flushed_on_exit_after_an_error(db):
+    with pytest.raises(KeyboardInterrupt):
+        with db.writer() as writer:
+            writer.insert(db.dois, dict(doi="a"))
+            raise KeyboardInterrupt
+    assert dois(db) == ["a"]
+
+
+def test_calls_share_the_flush_transaction(db):
+    seen = []
+
+    def read_back(conn):
+        seen.extend(r.doi for r in conn.execute(db.select([db.dois.c.doi])))
+        raise RuntimeError("crash")
+
+    writer = db.writer()
+    writer.insert(db.dois, dict(doi="a"))
+    writer.call(read_back)
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    # it saw the insert before it, which was then rolled back with it
+    assert seen == ["a"]
+    assert dois(db) == []